@@ -0,0 +1,329 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.reconcile import SynoACLReconciler
+from synoacl.snapshot import SynoACLSnapshot
+from synoacl.diff import SynoACLDiff
+from synoacl.job import SynoACLJournal
+
+FORMAT_VERSION = 1
+
+class BenchmarkSuite:
+    """Runs benchmarks and collects their results.
+
+    Each result records the best and the median time of a single run of the
+    measured operation (in seconds) and, for operations that run synoacltool
+    (against FakeSynoACLBackend), the number of invocations per subcommand.
+    """
+
+    def __init__(self, quick = False, only = None):
+        self.quick = quick
+        self.only = only
+        self.repeat = 3 if quick else 7
+        # the minimal time of a single repeat, the number of runs in a repeat is scaled to reach it
+        self.minTime = 0.01 if quick else 0.1
+        self.results = []
+
+    def sizes(self, sizes):
+        """Return the sizes to run with (the quick mode only uses the smaller ones)."""
+        return sizes[:2] if self.quick else sizes
+
+    def _selected(self, name):
+        return self.only is None or any(pattern in name for pattern in self.only)
+
+    def _record(self, name, params, times, number, calls):
+        times = sorted(times)
+        result = {
+            "name": name,
+            "params": params,
+            "best": times[0],
+            "median": times[len(times) // 2],
+            "repeat": len(times),
+            "number": number
+        }
+        if calls is not None:
+            result["calls"] = calls
+        self.results.append(result)
+
+    def measure(self, name, fn, params = {}, setup = None):
+        """Measure fn.
+
+        Without setup, fn() is run repeatedly. With setup, each run is
+        preceded by an (untimed) call of setup() and its return value is
+        passed to fn. If it's a FakeSynoACLBackend, the calls done by fn are
+        recorded.
+        """
+        if not self._selected(name):
+            return
+
+        if setup is None:
+            timer = timeit.Timer(fn)
+            number = 1
+            while timer.timeit(number) < self.minTime:
+                number *= 10
+            times = [t / number for t in timer.repeat(self.repeat, number)]
+            self._record(name, params, times, number, None)
+            return
+
+        times = []
+        calls = None
+        for i in range(self.repeat):
+            context = setup()
+            before = dict(context.calls) if isinstance(context, FakeSynoACLBackend) else None
+            start = timeit.default_timer()
+            fn(context)
+            times.append(timeit.default_timer() - start)
+            if before is not None:
+                calls = dict((command, count - before.get(command, 0)) for (command, count) in context.calls.items()
+                    if count != before.get(command, 0))
+        self._record(name, params, times, 1, calls)
+
+    def report(self):
+        return {
+            "format": FORMAT_VERSION,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "quick": self.quick,
+            "results": self.results
+        }
+
+def _acl(i, permissions = "rwxp---------"):
+    return "user:user" + str(i) + ":allow:" + permissions + ":fd--"
+
+def _getOutput(count):
+    lines = [ "ACL version: 1", "Archive: is_inherit,has_ACL,is_support_ACL", "Owner: [root(user)]", "---------------------" ]
+    for i in range(count):
+        lines.append("\t [" + str(i) + "] " + _acl(i) + " (level:" + str(i % 3) + ")")
+    return lines + [ "" ]
+
+def _adaptToData(count):
+    """Return (existing, desired) where a tenth of the entries is deleted, a tenth changed and a tenth added."""
+    existing = [SynoACL.fromString(_acl(i)) for i in range(count)]
+    tenth = max(1, count // 10)
+    desired = []
+    for i in range(tenth, count):
+        desired.append(SynoACL.fromString(_acl(i, "r------------" if i < 2 * tenth else "rwxp---------")))
+    desired += [SynoACL.fromString(_acl(count + i)) for i in range(tenth)]
+    return (existing, desired)
+
+def benchParsing(suite):
+    acls = [ "group:administrators:allow:rwxpdDaARWc--:fd--", "user:guest:deny:rwxpd--------:f-in", "owner:*:allow:r------------:----" ]
+    suite.measure("parse.SynoACL.fromString", lambda: [SynoACL.fromString(acl) for acl in acls], { "entries": len(acls) })
+    suite.measure("parse.SynoACL.intern", lambda: [SynoACL.intern(acl) for acl in acls], { "entries": len(acls) })
+    permissions = [ "rwxpdDaARWc--", "r------------", "rwxpdDaARWcCo" ]
+    suite.measure("parse.Permissions.fromString", lambda: [SynoACL.Permissions.fromString(p) for p in permissions], { "entries": len(permissions) })
+    archives = [ "is_inherit,has_ACL,is_support_ACL", "None", "is_inherit,is_read_only,is_owner_group,has_ACL,is_support_ACL" ]
+    suite.measure("parse.SynoACLArchive.fromString", lambda: [SynoACLArchive.fromString(a) for a in archives], { "entries": len(archives) })
+
+    for count in suite.sizes([ 10, 100, 1000, 10000 ]):
+        output = _getOutput(count)
+        suite.measure("parse.SynoACLTool._parseACLResult", lambda: SynoACLTool._parseACLResult(output), { "entries": count })
+
+def benchFormatting(suite):
+    strings = [ "group:administrators:allow:rwxpdDaARWc--:fd--", "user:guest:deny:rwxpd--------:f-in", "owner:*:allow:r------------:----" ]
+    acls = [SynoACL.fromString(acl) for acl in strings]
+    suite.measure("format.SynoACL.__str__", lambda: [str(acl) for acl in acls], { "entries": len(acls) })
+    interned = [SynoACL.intern(acl) for acl in strings]
+    suite.measure("format.SynoACL.__str__.interned", lambda: [str(acl) for acl in interned], { "entries": len(interned) })
+    permissions = [acl.permissions for acl in acls]
+    suite.measure("format.Permissions.__str__", lambda: [str(p) for p in permissions], { "entries": len(permissions) })
+    archives = [SynoACLArchive.fromString(a) for a in [ "is_inherit,has_ACL,is_support_ACL", "None",
+        "is_inherit,is_read_only,is_owner_group,has_ACL,is_support_ACL" ]]
+    suite.measure("format.SynoACLArchive.__str__", lambda: [str(a) for a in archives], { "entries": len(archives) })
+    suite.measure("format.SynoACLArchive.__eq__", lambda: [a == b for a in archives for b in archives], { "entries": len(archives) })
+
+    for count in suite.sizes([ 10, 100, 1000, 10000 ]):
+        operations = SynoACLTool.planAdaptTo(*_adaptToData(count))
+        suite.measure("format.SynoACLOperation.__str__", lambda: [str(operation) for operation in operations],
+            { "entries": len(operations) })
+
+def benchACLSet(suite):
+    for count in suite.sizes([ 10, 100, 1000, 10000 ]):
+        acls = [SynoACL.intern(_acl(i)) for i in range(count)]
+        levels = [i % 3 for i in range(count)]
+        suite.measure("set.SynoACLSet", lambda: SynoACLSet(acls, levels), { "entries": count })
+        aclSet = SynoACLSet(acls, levels)
+        suite.measure("set.SynoACLSet.__str__", lambda: str(aclSet), { "entries": count })
+        suite.measure("set.SynoACLSet.inherited", lambda: aclSet.inherited(True), { "entries": count })
+
+def benchAdaptTo(suite):
+    for count in suite.sizes([ 10, 100, 1000, 10000 ]):
+        (existing, desired) = _adaptToData(count)
+        suite.measure("plan.planAdaptTo", lambda: SynoACLTool.planAdaptTo(existing, desired), { "entries": count })
+    for count in suite.sizes([ 10, 100, 1000 ]):
+        (existing, desired) = _adaptToData(count)
+        suite.measure("plan.compilePolicy", lambda: SynoACLTool.compilePolicy(existing, desired), { "entries": count })
+
+    # applying the plan - one synoacltool call per operation
+    for count in suite.sizes([ 10, 100, 1000 ]):
+        (existing, desired) = _adaptToData(count)
+        def setup():
+            backend = FakeSynoACLBackend()
+            backend.makeDirectory("/share/dir", existing)
+            SynoACLTool.setExecutor(SynoACLExecutor(backend = backend))
+            return backend
+        suite.measure("tool.adaptTo", lambda backend: SynoACLTool.adaptTo("/share/dir", desired), { "entries": count }, setup)
+        suite.measure("tool.orderedAdaptTo", lambda backend: SynoACLTool.adaptTo("/share/dir", desired, ordered = True),
+            { "entries": count }, setup)
+
+def _treeSetup(width, depth):
+    def setup():
+        backend = FakeSynoACLBackend()
+        backend.makeTree("/share", width, depth)
+        backend.makeDirectory("/share", [ _acl(0) ], "is_support_ACL")
+        backend.makeDirectory("/share/d0", [ _acl(1) ])
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = backend))
+        return backend
+    return setup
+
+def benchTree(suite, tempDir):
+    (width, depth) = (4, 2) if suite.quick else (10, 3)
+    params = { "width": width, "depth": depth }
+    setup = _treeSetup(width, depth)
+
+    suite.measure("tree.walk", lambda backend: list(SynoACLTool.walk("/share")), params, setup)
+    suite.measure("tree.walk.deriveInherited", lambda backend: list(SynoACLTool.walk("/share", deriveInherited = True)), params, setup)
+
+    def reconcile(backend):
+        desired = [SynoACL.fromString(_acl(2))]
+        items = ((path, desired, None) for (path, depth, isDir) in
+            SynoACLTool.walkPaths("/share", (), None, False, False, None))
+        SynoACLReconciler.reconcileItems(items)
+    suite.measure("tree.reconcile", reconcile, params, setup)
+
+    oldFile = os.path.join(tempDir, "old.snapshot")
+    newFile = os.path.join(tempDir, "new.snapshot")
+    def snapshot(backend):
+        SynoACLSnapshot.create("/share", oldFile)
+    suite.measure("tree.snapshot", snapshot, params, setup)
+
+    def diffSetup():
+        backend = setup()
+        SynoACLSnapshot.create("/share", oldFile)
+        SynoACLTool.add("/share/d1", SynoACL.fromString(_acl(3)))
+        SynoACLSnapshot.create("/share", newFile)
+        return backend
+    suite.measure("tree.diffSnapshots", lambda backend: list(SynoACLDiff.diffSnapshots(oldFile, newFile)), params, diffSetup)
+    suite.measure("tree.diffSnapshotWithLive", lambda backend: list(SynoACLDiff.diffSnapshotWithLive(oldFile, "/share")), params, diffSetup)
+
+def benchJournal(suite, tempDir):
+    fileName = os.path.join(tempDir, "bench.journal")
+    for (count, syncEvery) in [ (1000, 1), (1000, 1000), (10000, 1000) ]:
+        def setup():
+            if os.path.exists(fileName):
+                os.remove(fileName)
+            return None
+        def write(context):
+            with SynoACLJournal(fileName, syncEvery = syncEvery) as journal:
+                for i in range(count):
+                    journal.markDone("/share/d" + str(i))
+        suite.measure("job.journal.markDone", write, { "entries": count, "syncEvery": syncEvery }, setup)
+
+def run(quick = False, only = None):
+    """Run all the benchmarks and return the report (a dict that can be dumped to JSON)."""
+    suite = BenchmarkSuite(quick, only)
+    executor = SynoACLTool.getExecutor()
+    cache = SynoACLTool.getCache()
+    tempDir = tempfile.mkdtemp()
+    try:
+        SynoACLTool.setCache(None)
+        benchParsing(suite)
+        benchFormatting(suite)
+        benchACLSet(suite)
+        benchAdaptTo(suite)
+        benchTree(suite, tempDir)
+        benchJournal(suite, tempDir)
+    finally:
+        SynoACLTool.setExecutor(executor)
+        SynoACLTool.setCache(cache)
+        shutil.rmtree(tempDir)
+    return suite.report()
+
+def _key(result):
+    return result["name"] + json.dumps(result["params"], sort_keys = True)
+
+def compare(baseline, current, threshold):
+    """Compare two reports.
+
+    Returns a list of lines describing the differences and a flag telling if
+    there is a regression: a benchmark slower by more than threshold (a
+    fraction) or doing more synoacltool calls.
+    """
+    baselineResults = dict((_key(result), result) for result in baseline["results"])
+    lines = []
+    regression = False
+    for result in current["results"]:
+        old = baselineResults.get(_key(result))
+        if old is None:
+            continue
+        ratio = result["best"] / old["best"] if old["best"] > 0 else 1.0
+        status = ""
+        if ratio > 1 + threshold:
+            status = " SLOWER"
+            regression = True
+        oldCalls = sum(old.get("calls", {}).values())
+        newCalls = sum(result.get("calls", {}).values())
+        if newCalls > oldCalls:
+            status += " MORE CALLS (" + str(oldCalls) + " -> " + str(newCalls) + ")"
+            regression = True
+        lines.append("%-40s %-30s %6.2fx%s" % (result["name"], json.dumps(result["params"], sort_keys = True), ratio, status))
+    return (lines, regression)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Run the synoacl benchmarks and print the results as JSON.")
+    parser.add_argument("--quick", action = "store_true", help = "use smaller inputs and fewer repeats")
+    parser.add_argument("--only", action = "append", help = "only run benchmarks whose name contains this (can be repeated)")
+    parser.add_argument("--output", help = "write the results to this file instead of the standard output")
+    parser.add_argument("--compare", help = "compare with the results in this file; exit with 1 on a regression")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "the slowdown (a fraction) considered a regression")
+    args = parser.parse_args(argv)
+
+    report = run(args.quick, args.only)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2, sort_keys = True)
+    else:
+        json.dump(report, sys.stdout, indent = 2, sort_keys = True)
+        sys.stdout.write("\n")
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        (lines, regression) = compare(baseline, report, args.threshold)
+        for line in lines:
+            sys.stderr.write(line + "\n")
+        return 1 if regression else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -28,14 +28,14 @@ setup(
 
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
 
-        "Programming Language :: Python :: 2",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.2",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
     ],
     keywords = "synology acl nas",
-    packages = find_packages(exclude = ["docs", "tests"]),
+    packages = find_packages(exclude = ["docs", "tests", "benchmarks"]),
+    python_requires = ">=3.10",
     test_suite = "tests",
 )
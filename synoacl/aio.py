@@ -0,0 +1,220 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import asyncio
+import locale
+import subprocess
+
+from synoacl.executor import SynoACLResult
+from synoacl.tool import SynoACLSet, SynoACLTool
+
+class AsyncSynoACLTool:
+    """An asyncio counterpart of SynoACLTool.
+
+    The methods mirror those of SynoACLTool but are coroutines that run
+    synoacltool with asyncio.create_subprocess_exec, so they don't block the
+    event loop. At most concurrency synoacltool processes run at once
+    (per instance); timeout (in seconds, None for no limit) applies to each
+    invocation. The output is parsed by the SynoACLTool parsers.
+
+    Note that this doesn't use SynoACLTool's executor nor its cache.
+    SynoACLTool.walk (and walkPaths) have no counterpart here: listing the
+    directories is blocking filesystem work - combine SynoACLTool.walkPaths
+    (e.g. in a thread) with getMany and getArchiveMany instead. iterGet
+    yields the entries only after synoacltool has finished.
+    """
+
+    DEFAULT_CONCURRENCY = 16
+
+    def __init__(self, command = "synoacltool", concurrency = DEFAULT_CONCURRENCY, timeout = None):
+        if concurrency < 1:
+            raise Exception("Concurrency must be at least 1, got: " + str(concurrency))
+        self.command = command
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # created on first use so that it belongs to the running event loop
+        self._semaphore = None
+
+    async def _execute(self, args):
+        """Run synoacltool and return (returncode, output)."""
+        process = await asyncio.create_subprocess_exec(self.command, *args, stdout = asyncio.subprocess.PIPE)
+        try:
+            (output, _) = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired([ self.command ] + args, self.timeout)
+        # the same as universal_newlines = True does for subprocess.check_output
+        output = output.decode(locale.getpreferredencoding(False)).replace("\r\n", "\n").replace("\r", "\n")
+        return (process.returncode, output)
+
+    async def _communicate(self, args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            (returncode, output) = await self._execute(args)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, [ self.command ] + args, output)
+        return output.split("\n")
+
+    async def _many(self, fn, paths, raiseErrors):
+        async def call(path):
+            try:
+                return SynoACLResult(path, value = await fn(path))
+            except Exception as e:
+                if raiseErrors:
+                    raise
+                return SynoACLResult(path, error = e)
+        return list(await asyncio.gather(*[call(path) for path in paths]))
+
+    async def get(self, path):
+        """See SynoACLTool.get."""
+        try:
+            return SynoACLTool._parseACLResult(await self._communicate(["-get", path]))
+        except subprocess.CalledProcessError:
+            # synoacltool fails for paths in "Linux mode", see SynoACLTool.get
+            return SynoACLSet([])
+
+    async def iterGet(self, path):
+        """Yield the ACL entries of path as (SynoACL, level), see SynoACLTool.iterGet.
+
+        Unlike SynoACLTool.iterGet, the whole output is read first.
+        """
+        try:
+            output = await self._communicate(["-get", path])
+        except subprocess.CalledProcessError:
+            return
+        for entry in SynoACLTool._iterACLResult(iter(output)):
+            yield entry
+
+    async def getMany(self, paths, raiseErrors = False):
+        """Return a list of SynoACLResult for paths (see SynoACLTool.getMany).
+
+        All paths are submitted at once; the concurrency limit of this
+        instance bounds how many synoacltool processes actually run.
+        """
+        return await self._many(self.get, paths, raiseErrors)
+
+    async def add(self, path, acl):
+        """See SynoACLTool.add."""
+        return SynoACLTool._parseACLResult(await self._communicate(["-add", path, str(acl)]))
+
+    async def deleteEntry(self, path, index):
+        """See SynoACLTool.deleteEntry."""
+        return SynoACLTool._parseACLResult(await self._communicate(["-del", path, str(index)]))
+
+    async def replace(self, path, index, acl):
+        """See SynoACLTool.replace."""
+        return SynoACLTool._parseACLResult(await self._communicate(["-replace", path, str(index), str(acl)]))
+
+    async def deleteAll(self, path):
+        """See SynoACLTool.deleteAll."""
+        if len(await self.get(path)) > 0:
+            await self._communicate(["-del", path])
+
+    async def deleteForRole(self, path, role, name):
+        """See SynoACLTool.deleteForRole."""
+        directACLs = (await self.get(path)).getDirect()
+        for i in range(0, len(directACLs)):
+            acl = directACLs[i]
+            if acl.role == role and acl.name == name:
+                return await self.deleteEntry(path, i)
+
+        raise Exception("Could not find role:name " + role + ":" + name + " in ACL for path " + path)
+
+    async def reset(self, path, acls):
+        """See SynoACLTool.reset."""
+        await self.deleteAll(path)
+        for acl in acls:
+            await self.add(path, acl)
+
+    async def applyOperations(self, path, operations, existingAcls):
+        """See SynoACLTool.applyOperations."""
+        current = existingAcls
+        result = None
+        for operation in operations:
+            if operation.kind == operation.DELETE:
+                index = SynoACLTool._findACLIndex(path, current, operation.previous, operation.index)
+                result = await self.deleteEntry(path, index)
+            elif operation.kind == operation.REPLACE:
+                index = SynoACLTool._findACLIndex(path, current, operation.previous, operation.index)
+                result = await self.replace(path, index, operation.acl)
+            else:
+                result = await self.add(path, operation.acl)
+            current = result.getDirect()
+        return result
+
+    async def adaptTo(self, path, acls, dryRun = False, existingAcls = None, ordered = False):
+        """See SynoACLTool.adaptTo."""
+        if existingAcls is None:
+            existingAcls = (await self.get(path)).getDirect()
+        if ordered:
+            operations = SynoACLTool.compilePolicy(existingAcls, acls)
+        else:
+            operations = SynoACLTool.planAdaptTo(existingAcls, acls)
+        if not dryRun:
+            await self.applyOperations(path, operations, existingAcls)
+        return operations
+
+    async def removeRole(self, path, role, name, dryRun = False, existingAcls = None):
+        """See SynoACLTool.removeRole."""
+        if existingAcls is None:
+            existingAcls = (await self.get(path)).getDirect()
+        operations = SynoACLTool.planRemoveRole(existingAcls, role, name)
+        if not dryRun and len(operations) > 0:
+            await self.applyOperations(path, operations, existingAcls)
+        return operations
+
+    async def renameRole(self, path, role, name, newRole, newName, dryRun = False, existingAcls = None):
+        """See SynoACLTool.renameRole."""
+        if existingAcls is None:
+            existingAcls = (await self.get(path)).getDirect()
+        operations = SynoACLTool.planRenameRole(existingAcls, role, name, newRole, newName)
+        if not dryRun and len(operations) > 0:
+            await self.applyOperations(path, operations, existingAcls)
+        return operations
+
+    async def getArchive(self, path):
+        """See SynoACLTool.getArchive."""
+        return SynoACLTool._parseArchiveResult(await self._communicate(["-get-archive", path]))
+
+    async def getArchiveMany(self, paths, raiseErrors = False):
+        """Return a list of SynoACLResult for paths (see SynoACLTool.getArchiveMany)."""
+        return await self._many(self.getArchive, paths, raiseErrors)
+
+    async def setArchive(self, path, synoACLArchive):
+        """See SynoACLTool.setArchive."""
+        return SynoACLTool._parseArchiveResult(await self._communicate(["-set-archive", path, str(synoACLArchive)]))
+
+    async def delArchive(self, path, synoACLArchive):
+        """See SynoACLTool.delArchive."""
+        return SynoACLTool._parseArchiveResult(await self._communicate(["-del-archive", path, str(synoACLArchive)]))
+
+    async def setArchiveTo(self, path, requestedFlags, existingFlags = None):
+        """See SynoACLTool.setArchiveTo."""
+        if existingFlags is None:
+            existingFlags = await self.getArchive(path)
+        (flagsToDrop, flagsToSet) = SynoACLTool.planSetArchiveTo(existingFlags, requestedFlags)
+        if not flagsToDrop.isNone():
+            await self.delArchive(path, flagsToDrop)
+        if not flagsToSet.isNone():
+            await self.setArchive(path, flagsToSet)
+
+    async def enforceInherit(self, path):
+        """See SynoACLTool.enforceInherit."""
+        await self._communicate(["-enforce-inherit", path])
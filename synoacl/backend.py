@@ -0,0 +1,133 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import os
+import subprocess
+import threading
+
+class SynoACLBackend:
+    """The interface between synoacl and the system it manages.
+
+    A backend runs synoacltool commands and gives access to the parts of
+    the filesystem synoacl needs (directory listing for SynoACLTool.walk,
+    ctime for SynoACLCache). SubprocessBackend is the real thing;
+    synoacl.fake.FakeSynoACLBackend simulates a NAS in memory.
+    """
+
+    def communicate(self, args):
+        """Run synoacltool with given arguments and return its output split into lines.
+
+        Raises subprocess.CalledProcessError if the command fails.
+        """
+        raise NotImplementedError()
+
+    def communicateStream(self, args):
+        """Run synoacltool with given arguments and return an iterator over its output lines.
+
+        The lines don't include the line terminator. Failures are reported
+        by raising subprocess.CalledProcessError from the iterator once the
+        output is exhausted. By default the whole output is collected by
+        communicate first.
+        """
+        lines = self.communicate(args)
+        if len(lines) > 0 and lines[-1] == "":
+            # the terminator of the last line
+            lines = lines[:-1]
+        return iter(lines)
+
+    def listDirectory(self, path):
+        """Return the names of the entries of directory path (raises OSError on failure)."""
+        raise NotImplementedError()
+
+    def isDirectory(self, path, followLinks = False):
+        """Return True if path is a directory (symlinks to directories only count if followLinks)."""
+        raise NotImplementedError()
+
+    def changeTime(self, path):
+        """Return the ctime of path, or None if it can't be determined."""
+        raise NotImplementedError()
+
+class SubprocessBackend(SynoACLBackend):
+    """Runs the synoacltool executable and uses the local filesystem.
+
+    command is the synoacltool executable and timeout (in seconds, None for
+    no limit) applies to each invocation.
+    """
+
+    def __init__(self, command = "synoacltool", timeout = None):
+        self.command = command
+        self.timeout = timeout
+
+    def communicate(self, args):
+        """See SynoACLBackend.communicate.
+
+        Also raises subprocess.TimeoutExpired if synoacltool runs longer than the timeout.
+        """
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs["timeout"] = self.timeout
+        return subprocess.check_output([ self.command ] + args, universal_newlines = True, **kwargs).split("\n")
+
+    def communicateStream(self, args):
+        """See SynoACLBackend.communicateStream.
+
+        The lines are read from the pipe as synoacltool writes them. If the
+        iterator is not exhausted, synoacltool is killed when it's closed.
+        """
+        command = [ self.command ] + args
+        process = subprocess.Popen(command, stdout = subprocess.PIPE, universal_newlines = True)
+        timedOut = []
+        timer = None
+        if self.timeout is not None:
+            def kill():
+                timedOut.append(True)
+                process.kill()
+            timer = threading.Timer(self.timeout, kill)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            for line in process.stdout:
+                yield line.rstrip("\n")
+            returncode = process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+
+        if timedOut:
+            raise subprocess.TimeoutExpired(command, self.timeout)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def listDirectory(self, path):
+        return os.listdir(path)
+
+    def isDirectory(self, path, followLinks = False):
+        if not followLinks and os.path.islink(path):
+            return False
+        return os.path.isdir(path)
+
+    def changeTime(self, path):
+        try:
+            return os.stat(path).st_ctime
+        except OSError:
+            return None
@@ -0,0 +1,82 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+from synoacl.tool import SynoACLTool
+from synoacl.reconcile import SynoACLReconcileSummary
+
+class SynoACLBulk:
+    """Removes or renames a principal (role:name) across a whole tree.
+
+    The tree is scanned by SynoACLTool.walk with deriveInherited, so
+    synoacltool -get only runs for the paths that have entries of their
+    own. Only the paths that have direct entries of the principal are
+    changed: the changes are planned from the scanned ACLs (no further
+    -get) and applied by SynoACLTool.applyOperations - one -del or
+    -replace per entry - up to concurrency paths at a time. The inherited
+    entries of the principal go away (or change) with the direct ones.
+    """
+
+    @staticmethod
+    def _hasDirectEntries(acls, role, name):
+        for acl in acls.getDirect():
+            if acl.role == role and acl.name == name:
+                return True
+        return False
+
+    @staticmethod
+    def applyToEntries(entries, role, name, planner, concurrency = None, dryRun = False):
+        """Apply the operations planned by planner(directAcls) to the paths in entries that have direct entries of role:name.
+
+        entries is an iterable of (path, archive, acls) as produced by
+        SynoACLTool.walk (or SynoACLSnapshotReader). Returns a
+        SynoACLReconcileSummary; the paths without direct entries of role:name
+        are not listed in it.
+        """
+        def process(entry):
+            (path, archive, acls) = entry
+            existingAcls = acls.getDirect()
+            operations = planner(existingAcls)
+            if not dryRun and len(operations) > 0:
+                SynoACLTool.applyOperations(path, operations, existingAcls)
+            return operations
+
+        affected = (entry for entry in entries if SynoACLBulk._hasDirectEntries(entry[2], role, name))
+        summary = SynoACLReconcileSummary()
+        for result in SynoACLTool.getExecutor().imap(process, affected, concurrency):
+            if result.ok:
+                summary.addResult(result.path[0], result.value, None)
+            else:
+                summary.addFailure(result.path[0], result.error)
+        return summary
+
+    @staticmethod
+    def removeRole(root, role, name, concurrency = None, dryRun = False, **walkOptions):
+        """Delete all the direct entries of role:name from root and the paths below it.
+
+        walkOptions are passed to SynoACLTool.walk. Returns a SynoACLReconcileSummary.
+        """
+        walkOptions.setdefault("deriveInherited", True)
+        return SynoACLBulk.applyToEntries(SynoACLTool.walk(root, concurrency, **walkOptions), role, name,
+            lambda existingAcls: SynoACLTool.planRemoveRole(existingAcls, role, name), concurrency, dryRun)
+
+    @staticmethod
+    def renameRole(root, role, name, newRole, newName, concurrency = None, dryRun = False, **walkOptions):
+        """Rewrite all the direct entries of role:name under root to newRole:newName (see removeRole)."""
+        walkOptions.setdefault("deriveInherited", True)
+        return SynoACLBulk.applyToEntries(SynoACLTool.walk(root, concurrency, **walkOptions), role, name,
+            lambda existingAcls: SynoACLTool.planRenameRole(existingAcls, role, name, newRole, newName), concurrency, dryRun)
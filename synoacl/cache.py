@@ -0,0 +1,159 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import bisect
+import collections
+import os
+import threading
+import time
+
+class SynoACLCache:
+    """A size-bounded LRU cache of ACLs and archive flags, keyed by path.
+
+    When set with SynoACLTool.setCache, SynoACLTool.get and
+    SynoACLTool.getArchive are served from the cache when possible and the
+    SynoACLTool methods that change ACLs update or drop the affected entries
+    (a change of a directory drops the cached entries of everything below
+    it too, as their inherited ACLs may have changed).
+
+    A cached entry is dropped when the ctime of the path changes (changing
+    the ACLs of a path changes its ctime, so this catches changes of the
+    path done by other processes) or when it gets older than ttl seconds
+    (None means no limit). A change of a parent directory done by another
+    process doesn't change the ctime of the paths below it, so their cached
+    inherited entries may get stale - set ttl to bound for how long.
+    At most maxSize paths are kept; the least recently used ones are dropped
+    first. The ctime is taken from the local filesystem unless a backend
+    is passed (see synoacl.backend).
+    """
+
+    def __init__(self, maxSize = 10000, ttl = None, backend = None):
+        if maxSize < 1:
+            raise Exception("Cache size must be at least 1, got: " + str(maxSize))
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # path -> [ctime, time stored, SynoACLSet or None, SynoACLArchive or None]
+        self._entries = collections.OrderedDict()
+        # the cached paths, sorted (so the paths below a directory are a range)
+        self._paths = []
+        self._lock = threading.Lock()
+
+    def changeTime(self, path):
+        """Return the ctime of path, or None if it can't be determined."""
+        if self.backend is not None:
+            return self.backend.changeTime(path)
+        try:
+            return os.stat(path).st_ctime
+        except OSError:
+            return None
+
+    def _lookup(self, path, field):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[field] is not None:
+                if self.ttl is None or time.time() - entry[1] <= self.ttl:
+                    ctime = entry[0]
+                else:
+                    ctime = None
+                    self._drop(path)
+            else:
+                ctime = None
+
+        if ctime is not None and self.changeTime(path) == ctime:
+            with self._lock:
+                if path in self._entries:
+                    # mark as recently used
+                    self._entries[path] = self._entries.pop(path)
+                self.hits += 1
+            return entry[field]
+
+        with self._lock:
+            if ctime is not None:
+                self._drop(path)
+            self.misses += 1
+        return None
+
+    def _store(self, path, field, value, ctime):
+        if ctime is None:
+            # can't validate the entry later
+            self.invalidate(path)
+            return
+
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is None:
+                bisect.insort(self._paths, path)
+            if entry is None or entry[0] != ctime:
+                entry = [ctime, time.time(), None, None]
+            entry[field] = value
+            self._entries[path] = entry
+            while len(self._entries) > self.maxSize:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, path):
+        # the caller holds the lock
+        if self._entries.pop(path, None) is not None:
+            del self._paths[bisect.bisect_left(self._paths, path)]
+
+    def getACLs(self, path):
+        """Return the cached SynoACLSet of path or None."""
+        return self._lookup(path, 2)
+
+    def getArchive(self, path):
+        """Return the cached SynoACLArchive of path or None."""
+        return self._lookup(path, 3)
+
+    def putACLs(self, path, acls, ctime):
+        """Store the SynoACLSet of path.
+
+        ctime is the ctime of the path from before the ACLs were read
+        (see changeTime) - that way a change in between is noticed.
+        """
+        self._store(path, 2, acls, ctime)
+
+    def putArchive(self, path, archive, ctime):
+        """Store the SynoACLArchive of path (see putACLs)."""
+        self._store(path, 3, archive, ctime)
+
+    def invalidate(self, path, recursive = False):
+        """Drop the cached entry of path and, if recursive, of everything below it."""
+        with self._lock:
+            self._drop(path)
+            if recursive:
+                # the paths starting with prefix sort between prefix and prefix with
+                # the separator replaced by the next character
+                prefix = path.rstrip(os.sep) + os.sep
+                start = bisect.bisect_left(self._paths, prefix)
+                end = bisect.bisect_left(self._paths, prefix[:-1] + chr(ord(os.sep) + 1), start)
+                for cachedPath in self._paths[start:end]:
+                    del self._entries[cachedPath]
+                del self._paths[start:end]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._paths = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return "entries: " + str(len(self._entries)) + ", hits: " + str(self.hits) + ", misses: " + str(self.misses)
@@ -0,0 +1,203 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import os
+
+from synoacl.tool import SynoACLTool
+from synoacl.snapshot import SynoACLSnapshot, SynoACLSnapshotReader
+
+class SynoACLPathDiff:
+    """The difference between the ACLs of a path in two trees (see SynoACLDiff).
+
+    status is ADDED (the path is only in the new tree), REMOVED (only in the
+    old tree) or CHANGED. For CHANGED paths, the direct ACL entries are
+    compared by (role, name, aclType) - the same way SynoACLTool.adaptTo does:
+    added and removed are lists of SynoACL, changed is a list of
+    (old SynoACL, new SynoACL). The entries are matched as a multiset: equal
+    entries first, then the remaining ones with the same key in order, so
+    duplicate entries are not lost. orderChanged tells if the entries
+    present in both trees are in a different order (which matters for
+    deny entries), archiveChanged if the archive flags differ and
+    inheritedChanged if the inherited (level > 0) entries differ.
+
+    oldArchive, oldACLs, newArchive and newACLs are the compared values (None
+    for the side where the path is missing).
+    """
+
+    ADDED = "added"
+    REMOVED = "removed"
+    CHANGED = "changed"
+
+    def __init__(self, path, status, oldArchive = None, oldACLs = None, newArchive = None, newACLs = None):
+        self.path = path
+        self.status = status
+        self.oldArchive = oldArchive
+        self.oldACLs = oldACLs
+        self.newArchive = newArchive
+        self.newACLs = newACLs
+        self.added = []
+        self.removed = []
+        self.changed = []
+        self.orderChanged = False
+        self.archiveChanged = False
+        self.inheritedChanged = False
+
+    def __str__(self):
+        if self.status != SynoACLPathDiff.CHANGED:
+            return self.status + " " + self.path
+        lines = [self.status + " " + self.path]
+        if self.archiveChanged:
+            lines.append("  archive: " + str(self.oldArchive) + " -> " + str(self.newArchive))
+        for acl in self.removed:
+            lines.append("  - " + str(acl))
+        for acl in self.added:
+            lines.append("  + " + str(acl))
+        for (oldAcl, newAcl) in self.changed:
+            lines.append("  ~ " + str(oldAcl) + " -> " + str(newAcl))
+        if self.orderChanged:
+            lines.append("  order of entries changed")
+        if self.inheritedChanged:
+            lines.append("  inherited entries changed")
+        return "\n".join(lines)
+
+class SynoACLDiff:
+    """Compares the ACLs of two trees given as snapshots or live walks.
+
+    A tree is represented by a source: an iterable of
+    (path, aclSetId, archiveId, SynoACLSet, SynoACLArchive) in the order
+    produced by SynoACLTool.walk (see snapshotSource and liveSource). Paths
+    with equal IDs are skipped without looking at their ACLs. The sources
+    are consumed in lockstep and the differences are yielded as they are
+    found, so the memory use doesn't depend on the size of the trees.
+    """
+
+    @staticmethod
+    def snapshotSource(reader):
+        """Turn a SynoACLSnapshotReader into a source."""
+        for (path, aclSetId, archiveId) in reader.entries():
+            yield (path, aclSetId, archiveId, reader.aclSets[aclSetId], reader.archives[archiveId])
+
+    @staticmethod
+    def liveSource(root, **walkOptions):
+        """Walk the tree under root (see SynoACLTool.walk) and produce a source."""
+        # the same ACL sets come up over and over, don't hash them each time
+        aclSetIds = {}
+        for (path, archive, acls) in SynoACLTool.walk(root, **walkOptions):
+            aclSetId = aclSetIds.get(acls)
+            if aclSetId is None:
+                aclSetId = SynoACLSnapshot.aclSetId(acls)
+                aclSetIds[acls] = aclSetId
+            yield (path, aclSetId, SynoACLSnapshot.archiveId(archive), acls, archive)
+
+    @staticmethod
+    def _sortKey(path):
+        # SynoACLTool.walk goes depth-first with sorted names, which is the
+        # order of the paths compared component by component
+        return path.split(os.sep)
+
+    @staticmethod
+    def _aclKey(acl):
+        return (acl.role, acl.name, acl.aclType)
+
+    @staticmethod
+    def _comparePath(path, oldItem, newItem, ignoreInherited):
+        (oldACLSetId, oldArchiveId, oldACLs, oldArchive) = oldItem[1:]
+        (newACLSetId, newArchiveId, newACLs, newArchive) = newItem[1:]
+        pathDiff = SynoACLPathDiff(path, SynoACLPathDiff.CHANGED, oldArchive, oldACLs, newArchive, newACLs)
+        pathDiff.archiveChanged = oldArchiveId != newArchiveId
+
+        if oldACLSetId != newACLSetId:
+            # key -> [(index, SynoACL)] of the old entries not matched yet
+            oldDirect = {}
+            for (index, acl) in enumerate(oldACLs.getDirect()):
+                oldDirect.setdefault(SynoACLDiff._aclKey(acl), []).append((index, acl))
+            # the old index of each matched new entry, in the new order
+            matched = []
+            unmatched = []
+            for acl in newACLs.getDirect():
+                candidates = oldDirect.get(SynoACLDiff._aclKey(acl), [])
+                equal = next((i for (i, (index, oldAcl)) in enumerate(candidates) if oldAcl == acl), None)
+                if equal is None:
+                    unmatched.append((len(matched), acl))
+                    matched.append(None)
+                else:
+                    matched.append(candidates.pop(equal)[0])
+            for (position, acl) in unmatched:
+                candidates = oldDirect.get(SynoACLDiff._aclKey(acl), [])
+                if len(candidates) == 0:
+                    pathDiff.added.append(acl)
+                else:
+                    (index, oldAcl) = candidates.pop(0)
+                    pathDiff.changed.append((oldAcl, acl))
+                    matched[position] = index
+            pathDiff.removed = [acl for (index, acl) in sorted(entry for entries in oldDirect.values() for entry in entries)]
+            matched = [index for index in matched if index is not None]
+            pathDiff.orderChanged = matched != sorted(matched)
+
+            def inheritedEntries(acls):
+                return [(acl, level) for (acl, level) in acls.getEntries() if level > 0]
+            pathDiff.inheritedChanged = inheritedEntries(oldACLs) != inheritedEntries(newACLs)
+
+        if pathDiff.archiveChanged or pathDiff.added or pathDiff.removed or pathDiff.changed or pathDiff.orderChanged or \
+                (pathDiff.inheritedChanged and not ignoreInherited):
+            return pathDiff
+        return None
+
+    @staticmethod
+    def diff(oldSource, newSource, ignoreInherited = False):
+        """Yield a SynoACLPathDiff for each path whose ACLs differ between the two sources.
+
+        With ignoreInherited, paths where only the inherited entries
+        changed (e.g. because of a change in a parent) are not reported.
+        """
+        oldIterator = iter(oldSource)
+        newIterator = iter(newSource)
+        oldItem = next(oldIterator, None)
+        newItem = next(newIterator, None)
+        while oldItem is not None or newItem is not None:
+            if newItem is None or (oldItem is not None and
+                    SynoACLDiff._sortKey(oldItem[0]) < SynoACLDiff._sortKey(newItem[0])):
+                yield SynoACLPathDiff(oldItem[0], SynoACLPathDiff.REMOVED, oldArchive = oldItem[4], oldACLs = oldItem[3])
+                oldItem = next(oldIterator, None)
+            elif oldItem is None or oldItem[0] != newItem[0]:
+                yield SynoACLPathDiff(newItem[0], SynoACLPathDiff.ADDED, newArchive = newItem[4], newACLs = newItem[3])
+                newItem = next(newIterator, None)
+            else:
+                if oldItem[1] != newItem[1] or oldItem[2] != newItem[2]:
+                    pathDiff = SynoACLDiff._comparePath(oldItem[0], oldItem, newItem, ignoreInherited)
+                    if pathDiff is not None:
+                        yield pathDiff
+                oldItem = next(oldIterator, None)
+                newItem = next(newIterator, None)
+
+    @staticmethod
+    def diffSnapshots(oldFileName, newFileName, ignoreInherited = False):
+        """Yield the differences between two snapshot files (see diff)."""
+        with SynoACLSnapshotReader(oldFileName) as oldReader:
+            with SynoACLSnapshotReader(newFileName) as newReader:
+                for pathDiff in SynoACLDiff.diff(SynoACLDiff.snapshotSource(oldReader),
+                        SynoACLDiff.snapshotSource(newReader), ignoreInherited):
+                    yield pathDiff
+
+    @staticmethod
+    def diffSnapshotWithLive(fileName, root, ignoreInherited = False, **walkOptions):
+        """Yield the differences between a snapshot file (old) and the current ACLs under root (new)."""
+        with SynoACLSnapshotReader(fileName) as reader:
+            for pathDiff in SynoACLDiff.diff(SynoACLDiff.snapshotSource(reader),
+                    SynoACLDiff.liveSource(root, **walkOptions), ignoreInherited):
+                yield pathDiff
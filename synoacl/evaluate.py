@@ -0,0 +1,159 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+from synoacl.tool import SynoACL, SynoACLTool
+
+class SynoACLPrincipal:
+    """A user together with the groups the user is a member of."""
+    __slots__ = ("user", "groups")
+
+    def __init__(self, user, groups = ()):
+        self.user = user
+        self.groups = frozenset(groups)
+
+    def matches(self, role, name, owner = None):
+        """Return True if an ACL entry for role:name applies to this principal.
+
+        owner is the owner of the path (if known) for "owner" entries.
+        """
+        if role == SynoACLEvaluator.ROLE_USER:
+            return name == self.user
+        if role == SynoACLEvaluator.ROLE_GROUP:
+            return name in self.groups
+        if role == SynoACLEvaluator.ROLE_OWNER:
+            return owner is not None and owner == self.user
+        return role in SynoACLEvaluator.ROLES_EVERYBODY
+
+    def __eq__(self, other):
+        return isinstance(other, SynoACLPrincipal) and self.user == other.user and self.groups == other.groups
+
+    def __hash__(self):
+        return hash((self.user, self.groups))
+
+    def __str__(self):
+        return self.user + " (" + ", ".join(sorted(self.groups)) + ")"
+
+class SynoACLEvaluator:
+    """Computes the effective permissions of principals from ACL sets.
+
+    The entries are evaluated like Windows ACLs (which the Synology ACLs
+    follow): entries with a lower level (i.e. explicit entries before the
+    inherited ones, closer ancestors before further ones) take precedence
+    and at the same level deny entries take precedence over allow entries.
+    A permission is granted if the first applicable entry mentioning it
+    allows it. Entries with inheritOnly don't apply to the path that holds
+    them (level 0), only to the children that inherit them. Archive flags
+    (e.g. is_read_only) are not taken into account.
+
+    The results are memoized per (ACL set, principal), so evaluating a
+    whole tree (where most paths share a handful of ACL sets) is cheap.
+    """
+
+    ROLE_USER = "user"
+    ROLE_GROUP = "group"
+    ROLE_OWNER = "owner"
+    # the roles that apply to any principal
+    ROLES_EVERYBODY = ("everyone", "authenticated_user")
+    # the memoized results are dropped when there are more than this
+    CACHE_LIMIT = 65536
+
+    def __init__(self):
+        # SynoACLSet -> tuple of (role, name, isDeny, mask) in the order of evaluation
+        self._compiled = {}
+        # (SynoACLSet, principal, owner) -> mask
+        self._results = {}
+
+    def _compile(self, acls):
+        try:
+            return self._compiled[acls]
+        except KeyError:
+            pass
+
+        entries = []
+        for (acl, level) in acls.getEntries():
+            # an inherit-only entry doesn't apply to the path that holds it,
+            # but the copies inherited by the children (level > 0) do
+            if level == 0 and acl.inheritMode.inheritOnly:
+                continue
+            isDeny = acl.aclType == "deny"
+            entries.append((level, 0 if isDeny else 1, len(entries), (acl.role, acl.name, isDeny, acl.permissions.mask)))
+        compiled = tuple(entry[3] for entry in sorted(entries))
+
+        if len(self._compiled) >= SynoACLEvaluator.CACHE_LIMIT:
+            self._compiled.clear()
+        self._compiled[acls] = compiled
+        return compiled
+
+    def evaluateMask(self, acls, principal, owner = None):
+        """Return the effective permissions of principal given a SynoACLSet as a bitmask (see SynoACL.Permissions)."""
+        key = (acls, principal, owner)
+        try:
+            return self._results[key]
+        except KeyError:
+            pass
+
+        allowed = 0
+        denied = 0
+        for (role, name, isDeny, mask) in self._compile(acls):
+            if not principal.matches(role, name, owner):
+                continue
+            if isDeny:
+                denied |= mask & ~allowed
+            else:
+                allowed |= mask & ~denied
+
+        if len(self._results) >= SynoACLEvaluator.CACHE_LIMIT:
+            self._results.clear()
+        self._results[key] = allowed
+        return allowed
+
+    def evaluate(self, acls, principal, owner = None):
+        """Return the effective SynoACL.Permissions of principal given a SynoACLSet.
+
+        owner is the owner of the path; without it, "owner" entries are
+        ignored. The returned object is shared and can't be modified.
+        """
+        return SynoACL.Permissions.shared(self.evaluateMask(acls, principal, owner))
+
+    def evaluatePath(self, path, principal, owner = None):
+        """Return the effective SynoACL.Permissions of principal on path (see evaluate)."""
+        return self.evaluate(SynoACLTool.get(path), principal, owner)
+
+    def evaluateEntries(self, entries, principals):
+        """Evaluate many principals on many paths at once.
+
+        entries is an iterable of (path, archive, acls) as produced by
+        SynoACLTool.walk or SynoACLSnapshotReader. Yields (path, list of
+        SynoACL.Permissions) with the permissions in the order of principals.
+        "owner" entries are ignored.
+        """
+        principals = list(principals)
+        # SynoACLSet -> list of permissions
+        evaluated = {}
+        for (path, archive, acls) in entries:
+            permissions = evaluated.get(acls)
+            if permissions is None:
+                permissions = [self.evaluate(acls, principal) for principal in principals]
+                if len(evaluated) >= SynoACLEvaluator.CACHE_LIMIT:
+                    evaluated.clear()
+                evaluated[acls] = permissions
+            yield (path, permissions)
+
+    def evaluateTree(self, root, principals, **walkOptions):
+        """Walk the tree under root (see SynoACLTool.walk) and evaluate principals on each path (see evaluateEntries)."""
+        return self.evaluateEntries(SynoACLTool.walk(root, **walkOptions), principals)
@@ -0,0 +1,137 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import collections
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from synoacl.backend import SubprocessBackend
+
+class SynoACLResult:
+    """The outcome of one call in a batch (see SynoACLExecutor.imap).
+
+    Exactly one of value and error is meaningful: if the call raised,
+    error holds the exception, otherwise value holds the return value.
+    """
+    def __init__(self, path, value = None, error = None):
+        self.path = path
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __str__(self):
+        if self.ok:
+            return str(self.path) + ": " + str(self.value)
+        return str(self.path) + ": error: " + str(self.error)
+
+class SynoACLExecutor:
+    """Runs synoacltool invocations.
+
+    All the calls SynoACLTool makes go through SynoACLTool._communicate which
+    delegates to the current executor (see SynoACLTool.setExecutor) and that
+    in turn to its backend (see synoacl.backend). Each call is a separate
+    synoacltool process (synoacltool has no batch mode) so batch operations
+    get their speed-up by running several calls at a time from a bounded pool
+    of worker threads (see imap).
+
+    By default, a SubprocessBackend running command with the timeout (in
+    seconds, None for no limit) is used; another backend can be passed
+    instead. concurrency is the default number of calls run at once by imap.
+    """
+
+    DEFAULT_CONCURRENCY = 4
+
+    def __init__(self, command = "synoacltool", timeout = None, concurrency = DEFAULT_CONCURRENCY, backend = None):
+        if concurrency < 1:
+            raise Exception("Concurrency must be at least 1, got: " + str(concurrency))
+        if backend is None:
+            backend = SubprocessBackend(command, timeout)
+        self.backend = backend
+        self.concurrency = concurrency
+
+    def communicate(self, args):
+        """Run synoacltool with given arguments and return its output split into lines.
+
+        Raises subprocess.CalledProcessError if synoacltool fails (and
+        subprocess.TimeoutExpired if it runs longer than the timeout).
+        """
+        return self.backend.communicate(args)
+
+    def communicateStream(self, args):
+        """Like communicate but return an iterator over the output lines, see SynoACLBackend.communicateStream."""
+        return self.backend.communicateStream(args)
+
+    @staticmethod
+    def _call(fn, path):
+        try:
+            return SynoACLResult(path, value = fn(path))
+        except Exception as e:
+            return SynoACLResult(path, error = e)
+
+    @staticmethod
+    def _collect(path, future):
+        try:
+            return SynoACLResult(path, value = future.result())
+        except Exception as e:
+            return SynoACLResult(path, error = e)
+
+    def imap(self, fn, paths, concurrency = None):
+        """Call fn(path) for each path, running up to concurrency calls at once.
+
+        Yields a SynoACLResult for each path, in the order of paths. An
+        exception raised by fn is reported in the result for that path and
+        doesn't affect the other paths.
+
+        paths is consumed lazily and only a bounded number of results is kept
+        in memory, so this can be used on arbitrarily long (or infinite) inputs.
+
+        The calls run in the context (see contextvars) of the caller, so e.g.
+        SynoACLScheduler.priority applies to them too.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+
+        if concurrency <= 1:
+            for path in paths:
+                yield SynoACLExecutor._call(fn, path)
+            return
+
+        # keep twice as many calls queued as there are workers so that the
+        # workers are kept busy while waiting for a slow call at the head
+        window = 2 * concurrency
+        pending = collections.deque()
+        pool = ThreadPoolExecutor(max_workers = concurrency)
+        try:
+            for path in paths:
+                pending.append((path, pool.submit(contextvars.copy_context().run, fn, path)))
+                if len(pending) >= window:
+                    yield SynoACLExecutor._collect(*pending.popleft())
+            while pending:
+                yield SynoACLExecutor._collect(*pending.popleft())
+        finally:
+            # the consumer might have stopped early - don't run what's left
+            for (path, future) in pending:
+                future.cancel()
+            pool.shutdown(wait = True)
+
+    def map(self, fn, paths, concurrency = None):
+        """Like imap but returns a list of all the results."""
+        return list(self.imap(fn, paths, concurrency))
@@ -0,0 +1,309 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import collections
+import errno
+import itertools
+import os
+import subprocess
+import threading
+import time
+
+from synoacl.backend import SynoACLBackend
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive
+
+class _FakeNode:
+    __slots__ = ("isDirectory", "acls", "archive", "ctime", "children")
+
+    def __init__(self, isDirectory, archive, ctime):
+        self.isDirectory = isDirectory
+        # direct ACL entries
+        self.acls = []
+        self.archive = archive
+        self.ctime = ctime
+        self.children = set() if isDirectory else None
+
+class FakeSynoACLBackend(SynoACLBackend):
+    """A simulated synoacltool working on an in-memory tree.
+
+    This allows running (and load-testing) synoacl anywhere:
+
+    ::
+
+        backend = FakeSynoACLBackend()
+        backend.makeTree("/volume1/share", width = 10, depth = 4)
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = backend))
+
+    It produces the same output format as synoacltool and follows its
+    behaviour as observed (and as assumed by SynoACLTool):
+
+    * the ACLs of a path are its direct entries (level 0) followed by the
+      entries inherited from the parent (see SynoACLSet.inherited) if the
+      path has is_inherit
+    * -get fails for paths without is_support_ACL ("Linux mode")
+    * -add inserts the new entry at index 0; -del and -replace only accept
+      indices of direct entries
+    * -del without an index removes all direct entries and also drops
+      is_inherit; it fails if there are no entries at all
+    * has_ACL is set exactly when a path has direct entries
+    * -enforce-inherit makes the path inherit: it removes its direct entries
+      and sets is_inherit
+
+    Note that the inherited entries are computed by SynoACLSet.inherited,
+    the same code SynoACLTool.walk uses with deriveInherited (and checks
+    with verifySample). Tests of deriving or verifying inherited entries
+    against the fake are therefore circular: they show consistency with
+    SynoACLSet.inherited, not that it matches the real synoacltool.
+
+    latency (in seconds) is added to every command to simulate the cost of
+    running synoacltool. calls counts the commands run, by subcommand. If
+    autoCreate is True, commands on unknown paths create them as directories
+    instead of failing.
+    """
+
+    DEFAULT_ARCHIVE = "is_inherit,is_support_ACL"
+
+    def __init__(self, latency = 0.0, autoCreate = False):
+        self.latency = latency
+        self.autoCreate = autoCreate
+        self.calls = collections.Counter()
+        self._nodes = {}
+        self._ctimes = itertools.count(1)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _normalize(path):
+        return os.path.normpath(path)
+
+    def _touch(self, node):
+        node.ctime = next(self._ctimes)
+
+    def _create(self, path, isDirectory, archive):
+        with self._lock:
+            path = FakeSynoACLBackend._normalize(path)
+            node = self._nodes.get(path)
+            if node is not None:
+                return node
+
+            parentPath = os.path.dirname(path)
+            if parentPath != path:
+                parent = self._create(parentPath, True, None)
+                if not parent.isDirectory:
+                    raise Exception("Can't create " + path + ": " + parentPath + " is not a directory")
+                parent.children.add(os.path.basename(path))
+                self._touch(parent)
+
+            if archive is None:
+                archive = SynoACLArchive.fromString(FakeSynoACLBackend.DEFAULT_ARCHIVE)
+            node = _FakeNode(isDirectory, archive, next(self._ctimes))
+            self._nodes[path] = node
+            return node
+
+    def _setACLs(self, node, acls):
+        node.acls = acls
+        node.archive.hasACL = len(acls) > 0
+        self._touch(node)
+
+    def _makePath(self, path, isDirectory, acls, archive):
+        if isinstance(archive, str):
+            archive = SynoACLArchive.fromString(archive)
+        elif archive is not None:
+            # the node's flags are changed in place, don't change the caller's object
+            archive = SynoACLArchive._fromMask(archive.mask)
+        with self._lock:
+            node = self._create(path, isDirectory, archive)
+            if archive is not None:
+                # the path may have existed already
+                node.archive = archive
+            self._setACLs(node, [acl if isinstance(acl, SynoACL) else SynoACL.intern(acl) for acl in acls])
+
+    def makeDirectory(self, path, acls = (), archive = None):
+        """Create a directory (and its parents) with given direct ACLs (SynoACL or strings) and archive flags.
+
+        archive is a SynoACLArchive or a string; it defaults to DEFAULT_ARCHIVE
+        (an existing path keeps its flags then).
+        """
+        self._makePath(path, True, acls, archive)
+
+    def makeFile(self, path, acls = (), archive = None):
+        """Create a file (see makeDirectory)."""
+        self._makePath(path, False, acls, archive)
+
+    def makeTree(self, root, width, depth, filesPerDirectory = 0):
+        """Create a tree of directories under root.
+
+        Each directory down to depth levels below root gets width
+        subdirectories (named d0, d1, ...) and filesPerDirectory files
+        (f0, f1, ...). Everything inherits from root. Returns the number of
+        paths created (including root).
+        """
+        self.makeDirectory(root)
+        count = 1
+        level = [root]
+        for i in range(depth):
+            nextLevel = []
+            for directory in level:
+                for j in range(filesPerDirectory):
+                    self.makeFile(os.path.join(directory, "f" + str(j)))
+                    count += 1
+                for j in range(width):
+                    path = os.path.join(directory, "d" + str(j))
+                    self.makeDirectory(path)
+                    nextLevel.append(path)
+                    count += 1
+            level = nextLevel
+        return count
+
+    def _node(self, path):
+        node = self._nodes.get(FakeSynoACLBackend._normalize(path))
+        if node is None:
+            if not self.autoCreate:
+                return None
+            node = self._create(path, True, None)
+        return node
+
+    def getACLs(self, path):
+        """Return the SynoACLSet synoacltool -get would report for path (None for "Linux mode")."""
+        with self._lock:
+            node = self._node(path)
+            if node is None or not node.archive.isSupportACL:
+                return None
+            return self._effectiveACLs(FakeSynoACLBackend._normalize(path), node)
+
+    def _effectiveACLs(self, path, node):
+        acls = list(node.acls)
+        levels = [0] * len(acls)
+        parentPath = os.path.dirname(path)
+        if node.archive.isInherit and parentPath != path:
+            parent = self._nodes.get(parentPath)
+            if parent is not None and parent.archive.isSupportACL:
+                for (acl, level) in self._effectiveACLs(parentPath, parent).inherited(node.isDirectory).getEntries():
+                    acls.append(acl)
+                    levels.append(level)
+        return SynoACLSet(acls, levels)
+
+    @staticmethod
+    def _formatACLs(acls):
+        lines = []
+        for (i, (acl, level)) in enumerate(acls.getEntries()):
+            lines.append("\t [" + str(i) + "] " + str(acl) + " (level:" + str(level) + ")")
+        return lines
+
+    def _getOutput(self, path, node):
+        return [
+            "ACL version: 1",
+            "Archive: " + str(node.archive),
+            "Owner: [root(user)]",
+            "---------------------"
+        ] + FakeSynoACLBackend._formatACLs(self._effectiveACLs(path, node)) + [""]
+
+    @staticmethod
+    def _fail(args, message):
+        raise subprocess.CalledProcessError(255, [ "synoacltool" ] + args, message)
+
+    @staticmethod
+    def _changeArchive(archive, flags, value):
+        changed = SynoACLArchive.fromString(flags)
+        for name in ["isInherit", "isReadOnly", "isOwnerGroup", "hasACL", "isSupportACL"]:
+            if getattr(changed, name):
+                setattr(archive, name, value)
+
+    def _index(self, args, node, index):
+        try:
+            index = int(index)
+        except ValueError:
+            FakeSynoACLBackend._fail(args, "Invalid index: " + index)
+        if index < 0 or index >= len(node.acls):
+            FakeSynoACLBackend._fail(args, "(synoacltool.c, 385)Index out of range")
+        return index
+
+    def communicate(self, args):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self._lock:
+            if len(args) < 2:
+                FakeSynoACLBackend._fail(args, "Usage: synoacltool ...")
+            command = args[0]
+            self.calls[command] += 1
+            path = FakeSynoACLBackend._normalize(args[1])
+            node = self._node(path)
+            if node is None:
+                FakeSynoACLBackend._fail(args, "No such file or directory: " + path)
+
+            if command == "-get-archive":
+                return ["Archive: " + str(node.archive), ""]
+            elif command == "-set-archive" and len(args) == 3:
+                FakeSynoACLBackend._changeArchive(node.archive, args[2], True)
+                self._touch(node)
+                return ["Archive: " + str(node.archive), ""]
+            elif command == "-del-archive" and len(args) == 3:
+                FakeSynoACLBackend._changeArchive(node.archive, args[2], False)
+                self._touch(node)
+                return ["Archive: " + str(node.archive), ""]
+            elif command == "-enforce-inherit" and len(args) == 2:
+                node.archive.isInherit = True
+                self._setACLs(node, [])
+                return [""]
+
+            if not node.archive.isSupportACL:
+                FakeSynoACLBackend._fail(args, "(synoacltool.c, 350)It's Linux mode")
+
+            if command == "-get" and len(args) == 2:
+                pass
+            elif command == "-add" and len(args) == 3:
+                self._setACLs(node, [SynoACL.intern(args[2])] + node.acls)
+            elif command == "-replace" and len(args) == 4:
+                index = self._index(args, node, args[2])
+                acls = list(node.acls)
+                acls[index] = SynoACL.intern(args[3])
+                self._setACLs(node, acls)
+            elif command == "-del" and len(args) == 3:
+                index = self._index(args, node, args[2])
+                acls = list(node.acls)
+                del acls[index]
+                self._setACLs(node, acls)
+            elif command == "-del" and len(args) == 2:
+                if len(self._effectiveACLs(path, node)) == 0:
+                    FakeSynoACLBackend._fail(args, "(synoacltool.c, 385)Index out of range")
+                node.archive.isInherit = False
+                self._setACLs(node, [])
+            else:
+                FakeSynoACLBackend._fail(args, "Usage: synoacltool ...")
+
+            return self._getOutput(path, node)
+
+    def listDirectory(self, path):
+        with self._lock:
+            node = self._nodes.get(FakeSynoACLBackend._normalize(path))
+            if node is None:
+                raise OSError(errno.ENOENT, "No such file or directory", path)
+            if not node.isDirectory:
+                raise OSError(errno.ENOTDIR, "Not a directory", path)
+            return list(node.children)
+
+    def isDirectory(self, path, followLinks = False):
+        node = self._nodes.get(FakeSynoACLBackend._normalize(path))
+        return node is not None and node.isDirectory
+
+    def changeTime(self, path):
+        node = self._nodes.get(FakeSynoACLBackend._normalize(path))
+        return node.ctime if node is not None else None
+
+    def __len__(self):
+        return len(self._nodes)
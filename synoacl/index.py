@@ -0,0 +1,234 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import os
+import sqlite3
+from dataclasses import dataclass
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLTool
+from synoacl.reconcile import SynoACLReconcileSummary
+from synoacl.snapshot import SynoACLSnapshot, SynoACLSnapshotReader
+
+@dataclass(slots = True)
+class SynoACLIndexHit:
+    """An ACL entry found in the index: the path, the entry and its level."""
+    path: str
+    acl: SynoACL
+    level: int
+
+    def __str__(self):
+        return f"{self.path}: {self.acl} (level: {self.level})"
+
+class SynoACLIndex:
+    """An on-disk (sqlite) inverted index: principal -> paths where it has ACL entries.
+
+    The index is filled from a scan (SynoACLTool.walk) or a snapshot
+    (SynoACLSnapshotReader) by update and answers which paths have
+    entries for a role:name (optionally of an aclType) without touching
+    the NAS:
+
+    ::
+
+        index = SynoACLIndex("acls.db")
+        index.update(SynoACLTool.walk("/volume1/share"), root = "/volume1/share")
+        for hit in index.find("user", "alice"):
+            print(hit)
+
+    As in snapshots, each distinct ACL set is stored once and the paths
+    refer to it by its content ID (see SynoACLSnapshot.aclSetId).
+    fileName ":memory:" keeps the index in memory only.
+    """
+
+    _SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS paths (path TEXT PRIMARY KEY, aclSetId TEXT NOT NULL, scan INTEGER NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS pathsByACLSet ON paths (aclSetId)",
+        "CREATE TABLE IF NOT EXISTS entries (aclSetId TEXT NOT NULL, position INTEGER NOT NULL, role TEXT NOT NULL, " +
+            "name TEXT NOT NULL, aclType TEXT NOT NULL, level INTEGER NOT NULL, acl TEXT NOT NULL, " +
+            "PRIMARY KEY (aclSetId, position))",
+        "CREATE INDEX IF NOT EXISTS entriesByPrincipal ON entries (role, name, aclType)",
+        "CREATE TABLE IF NOT EXISTS scans (scan INTEGER PRIMARY KEY)"
+    ]
+
+    def __init__(self, fileName):
+        self._connection = sqlite3.connect(fileName)
+        with self._connection:
+            for statement in SynoACLIndex._SCHEMA:
+                self._connection.execute(statement)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def _hasACLSet(self, aclSetId):
+        return self._connection.execute("SELECT 1 FROM entries WHERE aclSetId = ? LIMIT 1", (aclSetId,)).fetchone() is not None
+
+    def _storeACLSet(self, acls, aclSetIds):
+        aclSetId = aclSetIds.get(acls)
+        if aclSetId is not None:
+            return aclSetId
+
+        aclSetId = SynoACLSnapshot.aclSetId(acls)
+        aclSetIds[acls] = aclSetId
+        if not self._hasACLSet(aclSetId):
+            self._connection.executemany("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(aclSetId, position, acl.role, acl.name, acl.aclType, level, str(acl))
+                    for (position, (acl, level)) in enumerate(acls.getEntries())])
+        return aclSetId
+
+    @staticmethod
+    def _underRoot(root):
+        """Return a SQL condition (and its parameters) matching root and the paths below it."""
+        prefix = root.rstrip(os.sep) + os.sep
+        return ("(path = ? OR substr(path, 1, ?) = ?)", (root, len(prefix), prefix))
+
+    def update(self, entries, root = None):
+        """Add (or replace) the ACLs of paths in the index.
+
+        entries is an iterable of (path, archive, acls) as produced by
+        SynoACLTool.walk or SynoACLSnapshotReader. If root is given, the
+        entries are taken to be a complete scan of the tree under root and
+        the indexed paths under root that are not in entries are dropped.
+
+        Returns the number of paths updated.
+        """
+        count = 0
+        aclSetIds = {}
+        with self._connection:
+            scan = self._connection.execute("INSERT INTO scans VALUES (NULL)").lastrowid
+            for (path, archive, acls) in entries:
+                aclSetId = self._storeACLSet(acls, aclSetIds)
+                self._connection.execute("INSERT OR REPLACE INTO paths VALUES (?, ?, ?)", (path, aclSetId, scan))
+                count += 1
+
+            if root is not None:
+                (condition, parameters) = SynoACLIndex._underRoot(root)
+                self._connection.execute("DELETE FROM paths WHERE scan != ? AND " + condition, (scan,) + parameters)
+            self._dropUnusedACLSets()
+        return count
+
+    def updateFromSnapshot(self, fileName, root = None):
+        """Update the index from a snapshot file (see update)."""
+        with SynoACLSnapshotReader(fileName) as reader:
+            return self.update(reader, root)
+
+    def remove(self, path, recursive = False):
+        """Drop path (and, if recursive, the paths below it) from the index."""
+        with self._connection:
+            if recursive:
+                (condition, parameters) = SynoACLIndex._underRoot(path)
+                self._connection.execute("DELETE FROM paths WHERE " + condition, parameters)
+            else:
+                self._connection.execute("DELETE FROM paths WHERE path = ?", (path,))
+            self._dropUnusedACLSets()
+
+    def _dropUnusedACLSets(self):
+        self._connection.execute("DELETE FROM entries WHERE aclSetId NOT IN (SELECT aclSetId FROM paths)")
+
+    def find(self, role, name, aclType = None, directOnly = False):
+        """Return the SynoACLIndexHit list for the entries of role:name (of aclType if given), ordered by path.
+
+        With directOnly, only the entries set on the paths themselves
+        (level 0) are returned, not the inherited ones.
+        """
+        query = "SELECT paths.path, entries.acl, entries.level FROM entries JOIN paths ON paths.aclSetId = entries.aclSetId " + \
+            "WHERE entries.role = ? AND entries.name = ?"
+        parameters = [role, name]
+        if aclType is not None:
+            query += " AND entries.aclType = ?"
+            parameters.append(aclType)
+        if directOnly:
+            query += " AND entries.level = 0"
+        query += " ORDER BY paths.path, entries.position"
+        return [SynoACLIndexHit(path, SynoACL.intern(acl), level)
+            for (path, acl, level) in self._connection.execute(query, parameters)]
+
+    def get(self, path):
+        """Return the indexed SynoACLSet of path or None if path is not in the index."""
+        row = self._connection.execute("SELECT aclSetId FROM paths WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        entries = self._connection.execute("SELECT acl, level FROM entries WHERE aclSetId = ? ORDER BY position", row).fetchall()
+        return SynoACLSet([SynoACL.intern(acl) for (acl, level) in entries], [level for (acl, level) in entries])
+
+    def findPaths(self, role, name, aclType = None, directOnly = False):
+        """Return the sorted list of paths that have entries for role:name (see find)."""
+        paths = []
+        for hit in self.find(role, name, aclType, directOnly):
+            if len(paths) == 0 or paths[-1] != hit.path:
+                paths.append(hit.path)
+        return paths
+
+    def principals(self):
+        """Return the sorted list of (role, name) that have entries in the index."""
+        return [tuple(row) for row in self._connection.execute(
+            "SELECT DISTINCT role, name FROM entries WHERE aclSetId IN (SELECT aclSetId FROM paths) ORDER BY role, name")]
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM paths").fetchone()[0]
+
+    def _changeRole(self, role, name, change, planner, concurrency, dryRun):
+        summary = SynoACLReconcileSummary()
+        directPaths = self.findPaths(role, name, directOnly = True)
+        if dryRun:
+            for path in directPaths:
+                summary.addResult(path, planner(self.get(path).getDirect()), None)
+            return summary
+
+        affectedPaths = self.findPaths(role, name)
+        for result in SynoACLTool.getExecutor().imap(change, directPaths, concurrency):
+            if result.ok:
+                summary.addResult(result.path, result.value, None)
+            else:
+                summary.addFailure(result.path, result.error)
+
+        refreshed = []
+        for result in SynoACLTool.getMany(affectedPaths, concurrency):
+            if result.ok:
+                refreshed.append((result.path, None, result.value))
+        self.update(refreshed)
+        return summary
+
+    def deleteForRole(self, role, name, concurrency = None, dryRun = False):
+        """Delete all the entries of role:name from all the indexed paths that have them.
+
+        Only paths with direct entries of role:name are changed (by
+        SynoACLTool.removeRole: one -get and one -del per entry; the
+        inherited entries go away with them), up to concurrency paths at a
+        time (see SynoACLExecutor.imap). Then all the paths that had any
+        entry of role:name are read again and updated in the index. With
+        dryRun, nothing is changed and the operations are planned from the
+        indexed ACLs.
+
+        Returns a SynoACLReconcileSummary.
+        """
+        return self._changeRole(role, name,
+            lambda path: SynoACLTool.removeRole(path, role, name),
+            lambda existingAcls: SynoACLTool.planRemoveRole(existingAcls, role, name),
+            concurrency, dryRun)
+
+    def renameRole(self, role, name, newRole, newName, concurrency = None, dryRun = False):
+        """Rewrite all the entries of role:name on the indexed paths to newRole:newName (see deleteForRole and SynoACLTool.renameRole)."""
+        return self._changeRole(role, name,
+            lambda path: SynoACLTool.renameRole(path, role, name, newRole, newName),
+            lambda existingAcls: SynoACLTool.planRenameRole(existingAcls, role, name, newRole, newName),
+            concurrency, dryRun)
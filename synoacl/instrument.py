@@ -0,0 +1,270 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import bisect
+import threading
+from timeit import default_timer
+
+class SynoACLCall:
+    """A finished synoacltool invocation, as passed to SynoACLHook.callFinished.
+
+    waitTime is the time spent running synoacltool, parseTime the time spent
+    parsing its output (both in seconds), lines the number of output lines.
+    error is the exception raised (by synoacltool or by the parser) or None.
+    """
+    def __init__(self, args, waitTime, parseTime, lines, error):
+        self.args = args
+        self.waitTime = waitTime
+        self.parseTime = parseTime
+        self.lines = lines
+        self.error = error
+
+    @property
+    def command(self):
+        return self.args[0]
+
+    @property
+    def time(self):
+        return self.waitTime + self.parseTime
+
+    def __str__(self):
+        s = " ".join(self.args) + ": wait " + "%.6f" % self.waitTime + "s, parse " + \
+            "%.6f" % self.parseTime + "s, " + str(self.lines) + " lines"
+        if self.error is not None:
+            s += ", error: " + str(self.error)
+        return s
+
+class SynoACLHook:
+    """Receives notifications about synoacltool invocations (see SynoACLInstrumentation.addHook).
+
+    This can be used to export the data to a metrics or tracing system.
+    Hooks are called from the threads that run synoacltool, so they must be
+    thread safe. An exception raised by a hook propagates to the caller.
+    """
+
+    def callStarted(self, args):
+        """Called before synoacltool is run. The return value is passed to callFinished."""
+        return None
+
+    def callFinished(self, call, context):
+        """Called with a SynoACLCall when the call is done (successfully or not)."""
+        pass
+
+class SynoACLHistogram:
+    """A histogram of durations with fixed buckets.
+
+    counts[i] is the number of durations <= bounds[i] (and > bounds[i - 1]);
+    the last item of counts is for the durations above the last bound.
+    """
+
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, bounds = BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    def add(self, duration):
+        self.counts[bisect.bisect_left(self.bounds, duration)] += 1
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket holding the p-th percentile (p in 0..100).
+
+        Returns None if the histogram is empty and infinity if it's in the
+        overflow bucket.
+        """
+        total = sum(self.counts)
+        if total == 0:
+            return None
+        limit = total * p / 100.0
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if seen >= limit and count > 0:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def toDict(self):
+        return { "bounds": list(self.bounds), "counts": list(self.counts) }
+
+class SynoACLCallStats:
+    """Statistics of the invocations of one synoacltool subcommand."""
+
+    def __init__(self, command):
+        self.command = command
+        self.count = 0
+        self.errors = 0
+        self.waitTime = 0.0
+        self.parseTime = 0.0
+        self.lines = 0
+        self.histogram = SynoACLHistogram()
+
+    def add(self, call):
+        self.count += 1
+        if call.error is not None:
+            self.errors += 1
+        self.waitTime += call.waitTime
+        self.parseTime += call.parseTime
+        self.lines += call.lines
+        self.histogram.add(call.time)
+
+    def toDict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "waitTime": self.waitTime,
+            "parseTime": self.parseTime,
+            "lines": self.lines,
+            "histogram": self.histogram.toDict()
+        }
+
+    def __str__(self):
+        return "%-18s %8d %6d %12.6f %12.6f %10d %10s" % (self.command, self.count, self.errors,
+            self.waitTime, self.parseTime, self.lines, self.histogram.percentile(95))
+
+class SynoACLInstrumentation:
+    """Collects statistics of the synoacltool invocations done by SynoACLTool.
+
+    Enable it by SynoACLTool.setInstrumentation:
+
+    ::
+
+        instrumentation = SynoACLInstrumentation()
+        SynoACLTool.setInstrumentation(instrumentation)
+        ...
+        print(instrumentation)
+
+    For each subcommand (-get, -add, ...) it keeps the number of calls and
+    failures, the total time spent waiting for synoacltool and parsing its
+    output, the number of output lines and a latency histogram (see
+    SynoACLCallStats). Hooks (see SynoACLHook) are notified of each call.
+
+    When no instrumentation is set, SynoACLTool doesn't measure anything.
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._hooks = []
+        self._lock = threading.Lock()
+
+    def addHook(self, hook):
+        with self._lock:
+            self._hooks = self._hooks + [hook]
+
+    def removeHook(self, hook):
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h is not hook]
+
+    @staticmethod
+    def _countLines(output):
+        if output is None:
+            return 0
+        # the output ends with a newline, so the last item of the split output is empty
+        if len(output) > 0 and output[-1] == "":
+            return len(output) - 1
+        return len(output)
+
+    def run(self, communicate, args, parser):
+        """Run communicate(args) and parse the output with parser (if not None), recording the call."""
+        hooks = self._hooks
+        contexts = [hook.callStarted(args) for hook in hooks]
+
+        output = None
+        error = None
+        start = default_timer()
+        parseStart = None
+        try:
+            output = communicate(args)
+            parseStart = default_timer()
+            if parser is not None:
+                return parser(output)
+            return output
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            end = default_timer()
+            if parseStart is None:
+                parseStart = end
+            call = SynoACLCall(args, parseStart - start, end - parseStart, SynoACLInstrumentation._countLines(output), error)
+            self.record(call)
+            for (hook, context) in zip(hooks, contexts):
+                hook.callFinished(call, context)
+
+    def stream(self, communicateStream, args):
+        """Iterate over the lines of communicateStream(args), recording the call.
+
+        The time spent waiting for the next line is counted as waitTime, the
+        rest (the consumer working on the lines) as parseTime. The call is
+        recorded when the iteration ends (or the generator is closed).
+        """
+        hooks = self._hooks
+        contexts = [hook.callStarted(args) for hook in hooks]
+
+        lines = 0
+        waitTime = 0.0
+        error = None
+        start = default_timer()
+        try:
+            iterator = iter(communicateStream(args))
+            while True:
+                before = default_timer()
+                try:
+                    line = next(iterator)
+                except StopIteration:
+                    waitTime += default_timer() - before
+                    break
+                waitTime += default_timer() - before
+                lines += 1
+                yield line
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            call = SynoACLCall(args, waitTime, default_timer() - start - waitTime, lines, error)
+            self.record(call)
+            for (hook, context) in zip(hooks, contexts):
+                hook.callFinished(call, context)
+
+    def record(self, call):
+        """Add a SynoACLCall to the statistics."""
+        with self._lock:
+            stats = self._stats.get(call.command)
+            if stats is None:
+                stats = SynoACLCallStats(call.command)
+                self._stats[call.command] = stats
+            stats.add(call)
+
+    def stats(self):
+        """Return a dict of subcommand -> SynoACLCallStats."""
+        with self._lock:
+            return dict(self._stats)
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def toDict(self):
+        """Return the statistics as a dict (e.g. for JSON export)."""
+        with self._lock:
+            return dict((command, stats.toDict()) for (command, stats) in self._stats.items())
+
+    def __str__(self):
+        lines = ["%-18s %8s %6s %12s %12s %10s %10s" % ("command", "calls", "errors", "wait [s]", "parse [s]", "lines", "p95 [s]")]
+        for command in sorted(self.stats()):
+            lines.append(str(self._stats[command]))
+        return "\n".join(lines)
@@ -0,0 +1,276 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import os
+import threading
+from timeit import default_timer
+
+from synoacl.tool import SynoACLTool
+from synoacl.reconcile import SynoACLReconcileSummary, SynoACLReconciler
+from synoacl.snapshot import SynoACLSnapshot
+
+class SynoACLJournal:
+    """An append-only journal of the work done by a SynoACLJob.
+
+    The journal is a text file with one record per line, fields separated
+    by tabs (paths and messages escaped as in snapshots):
+
+    ::
+
+        synoacl-journal 1 <name>
+        P <path> [<operation>]...     the changes planned for path
+        D <path>                      path is done
+        F <path> <error>              path failed
+
+    To keep the journal from becoming the bottleneck, the records are not
+    synced to the disk one by one: an fsync is done after syncEvery
+    records or syncInterval seconds, whichever comes first, and on
+    close. A crash can lose the last unsynced records; the paths they
+    were about are then done again on resume, which is harmless as the
+    changes are planned against the actual state of each path. A record
+    cut short by a crash is dropped when the journal is opened.
+    """
+
+    HEADER = "synoacl-journal 1"
+
+    def __init__(self, fileName, name = "", syncEvery = 1000, syncInterval = 1.0, readOnly = False):
+        self.fileName = fileName
+        self.name = name
+        self.syncEvery = syncEvery
+        self.syncInterval = syncInterval
+        # the paths done (and failed, path -> error message) so far according to the journal
+        self.done = set()
+        self.failed = {}
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._lastSync = default_timer()
+        self._readOnly = readOnly
+
+        exists = self._load()
+        self._file = None
+        if not readOnly:
+            self._file = open(fileName, "a", encoding = "utf-8", newline = "\n")
+            if not exists:
+                self._write(SynoACLJournal.HEADER + "\t" + SynoACLSnapshot.escape(name))
+                self.sync()
+
+    def _load(self):
+        """Read the existing journal (if any); returns False if there is none."""
+        try:
+            f = open(self.fileName, "rb")
+        except FileNotFoundError:
+            return False
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            end = 0
+            first = True
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # cut short by a crash
+                    break
+                end += len(line)
+                fields = line[:-1].decode("utf-8").split("\t")
+                if first:
+                    first = False
+                    self._checkHeader(fields)
+                    continue
+                kind = fields[0]
+                path = SynoACLSnapshot.unescape(fields[1])
+                if kind == "D":
+                    self.done.add(path)
+                    self.failed.pop(path, None)
+                elif kind == "F":
+                    self.failed[path] = SynoACLSnapshot.unescape(fields[2])
+                elif kind != "P":
+                    raise Exception(f"Unexpected record in journal {self.fileName}: {kind}")
+
+        if self._readOnly:
+            return not first
+        if first:
+            # not even the header made it to the disk
+            os.remove(self.fileName)
+            return False
+        if end != size:
+            with open(self.fileName, "r+b") as f:
+                f.truncate(end)
+        return True
+
+    def _checkHeader(self, fields):
+        if fields[0] != SynoACLJournal.HEADER:
+            raise Exception(f"{self.fileName} is not a synoacl journal")
+        name = SynoACLSnapshot.unescape(fields[1]) if len(fields) > 1 else ""
+        if name != self.name:
+            raise Exception(f"Journal {self.fileName} is for job '{name}', not for '{self.name}'")
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(record + "\n")
+            self._unsynced += 1
+            if self._unsynced >= self.syncEvery or default_timer() - self._lastSync >= self.syncInterval:
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._lastSync = default_timer()
+
+    def sync(self):
+        """Write all the records to the disk."""
+        with self._lock:
+            self._sync()
+
+    def isDone(self, path):
+        return path in self.done
+
+    def plan(self, path, changes):
+        """Record the changes (e.g. SynoACLOperation) planned for path."""
+        self._write("\t".join(["P", SynoACLSnapshot.escape(path)] + [SynoACLSnapshot.escape(str(change)) for change in changes]))
+
+    def markDone(self, path):
+        self.done.add(path)
+        self.failed.pop(path, None)
+        self._write("D\t" + SynoACLSnapshot.escape(path))
+
+    def markFailed(self, path, error):
+        self.failed[path] = str(error)
+        self._write("F\t" + SynoACLSnapshot.escape(path) + "\t" + SynoACLSnapshot.escape(str(error)))
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+class SynoACLJobSummary(SynoACLReconcileSummary):
+    """The outcome of a SynoACLJob run: a SynoACLReconcileSummary of this run plus
+    skipped, the number of items left out as the journal says they are done."""
+    def __init__(self):
+        SynoACLReconcileSummary.__init__(self)
+        self.skipped = 0
+
+    def __str__(self):
+        return SynoACLReconcileSummary.__str__(self) + f", skipped: {self.skipped}"
+
+class SynoACLJob:
+    """Runs a long operation over many paths so that it can be interrupted and resumed.
+
+    The progress is kept in a SynoACLJournal: the changes planned for each
+    path and which paths are done. When the job is run again with the same
+    journal (and name), the paths that are done are skipped and the ones
+    that failed are retried:
+
+    ::
+
+        with SynoACLJob("/root/migration.journal", name = "migration") as job:
+            print(job.reconcile(items, concurrency = 8))
+
+    A dry run only reads the journal (it tells what is left to do).
+    """
+
+    def __init__(self, journalFile, name = "", syncEvery = 1000, syncInterval = 1.0, dryRun = False):
+        self.dryRun = dryRun
+        self.journal = SynoACLJournal(journalFile, name, syncEvery, syncInterval, readOnly = dryRun)
+
+    def close(self):
+        self.journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    @staticmethod
+    def _archiveChangesToStrings(archiveChanges):
+        if not SynoACLReconcileSummary.isArchiveChanged(archiveChanges):
+            return []
+        (flagsToDrop, flagsToSet) = archiveChanges
+        changes = []
+        if not flagsToDrop.isNone():
+            changes.append(f"del-archive {flagsToDrop}")
+        if not flagsToSet.isNone():
+            changes.append(f"set-archive {flagsToSet}")
+        return changes
+
+    def _planned(self, path, operations, archiveChanges):
+        if not self.dryRun:
+            self.journal.plan(path, [str(operation) for operation in operations] +
+                SynoACLJob._archiveChangesToStrings(archiveChanges))
+
+    def run(self, items, process, concurrency = None, progress = None):
+        """Call process(item) for each item that is not done yet, up to concurrency at once.
+
+        items is an iterable of tuples whose first item is the path (consumed
+        lazily). process(item) does the work for one path and returns
+        (operations, archiveChanges) like SynoACLReconciler.reconcileItems
+        records them (archiveChanges may be None). It should call
+        self.journal.plan before changing anything. progress(path, summary)
+        is called after each path.
+
+        Returns a SynoACLJobSummary.
+        """
+        summary = SynoACLJobSummary()
+
+        def pending():
+            for item in items:
+                if self.journal.isDone(item[0]):
+                    summary.skipped += 1
+                else:
+                    yield item
+
+        for result in SynoACLTool.getExecutor().imap(process, pending(), concurrency):
+            path = result.path[0]
+            if result.ok:
+                summary.addResult(path, *result.value)
+                if not self.dryRun:
+                    self.journal.markDone(path)
+            else:
+                summary.addFailure(path, result.error)
+                if not self.dryRun:
+                    self.journal.markFailed(path, result.error)
+            if progress is not None:
+                progress(path, summary)
+        return summary
+
+    def reconcile(self, items, concurrency = None, progress = None):
+        """Bring each path to its desired state, see SynoACLReconciler.reconcileItems.
+
+        items is an iterable of (path, acls, archive); acls (or archive) can
+        be None to leave the ACL entries (or the archive flags) alone, which
+        makes this a resumable, tree-wide adaptTo or setArchiveTo.
+        """
+        def process(item):
+            (path, acls, archive) = item
+            return SynoACLReconciler.reconcilePath(path, acls, archive, self.dryRun, self._planned)
+        return self.run(items, process, concurrency, progress)
+
+    def reset(self, items, concurrency = None, progress = None):
+        """Set the direct ACL entries of each path (items is an iterable of (path, acls)).
+
+        Unlike SynoACLTool.reset, this only changes the entries that differ
+        (by adaptTo), so redoing a path after an interruption is cheap.
+        """
+        return self.reconcile(((path, acls, None) for (path, acls) in items), concurrency, progress)
@@ -0,0 +1,297 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import json
+import os
+
+from synoacl.tool import SynoACLArchive, SynoACLTool
+from synoacl.reconcile import SynoACLReconcileSummary
+
+class SynoACLPropagationSummary(SynoACLReconcileSummary):
+    """The outcome of SynoACLPropagator.propagate.
+
+    On top of SynoACLReconcileSummary, enforced lists the changed paths
+    that enforceInherit was (or would be) run on - the other changed paths
+    only had their archive flags changed - and skipped is the number of
+    paths (and whole subtrees) left out because a checkpoint said they
+    were already done.
+    """
+    def __init__(self):
+        SynoACLReconcileSummary.__init__(self)
+        self.enforced = []
+        self.skipped = 0
+
+    def __str__(self):
+        return SynoACLReconcileSummary.__str__(self) + f", enforced: {len(self.enforced)}, skipped: {self.skipped}"
+
+class SynoACLPropagationCheckpoint:
+    """How far a SynoACLPropagator.propagate run got, kept in a JSON file.
+
+    All the paths up to last (in the order of the walk) were processed,
+    except for the failed ones which are retried when resuming and the
+    paths below the directories in unlisted (those that couldn't be
+    listed), which are walked again when resuming. The file
+    is replaced atomically, so an interruption while saving leaves the
+    previous checkpoint in place.
+    """
+
+    FORMAT = 1
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.root = None
+        self.last = None
+        self.failed = []
+        self.unlisted = []
+
+    def load(self):
+        """Read the checkpoint; returns False (and leaves it empty) if the file doesn't exist."""
+        try:
+            with open(self.fileName) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        if data.get("format") != SynoACLPropagationCheckpoint.FORMAT:
+            raise Exception(f"Unsupported checkpoint format in {self.fileName}: {data.get('format')}")
+        self.root = data["root"]
+        self.last = data["last"]
+        self.failed = data["failed"]
+        self.unlisted = data.get("unlisted", [])
+        return True
+
+    def save(self):
+        data = { "format": SynoACLPropagationCheckpoint.FORMAT, "root": self.root, "last": self.last, "failed": self.failed,
+            "unlisted": self.unlisted }
+        tempFileName = self.fileName + ".tmp"
+        with open(tempFileName, "w") as f:
+            json.dump(data, f)
+        os.replace(tempFileName, self.fileName)
+
+    def remove(self):
+        try:
+            os.remove(self.fileName)
+        except FileNotFoundError:
+            pass
+
+class SynoACLPropagator:
+    """Makes the paths below a root inherit the root's ACLs: a parallel, recursive SynoACLTool.enforceInherit.
+
+    The tree is walked top-down (in the order of SynoACLTool.walk) and
+    only the archive flags of each path are read: a path that has ACL
+    entries of its own (has_ACL) or doesn't inherit (no is_inherit) gets
+    enforceInherit. With archive, the paths' archive flags are also
+    brought to archive by setArchiveTo. The other paths cost a single
+    synoacltool -get-archive. Up to concurrency paths are processed at
+    once (see SynoACLExecutor.imap). The root itself is not changed and
+    the paths in "Linux mode" (without is_support_ACL) are left alone.
+
+    A long run can be checkpointed to a file and resumed after an
+    interruption (see propagate).
+    """
+
+    # the number of processed paths between two checkpoint saves
+    CHECKPOINT_INTERVAL = 1000
+
+    @staticmethod
+    def _components(path):
+        return tuple(part for part in path.split(os.sep) if part != "")
+
+    @staticmethod
+    def _isDone(components, lastComponents):
+        """Return True if the path with components is at or before the last checkpointed path in the walk order."""
+        # the walk order is depth-first with sorted names, i.e. the order of the path components
+        return components <= lastComponents
+
+    @staticmethod
+    def _canPrune(components, lastComponents):
+        """Return True if the path and everything below it come before the last checkpointed path."""
+        return components < lastComponents and lastComponents[:len(components)] != components
+
+    @staticmethod
+    def _propagatePath(path, archive, dryRun):
+        """Make a single path inherit; returns (enforce, archiveChanges)."""
+        existing = SynoACLTool.getArchive(path)
+        if not existing.isSupportACL:
+            return (False, None)
+
+        enforce = existing.hasACL or not existing.isInherit
+        expected = existing
+        if enforce:
+            # enforceInherit drops the entries and sets is_inherit
+            expected = SynoACLArchive.fromFlags((existing.flags | SynoACLArchive.Flag.IS_INHERIT) & ~SynoACLArchive.Flag.HAS_ACL)
+
+        archiveChanges = None
+        if archive is not None:
+            archiveChanges = SynoACLTool.planSetArchiveTo(expected, archive)
+
+        if not dryRun:
+            if enforce:
+                SynoACLTool.enforceInherit(path)
+            if archiveChanges is not None and not (archiveChanges[0].isNone() and archiveChanges[1].isNone()):
+                SynoACLTool.setArchiveTo(path, archive, expected)
+        return (enforce, archiveChanges)
+
+    @staticmethod
+    def propagate(root, concurrency = None, archive = None, dryRun = False, progress = None, checkpoint = None,
+            exclude = (), maxDepth = None, includeFiles = False, followLinks = False):
+        """Make all the directories below root inherit the ACLs of root.
+
+        archive, if given, are the archive flags the paths below root should
+        have (is_inherit is always added); without it only is_inherit is
+        checked. exclude, maxDepth, includeFiles (by default only
+        directories are processed) and followLinks limit the walk as in
+        SynoACLTool.walk. With dryRun nothing is changed.
+
+        progress(path, summary) is called after each path is processed,
+        with the summary so far.
+
+        checkpoint is the name of a file to record the progress in, every
+        CHECKPOINT_INTERVAL paths and when the run stops early (e.g. on
+        KeyboardInterrupt). If the file exists, the run resumes after the
+        recorded path and retries the paths that failed before (walking
+        again below the directories that couldn't be listed). The file
+        is removed when the run finishes. Paths that were being processed
+        when the run was interrupted are checked again on resume, which is
+        harmless as changing them again is a no-op. Dry runs don't use the
+        checkpoint.
+
+        Returns a SynoACLPropagationSummary of this run (resumed paths are
+        only counted in skipped).
+        """
+        if archive is not None:
+            archive = archive | SynoACLArchive(isInherit = True)
+
+        state = None
+        if checkpoint is not None and not dryRun:
+            state = SynoACLPropagationCheckpoint(checkpoint)
+            if state.load() and state.root != root:
+                raise Exception(f"Checkpoint {checkpoint} is for {state.root}, not for {root}")
+            state.root = root
+
+        summary = SynoACLPropagationSummary()
+        lastComponents = None
+        retry = []
+        # the directories that couldn't be listed before and in this run
+        retryUnlisted = []
+        unlisted = []
+        if state is not None and state.last is not None:
+            lastComponents = SynoACLPropagator._components(state.last)
+            retry = list(state.failed)
+            retryUnlisted = list(state.unlisted)
+            state.failed = []
+
+        def prune(path):
+            if lastComponents is None:
+                return False
+            if SynoACLPropagator._canPrune(SynoACLPropagator._components(path), lastComponents):
+                summary.skipped += 1
+                return True
+            return False
+
+        def onError(path, error):
+            if path not in summary.errors:
+                summary.failed.append(path)
+            summary.errors[path] = error
+
+        def onListError(path, error):
+            onError(path, error)
+            unlisted.append(path)
+
+        # the paths below retryUnlisted, processed like the retried ones
+        rewalked = set()
+
+        def paths():
+            for path in retry:
+                yield path
+            rootDepth = len(SynoACLPropagator._components(root))
+            for directory in retryUnlisted:
+                # nothing below the directory was processed, walk it again up to the checkpoint (the main
+                # walk below goes on after it)
+                depthLeft = None
+                if maxDepth is not None:
+                    depthLeft = maxDepth - (len(SynoACLPropagator._components(directory)) - rootDepth)
+                for (path, depth, isDir) in SynoACLTool.walkPaths(directory, exclude, depthLeft, includeFiles,
+                        followLinks, onListError):
+                    if depth == 0 or path in retrySet or path in rewalked or \
+                            not SynoACLPropagator._isDone(SynoACLPropagator._components(path), lastComponents):
+                        continue
+                    rewalked.add(path)
+                    yield path
+            for (path, depth, isDir) in SynoACLTool.walkPaths(root, exclude, maxDepth, includeFiles, followLinks,
+                    onListError, prune):
+                if depth == 0:
+                    continue
+                if lastComponents is not None and SynoACLPropagator._isDone(SynoACLPropagator._components(path), lastComponents):
+                    summary.skipped += 1
+                    continue
+                yield path
+
+        retried = set()
+        def failedPaths():
+            # the retried paths that didn't succeed (yet) and the new failures
+            return [path for path in retry if path not in retried] + \
+                [path for path in summary.failed if path not in retrySet]
+
+        retrySet = set(retry)
+        completed = False
+        sinceCheckpoint = 0
+        try:
+            for result in SynoACLTool.getExecutor().imap(lambda path: SynoACLPropagator._propagatePath(path, archive, dryRun),
+                    paths(), concurrency):
+                path = result.path
+                if not result.ok:
+                    onError(path, result.error)
+                else:
+                    (enforce, archiveChanges) = result.value
+                    archiveChanged = archiveChanges is not None and \
+                        not (archiveChanges[0].isNone() and archiveChanges[1].isNone())
+                    if enforce or archiveChanged:
+                        summary.changed.append(path)
+                        if enforce:
+                            summary.enforced.append(path)
+                        if archiveChanged:
+                            summary.archiveChanges[path] = archiveChanges
+                    else:
+                        summary.unchanged.append(path)
+
+                if state is not None:
+                    if path in retrySet or path in rewalked:
+                        if result.ok:
+                            retried.add(path)
+                    else:
+                        state.last = path
+                        sinceCheckpoint += 1
+                        if sinceCheckpoint >= SynoACLPropagator.CHECKPOINT_INTERVAL:
+                            state.failed = failedPaths()
+                            state.unlisted = list(dict.fromkeys(retryUnlisted + unlisted))
+                            state.save()
+                            sinceCheckpoint = 0
+
+                if progress is not None:
+                    progress(path, summary)
+            completed = True
+        finally:
+            if state is not None:
+                if completed:
+                    state.remove()
+                else:
+                    state.failed = failedPaths()
+                    # the retried directories are walked again until the run completes
+                    state.unlisted = list(dict.fromkeys(retryUnlisted + unlisted))
+                    state.save()
+        return summary
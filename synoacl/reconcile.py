@@ -0,0 +1,188 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import glob
+
+from synoacl.tool import SynoACLSet, SynoACLTool
+
+class SynoACLReconcileSummary:
+    """The outcome of SynoACLReconciler.reconcile.
+
+    changed, unchanged and failed are lists of paths (in the order they
+    were processed); errors maps each failed path to its exception.
+    For changed paths, operations holds the SynoACLOperation list and
+    archiveChanges the (flagsToDrop, flagsToSet) pair that were (or, in a
+    dry run, would be) applied.
+    """
+    def __init__(self):
+        self.changed = []
+        self.unchanged = []
+        self.failed = []
+        self.errors = {}
+        self.operations = {}
+        self.archiveChanges = {}
+
+    def isSuccess(self):
+        return len(self.failed) == 0
+
+    @staticmethod
+    def isArchiveChanged(archiveChanges):
+        """Return True if an archive (flagsToDrop, flagsToSet) pair (or None) changes anything."""
+        return archiveChanges is not None and not (archiveChanges[0].isNone() and archiveChanges[1].isNone())
+
+    def addResult(self, path, operations, archiveChanges):
+        """Record the outcome of a path: the operations and the archive changes (or None) done to it."""
+        if len(operations) == 0 and not SynoACLReconcileSummary.isArchiveChanged(archiveChanges):
+            self.unchanged.append(path)
+            return
+        self.changed.append(path)
+        self.operations[path] = operations
+        if archiveChanges is not None:
+            self.archiveChanges[path] = archiveChanges
+
+    def addFailure(self, path, error):
+        self.failed.append(path)
+        self.errors[path] = error
+
+    def __str__(self):
+        return "changed: " + str(len(self.changed)) + ", unchanged: " + str(len(self.unchanged)) + \
+            ", failed: " + str(len(self.failed))
+
+class SynoACLReconciler:
+    """Brings many paths to a desired state of ACL entries and archive flags.
+
+    This is SynoACLTool.adaptTo and SynoACLTool.setArchiveTo applied to
+    a whole set of paths: each path is read, compared with the desired state
+    and changed only if it differs. Paths are processed in parallel through
+    the executor of SynoACLTool.
+    """
+
+    @staticmethod
+    def _isPattern(path):
+        return any(c in path for c in "*?[")
+
+    @staticmethod
+    def expand(desired):
+        """Turn a mapping of path or glob pattern -> desired state into a list of (path, desired state).
+
+        Explicitly listed paths take precedence over glob patterns. A path
+        matched by more than one pattern (and not listed explicitly) is
+        an error as it's not clear which state is to be applied.
+        """
+        explicit = {}
+        fromPatterns = {}
+        for (key, state) in desired.items():
+            if not SynoACLReconciler._isPattern(key):
+                explicit[key] = state
+                continue
+            for path in glob.glob(key):
+                if path in fromPatterns and fromPatterns[path][0] != key:
+                    raise Exception("Path " + path + " is matched by both '" + fromPatterns[path][0] +
+                        "' and '" + key + "'")
+                fromPatterns[path] = (key, state)
+
+        for (path, (key, state)) in fromPatterns.items():
+            explicit.setdefault(path, state)
+
+        return sorted(explicit.items())
+
+    @staticmethod
+    def directACLs(acls):
+        """Return the direct entries of acls - a SynoACLSet (see SynoACLSet.getDirect) or a list of SynoACL, returned as is."""
+        if isinstance(acls, SynoACLSet):
+            return acls.getDirect()
+        return acls
+
+    @staticmethod
+    def reconcilePath(path, acls, archive, dryRun = False, onPlanned = None, ordered = False):
+        """Bring a single path to the desired state (see reconcileItems for acls and archive).
+
+        With ordered, the direct ACL entries are also brought to the order
+        of acls (see SynoACLTool.compilePolicy).
+
+        Returns (operations, archiveChanges) - archiveChanges being None if
+        the archive flags are not managed (archive is None). If given,
+        onPlanned(path, operations, archiveChanges) is called before
+        anything is changed.
+        """
+        operations = []
+        if acls is not None:
+            existingAcls = SynoACLTool.get(path).getDirect()
+            if ordered:
+                operations = SynoACLTool.compilePolicy(existingAcls, SynoACLReconciler.directACLs(acls))
+            else:
+                operations = SynoACLTool.planAdaptTo(existingAcls, SynoACLReconciler.directACLs(acls))
+
+        archiveChanges = None
+        if archive is not None:
+            existingArchive = SynoACLTool.getArchive(path)
+            archiveChanges = SynoACLTool.planSetArchiveTo(existingArchive, archive)
+
+        if onPlanned is not None:
+            onPlanned(path, operations, archiveChanges)
+
+        if not dryRun:
+            if len(operations) > 0:
+                SynoACLTool.applyOperations(path, operations, existingAcls)
+                if archive is not None:
+                    # changing the ACL entries may affect the archive flags
+                    SynoACLTool.setArchiveTo(path, archive)
+            elif archiveChanges is not None:
+                SynoACLTool.setArchiveTo(path, archive, existingArchive)
+
+        return (operations, archiveChanges)
+
+    @staticmethod
+    def reconcileItems(items, concurrency = None, dryRun = False, ordered = False):
+        """Bring each path to its desired state.
+
+        items is an iterable of (path, acls, archive) where acls is a SynoACLSet
+        (only the direct entries are considered), a list of SynoACL or None
+        to leave the ACL entries alone and archive is a SynoACLArchive or
+        None to leave the archive flags alone. items is consumed lazily.
+
+        Up to concurrency paths (defaults to the executor's concurrency) are
+        processed at once. With dryRun, nothing is changed but the summary
+        tells what would be. With ordered, the order of the ACL entries is
+        kept too (as in SynoACLTool.adaptTo).
+
+        Returns a SynoACLReconcileSummary.
+        """
+        def process(item):
+            (path, acls, archive) = item
+            return SynoACLReconciler.reconcilePath(path, acls, archive, dryRun, ordered = ordered)
+
+        summary = SynoACLReconcileSummary()
+        for result in SynoACLTool.getExecutor().imap(process, items, concurrency):
+            if result.ok:
+                summary.addResult(result.path[0], *result.value)
+            else:
+                summary.addFailure(result.path[0], result.error)
+        return summary
+
+    @staticmethod
+    def reconcile(desired, concurrency = None, dryRun = False):
+        """Bring all paths in desired to the requested state.
+
+        desired maps a path or a glob pattern to an (acls, archive) pair
+        (see reconcileItems and expand).
+
+        Returns a SynoACLReconcileSummary.
+        """
+        items = ((path, acls, archive) for (path, (acls, archive)) in SynoACLReconciler.expand(desired))
+        return SynoACLReconciler.reconcileItems(items, concurrency, dryRun)
@@ -0,0 +1,276 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import contextlib
+import contextvars
+import heapq
+import itertools
+import threading
+from timeit import default_timer
+
+from synoacl.instrument import SynoACLHistogram
+
+class SynoACLPriorityStats:
+    """Statistics of the synoacltool calls of one priority class (see SynoACLScheduler.stats)."""
+
+    def __init__(self, priority):
+        self.priority = priority
+        self.calls = 0
+        self.queued = 0
+        self.waitTime = 0.0
+        self.maxWaitTime = 0.0
+        self.waitHistogram = SynoACLHistogram()
+
+    def add(self, waitTime):
+        self.calls += 1
+        self.waitTime += waitTime
+        self.maxWaitTime = max(self.maxWaitTime, waitTime)
+        self.waitHistogram.add(waitTime)
+
+    def toDict(self):
+        return {
+            "calls": self.calls,
+            "queued": self.queued,
+            "waitTime": self.waitTime,
+            "maxWaitTime": self.maxWaitTime,
+            "waitHistogram": self.waitHistogram.toDict()
+        }
+
+    def __str__(self):
+        return "%-12s %8d %8d %12.6f %12.6f %10s" % (SynoACLScheduler.PRIORITY_NAMES[self.priority], self.calls,
+            self.queued, self.waitTime, self.maxWaitTime, self.waitHistogram.percentile(95))
+
+class SynoACLScheduler:
+    """Decides when the synoacltool calls made by SynoACLTool run.
+
+    Enable it by SynoACLTool.setScheduler. Each call waits for a free slot
+    (at most the current concurrency limit of calls run at once) and, if
+    rate is set, for a token from a token bucket (rate calls per second on
+    average with bursts of up to burst calls). Waiting calls are let
+    through by priority class first and in the order they came within a
+    class. By default, reads (-get, -get-archive) are INTERACTIVE and
+    changes are BULK, so a get doesn't wait behind a long adaptTo sweep;
+    priority() sets the class for a block of code (including the calls
+    it makes through SynoACLExecutor.imap).
+
+    If maxConcurrency is given, the concurrency limit adapts to the
+    latency of the calls (additive increase, multiplicative decrease)
+    between minConcurrency and maxConcurrency: each call faster than the
+    target latency raises the limit by 1/limit, a slower call halves it
+    (at most once per limit calls). targetLatency defaults to
+    LATENCY_TOLERANCE times the lowest latency seen so far. The executor's
+    concurrency must be at least maxConcurrency for the limit to matter.
+
+    stats and toDict give the queue depths, the wait times, the number of
+    running calls and the current limit.
+    """
+
+    INTERACTIVE = 0
+    NORMAL = 1
+    BULK = 2
+    PRIORITY_NAMES = { INTERACTIVE: "interactive", NORMAL: "normal", BULK: "bulk" }
+
+    LATENCY_TOLERANCE = 2.0
+
+    _READ_COMMANDS = frozenset(["-get", "-get-archive"])
+    _priority = contextvars.ContextVar("synoaclPriority", default = None)
+
+    def __init__(self, concurrency = 4, rate = None, burst = 1, minConcurrency = 1, maxConcurrency = None, targetLatency = None):
+        if concurrency < 1:
+            raise Exception(f"Concurrency must be at least 1, got: {concurrency}")
+        if rate is not None and rate <= 0:
+            raise Exception(f"Rate must be positive, got: {rate}")
+        if burst < 1:
+            raise Exception(f"Burst must be at least 1, got: {burst}")
+        self.rate = rate
+        self.burst = burst
+        self.minConcurrency = minConcurrency
+        self.maxConcurrency = maxConcurrency
+        self.targetLatency = targetLatency
+
+        self._condition = threading.Condition()
+        self._limit = float(concurrency)
+        self._running = 0
+        self._tokens = float(burst)
+        self._refilled = default_timer()
+        # heap of (priority, sequence number) of the waiting calls
+        self._queue = []
+        self._sequence = itertools.count()
+        self._minLatency = None
+        self._sinceDecrease = 0
+        self._stats = dict((priority, SynoACLPriorityStats(priority)) for priority in SynoACLScheduler.PRIORITY_NAMES)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority(priority):
+        """Run the synoacltool calls made in the with block (and by the executor on its behalf) with priority."""
+        token = SynoACLScheduler._priority.set(priority)
+        try:
+            yield
+        finally:
+            SynoACLScheduler._priority.reset(token)
+
+    @staticmethod
+    def classify(args):
+        """Return the priority class of a call of synoacltool with args."""
+        priority = SynoACLScheduler._priority.get()
+        if priority is not None:
+            return priority
+        return SynoACLScheduler.INTERACTIVE if args[0] in SynoACLScheduler._READ_COMMANDS else SynoACLScheduler.BULK
+
+    @property
+    def concurrency(self):
+        """The current concurrency limit."""
+        return int(self._limit)
+
+    def _takeToken(self, now):
+        """Take a token from the bucket; returns 0 if there was one, otherwise the time until there will be one."""
+        if self.rate is None:
+            return 0
+        self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0
+        return (1.0 - self._tokens) / self.rate
+
+    def acquire(self, args):
+        """Wait until a call of synoacltool with args may run; returns its priority (to be passed to release)."""
+        priority = SynoACLScheduler.classify(args)
+        stats = self._stats[priority]
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._queue, entry)
+            stats.queued += 1
+            enqueued = default_timer()
+            try:
+                while True:
+                    if self._queue[0] is entry and self._running < int(self._limit):
+                        wait = self._takeToken(default_timer())
+                        if wait == 0:
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                stats.queued -= 1
+                self._condition.notify_all()
+                raise
+
+            heapq.heappop(self._queue)
+            stats.queued -= 1
+            self._running += 1
+            stats.add(default_timer() - enqueued)
+            # the next call in the queue may be able to run too
+            self._condition.notify_all()
+        return priority
+
+    def release(self, priority, latency):
+        """Mark a call (acquired with priority) done after running for latency seconds."""
+        with self._condition:
+            self._running -= 1
+            self._adapt(latency)
+            self._condition.notify_all()
+
+    def _adapt(self, latency):
+        if self.maxConcurrency is None:
+            return
+        if self._minLatency is None or latency < self._minLatency:
+            self._minLatency = latency
+        targetLatency = self.targetLatency
+        if targetLatency is None:
+            targetLatency = self._minLatency * SynoACLScheduler.LATENCY_TOLERANCE
+
+        self._sinceDecrease += 1
+        if latency > targetLatency:
+            if self._sinceDecrease >= self._limit:
+                self._limit = max(float(self.minConcurrency), self._limit / 2)
+                self._sinceDecrease = 0
+        else:
+            self._limit = min(float(self.maxConcurrency), self._limit + 1.0 / self._limit)
+
+    @contextlib.contextmanager
+    def slot(self, args):
+        """Hold a slot for a call of synoacltool with args for the duration of the with block."""
+        priority = self.acquire(args)
+        start = default_timer()
+        try:
+            yield priority
+        finally:
+            self.release(priority, default_timer() - start)
+
+    def run(self, communicate, args):
+        """Run communicate(args) when the scheduler lets it."""
+        with self.slot(args):
+            return communicate(args)
+
+    def stream(self, communicateStream, args):
+        """Iterate over communicateStream(args) when the scheduler lets it.
+
+        The slot is held until the iteration ends, so the consumer must
+        exhaust or close the iterator (SynoACLTool does so even when the
+        parsing fails). Closing it also closes the underlying stream.
+        """
+        with self.slot(args):
+            lines = communicateStream(args)
+            try:
+                for line in lines:
+                    yield line
+            finally:
+                close = getattr(lines, "close", None)
+                if close is not None:
+                    close()
+
+    def stats(self):
+        """Return a dict of priority -> SynoACLPriorityStats (copies)."""
+        with self._condition:
+            result = {}
+            for (priority, stats) in self._stats.items():
+                copy = SynoACLPriorityStats(priority)
+                copy.__dict__.update(stats.__dict__)
+                copy.waitHistogram = SynoACLHistogram(stats.waitHistogram.bounds)
+                copy.waitHistogram.counts = list(stats.waitHistogram.counts)
+                result[priority] = copy
+            return result
+
+    def queueDepth(self):
+        """Return the number of calls waiting."""
+        with self._condition:
+            return len(self._queue)
+
+    def toDict(self):
+        """Return the state and the statistics as a dict (e.g. for JSON export)."""
+        with self._condition:
+            return {
+                "running": self._running,
+                "queued": len(self._queue),
+                "concurrency": int(self._limit),
+                "tokens": self._tokens if self.rate is not None else None,
+                "priorities": dict((SynoACLScheduler.PRIORITY_NAMES[priority], stats.toDict())
+                    for (priority, stats) in self._stats.items())
+            }
+
+    def __str__(self):
+        with self._condition:
+            lines = [f"running: {self._running}, queued: {len(self._queue)}, concurrency: {int(self._limit)}",
+                "%-12s %8s %8s %12s %12s %10s" % ("priority", "calls", "queued", "wait [s]", "max wait [s]", "p95 [s]")]
+            for priority in sorted(self._stats):
+                lines.append(str(self._stats[priority]))
+        return "\n".join(lines)
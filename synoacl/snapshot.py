@@ -0,0 +1,228 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import gzip
+import hashlib
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.reconcile import SynoACLReconciler
+
+class SynoACLSnapshot:
+    """Snapshots of the ACLs and archive flags of whole directory trees.
+
+    A snapshot is a gzip-compressed text file with one record per line,
+    fields separated by tabs:
+
+    ::
+
+        synoacl-snapshot 1
+        S <id> [<level> <acl>]...        an ACL set
+        A <id> <archive flags>           a set of archive flags
+        P <acl set id> <archive id> <path>
+
+    Each distinct ACL set and archive is stored once (before the first
+    path that uses it) and the paths refer to it by its ID. The IDs are
+    derived from the content (see aclSetId and archiveId), so equal ACLs
+    have the same ID in all snapshots and two snapshots (or a snapshot
+    and a live tree) can be compared just by the IDs.
+
+    In paths, backslash, tab, carriage return and newline are escaped as
+    \\\\, \\t, \\r and \\n.
+    """
+
+    HEADER = "synoacl-snapshot 1"
+
+    _ESCAPES = [("\\", "\\\\"), ("\t", "\\t"), ("\r", "\\r"), ("\n", "\\n")]
+    _UNESCAPES = {"\\": "\\", "t": "\t", "r": "\r", "n": "\n"}
+
+    @staticmethod
+    def escape(path):
+        """Escape a path (or any string) for a tab-separated line of a snapshot or journal (see unescape)."""
+        for (c, escaped) in SynoACLSnapshot._ESCAPES:
+            path = path.replace(c, escaped)
+        return path
+
+    @staticmethod
+    def unescape(s):
+        """Undo escape."""
+        if "\\" not in s:
+            return s
+        r = []
+        i = 0
+        while i < len(s):
+            c = s[i]
+            if c == "\\" and i + 1 < len(s):
+                i += 1
+                c = SynoACLSnapshot._UNESCAPES.get(s[i], s[i])
+            r.append(c)
+            i += 1
+        return "".join(r)
+
+    @staticmethod
+    def _hash(kind, payload):
+        return hashlib.sha1((kind + "\t" + payload).encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _formatACLSet(acls):
+        fields = []
+        for (acl, level) in acls.getEntries():
+            fields.append(str(level))
+            fields.append(str(acl))
+        return "\t".join(fields)
+
+    @staticmethod
+    def aclSetId(acls):
+        """Return the content ID of a SynoACLSet as used in snapshots."""
+        return SynoACLSnapshot._hash("S", SynoACLSnapshot._formatACLSet(acls))
+
+    @staticmethod
+    def archiveId(archive):
+        """Return the content ID of a SynoACLArchive as used in snapshots."""
+        return SynoACLSnapshot._hash("A", str(archive))
+
+    @staticmethod
+    def create(root, fileName, **walkOptions):
+        """Walk the tree under root and write a snapshot of it to fileName.
+
+        walkOptions are passed to SynoACLTool.walk. Returns the number of paths written.
+        """
+        count = 0
+        with SynoACLSnapshotWriter(fileName) as writer:
+            for (path, archive, acls) in SynoACLTool.walk(root, **walkOptions):
+                writer.write(path, archive, acls)
+                count += 1
+        return count
+
+    @staticmethod
+    def restore(fileName, concurrency = None, dryRun = False):
+        """Restore the ACLs and archive flags recorded in a snapshot.
+
+        Only paths that differ from the snapshot are changed (by an ordered
+        adaptTo and setArchiveTo, see SynoACLReconciler.reconcileItems), up
+        to concurrency paths at a time. The direct ACL entries get back
+        their recorded order too. Returns a SynoACLReconcileSummary.
+        """
+        reader = SynoACLSnapshotReader(fileName)
+        try:
+            items = ((path, acls, archive) for (path, archive, acls) in reader)
+            return SynoACLReconciler.reconcileItems(items, concurrency, dryRun, ordered = True)
+        finally:
+            reader.close()
+
+class SynoACLSnapshotWriter:
+    """Writes a snapshot (see SynoACLSnapshot) path by path."""
+
+    def __init__(self, fileName):
+        self._file = gzip.open(fileName, "wt", encoding = "utf-8", newline = "\n")
+        # SynoACLSet -> ID
+        self._aclSetIds = {}
+        # archive string -> ID
+        self._archiveIds = {}
+        self._file.write(SynoACLSnapshot.HEADER + "\n")
+
+    def _aclSetId(self, acls):
+        try:
+            return self._aclSetIds[acls]
+        except KeyError:
+            payload = SynoACLSnapshot._formatACLSet(acls)
+            aclSetId = SynoACLSnapshot._hash("S", payload)
+            self._aclSetIds[acls] = aclSetId
+            self._file.write("S\t" + aclSetId + ("\t" + payload if payload else "") + "\n")
+            return aclSetId
+
+    def _archiveId(self, archive):
+        payload = str(archive)
+        try:
+            return self._archiveIds[payload]
+        except KeyError:
+            archiveId = SynoACLSnapshot._hash("A", payload)
+            self._archiveIds[payload] = archiveId
+            self._file.write("A\t" + archiveId + "\t" + payload + "\n")
+            return archiveId
+
+    def write(self, path, archive, acls):
+        """Record the archive flags and ACLs of path."""
+        aclSetId = self._aclSetId(acls)
+        archiveId = self._archiveId(archive)
+        self._file.write("P\t" + aclSetId + "\t" + archiveId + "\t" + SynoACLSnapshot.escape(path) + "\n")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+class SynoACLSnapshotReader:
+    """Reads a snapshot (see SynoACLSnapshot) path by path.
+
+    Iterating yields (path, SynoACLArchive, SynoACLSet) in the order the paths
+    were written. entries() yields the IDs instead, which can be looked up in
+    aclSets and archives (these are filled in as the snapshot is read).
+    Only the distinct ACL sets and archives are kept in memory.
+    """
+
+    def __init__(self, fileName):
+        self._file = gzip.open(fileName, "rt", encoding = "utf-8", newline = "\n")
+        header = self._file.readline().rstrip("\n")
+        if header != SynoACLSnapshot.HEADER:
+            self._file.close()
+            raise Exception("Not a synoacl snapshot: " + fileName + " (header: '" + header + "')")
+        # ID -> SynoACLSet
+        self.aclSets = {}
+        # ID -> SynoACLArchive
+        self.archives = {}
+
+    @staticmethod
+    def _parseACLSet(fields):
+        acls = []
+        levels = []
+        for i in range(0, len(fields), 2):
+            levels.append(int(fields[i]))
+            acls.append(SynoACL.intern(fields[i + 1]))
+        return SynoACLSet(acls, levels)
+
+    def entries(self):
+        """Yield (path, aclSetId, archiveId) for each path in the snapshot."""
+        for line in self._file:
+            fields = line.rstrip("\n").split("\t")
+            kind = fields[0]
+            if kind == "P":
+                # the path is the last field and can't contain (unescaped) tabs
+                yield (SynoACLSnapshot.unescape(fields[3]), fields[1], fields[2])
+            elif kind == "S":
+                self.aclSets[fields[1]] = SynoACLSnapshotReader._parseACLSet(fields[2:])
+            elif kind == "A":
+                self.archives[fields[1]] = SynoACLArchive.fromString(fields[2])
+            else:
+                raise Exception("Unexpected record in snapshot: '" + line + "'")
+
+    def __iter__(self):
+        for (path, aclSetId, archiveId) in self.entries():
+            yield (path, self.archives[archiveId], self.aclSets[aclSetId])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
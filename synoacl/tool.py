@@ -16,156 +16,281 @@
 
     Copyright 2015 David Kozub
 """
+import array
+import contextlib
+import enum
+import fnmatch
+import itertools
+import os
 import re
 import subprocess
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+from synoacl.executor import SynoACLExecutor
+
+def _flagProperty(bit):
+    """Create a boolean property that reads/writes one bit of self._mask."""
+    bit = int(bit)
+
+    def getter(self):
+        return (self._mask & bit) != 0
+
+    def setter(self, value):
+        if value:
+            self._mask |= bit
+        else:
+            self._mask &= ~bit
+
+    return property(getter, setter)
+
+def _boolsToMask(flags):
+    """Turn a sequence of booleans into a bitmask, the first item being bit 0."""
+    mask = 0
+    bit = 1
+    for flag in flags:
+        if flag:
+            mask |= bit
+        bit <<= 1
+    return mask
+
+class _Immutable:
+    """Mixin that makes instances of slot-based classes read-only.
+
+    Used for the shared instances handed out by SynoACL.intern().
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Can't set '{name}': shared (interned) ACL objects are immutable")
+
+# the parse/format caches below are cleared when they grow beyond this
+# (only reachable when parsing lots of non-canonical strings)
+_CACHE_LIMIT = 65536
+
+class _FlagSet:
+    """Common base for classes that keep a set of flags in a single integer bitmask.
+
+    Subclasses define Flag - an enum.IntFlag with one member per flag - and
+    _LETTERS - the letters used by synoacltool, one per member of Flag
+    (bit 0 being the first letter) - plus _KIND and the cache dicts; the
+    letter table is built by __init_subclass__. The mask itself is a plain
+    int: equality, hashing and the set operations are integer operations.
+    The set operations return an instance of _PUBLIC, the class that
+    defines Flag, so the result of combining shared (immutable) instances
+    is an ordinary one.
+    """
+    __slots__ = ("_mask",)
+
+    Flag = None
+    _LETTERS = ""
+    _LETTER_BITS = {}
+    _KIND = ""
+    _PUBLIC = None
+    # string -> mask
+    _PARSE_CACHE = {}
+    # mask -> string
+    _FORMAT_CACHE = {}
+
+    def __init_subclass__(cls, **kwargs):
+        if cls.__dict__.get("Flag") is not None:
+            cls._PUBLIC = cls
+            cls._LETTER_BITS = {"-": 0}
+            cls._LETTER_BITS.update(zip(cls._LETTERS, (int(flag) for flag in cls.Flag)))
+
+    @classmethod
+    def _fromMask(cls, mask):
+        r = cls.__new__(cls)
+        object.__setattr__(r, "_mask", mask)
+        return r
+
+    @classmethod
+    def fromFlags(cls, flags):
+        """Create an instance with the flags set (a combination of the Flag members)."""
+        return cls._fromMask(int(flags))
+
+    @classmethod
+    def _parseMask(cls, s):
+        try:
+            return cls._PARSE_CACHE[s]
+        except KeyError:
+            pass
+
+        letterBits = cls._LETTER_BITS
+        mask = 0
+        for c in s:
+            bit = letterBits.get(c)
+            if bit is None:
+                raise Exception(f"Unexpected {cls._KIND} letter: '{c}'")
+            mask |= bit
+
+        if len(cls._PARSE_CACHE) >= _CACHE_LIMIT:
+            cls._PARSE_CACHE.clear()
+        cls._PARSE_CACHE[s] = mask
+        return mask
+
+    @classmethod
+    def _formatMask(cls, mask):
+        return "".join(letter if mask & (1 << i) else "-" for (i, letter) in enumerate(cls._LETTERS))
+
+    @property
+    def mask(self):
+        """The flags as an integer bitmask."""
+        return self._mask
+
+    @property
+    def flags(self):
+        """The flags as a member (or a combination of members) of Flag."""
+        return self.Flag(self._mask)
+
+    def __str__(self):
+        mask = self._mask
+        try:
+            return self._FORMAT_CACHE[mask]
+        except KeyError:
+            pass
+
+        r = self._formatMask(mask)
+        self._FORMAT_CACHE[mask] = r
+        return r
+
+    def __repr__(self):
+        return f"<{self._KIND} {self}>"
+
+    def __eq__(self, other):
+        if not isinstance(other, self.__class__):
+            return NotImplemented
+        return self._mask == other._mask
+
+    def __hash__(self):
+        return hash(self._mask)
+
+    def __and__(self, other):
+        return self._PUBLIC._fromMask(self._mask & other._mask)
+
+    def __or__(self, other):
+        return self._PUBLIC._fromMask(self._mask | other._mask)
+
+    def issubset(self, other):
+        """Return True if all flags set in self are also set in other."""
+        return (self._mask & ~other._mask) == 0
+
+    def issuperset(self, other):
+        """Return True if all flags set in other are also set in self."""
+        return (other._mask & ~self._mask) == 0
+
+    __le__ = issubset
+    __ge__ = issuperset
+
+@dataclass(eq = False, slots = True)
+class SynoACL:
+    class Permissions(_FlagSet):
+        __slots__ = ()
+
+        class Flag(enum.IntFlag):
+            READ_DATA = 1 << 0
+            WRITE_DATA = 1 << 1
+            EXECUTE = 1 << 2
+            APPEND_DATA = 1 << 3
+            DELETE = 1 << 4
+            DELETE_CHILD = 1 << 5
+            READ_ATTRIBUTE = 1 << 6
+            WRITE_ATTRIBUTE = 1 << 7
+            READ_XATTR = 1 << 8
+            WRITE_XATTR = 1 << 9
+            READ_ACL = 1 << 10
+            WRITE_ACL = 1 << 11
+            GET_OWNERSHIP = 1 << 12
+
+        _LETTERS = "rwxpdDaARWcCo"
+        _KIND = "permission"
+        _PARSE_CACHE = {}
+        _FORMAT_CACHE = {}
+
+        READ_DATA = Flag.READ_DATA
+        WRITE_DATA = Flag.WRITE_DATA
+        EXECUTE = Flag.EXECUTE
+        APPEND_DATA = Flag.APPEND_DATA
+        DELETE = Flag.DELETE
+        DELETE_CHILD = Flag.DELETE_CHILD
+        READ_ATTRIBUTE = Flag.READ_ATTRIBUTE
+        WRITE_ATTRIBUTE = Flag.WRITE_ATTRIBUTE
+        READ_XATTR = Flag.READ_XATTR
+        WRITE_XATTR = Flag.WRITE_XATTR
+        READ_ACL = Flag.READ_ACL
+        WRITE_ACL = Flag.WRITE_ACL
+        GET_OWNERSHIP = Flag.GET_OWNERSHIP
 
-class SynoACL(object):
-    class Permissions(object):
         def __init__(self, readData = False, writeData = False, execute = False, appendData = False,
             delete = False, deleteChild = False, readAttribute = False, writeAttribute = False,
             readXAttr = False, writeXAttr = False, readAcl = False, writeAcl = False, getOwnership = False):
-            self.readData = readData
-            self.writeData = writeData
-            self.execute = execute
-            self.appendData = appendData
-            self.delete = delete
-            self.deleteChild = deleteChild
-            self.readAttribute = readAttribute
-            self.writeAttribute = writeAttribute
-            self.readXAttr = readXAttr
-            self.writeXAttr = writeXAttr
-            self.readAcl = readAcl
-            self.writeAcl = writeAcl
-            self.getOwnership = getOwnership
+            self._mask = _boolsToMask((readData, writeData, execute, appendData, delete, deleteChild,
+                readAttribute, writeAttribute, readXAttr, writeXAttr, readAcl, writeAcl, getOwnership))
+
+        readData = _flagProperty(READ_DATA)
+        writeData = _flagProperty(WRITE_DATA)
+        execute = _flagProperty(EXECUTE)
+        appendData = _flagProperty(APPEND_DATA)
+        delete = _flagProperty(DELETE)
+        deleteChild = _flagProperty(DELETE_CHILD)
+        readAttribute = _flagProperty(READ_ATTRIBUTE)
+        writeAttribute = _flagProperty(WRITE_ATTRIBUTE)
+        readXAttr = _flagProperty(READ_XATTR)
+        writeXAttr = _flagProperty(WRITE_XATTR)
+        readAcl = _flagProperty(READ_ACL)
+        writeAcl = _flagProperty(WRITE_ACL)
+        getOwnership = _flagProperty(GET_OWNERSHIP)
 
         @staticmethod
         def fromString(s):
-            readData = False
-            writeData = False
-            execute = False
-            appendData = False
-            delete = False
-            deleteChild = False
-            readAttribute = False
-            writeAttribute = False
-            readXAttr = False
-            writeXAttr = False
-            readAcl = False
-            writeAcl = False
-            getOwnership = False
-
-            for c in s:
-                if c == "-":
-                    pass
-                elif c == "r":
-                    readData = True
-                elif c == "w":
-                    writeData = True
-                elif c == "x":
-                    execute = True
-                elif c == "p":
-                    appendData = True
-                elif c == "d":
-                    delete = True
-                elif c == "D":
-                    deleteChild = True
-                elif c == "a":
-                    readAttribute = True
-                elif c == "A":
-                    writeAttribute = True
-                elif c == "R":
-                    readXAttr = True
-                elif c == "W":
-                    writeXAttr = True
-                elif c == "c":
-                    readAcl = True
-                elif c == "C":
-                    writeAcl = True
-                elif c == "o":
-                    getOwnership = True
-                else:
-                    raise Exception("Unexpected permission letter: '" + c + "'")
-
-            return SynoACL.Permissions(readData = readData, writeData = writeData, execute = execute, appendData = appendData,
-                delete = delete, deleteChild = deleteChild, readAttribute = readAttribute, writeAttribute = writeAttribute,
-                readXAttr = readXAttr, writeXAttr = writeXAttr, readAcl = readAcl, writeAcl = writeAcl, getOwnership = getOwnership)
-
-        def __str__(self):
-            r = ""
-            r += SynoACL._formatPermission("r", self.readData)
-            r += SynoACL._formatPermission("w", self.writeData)
-            r += SynoACL._formatPermission("x", self.execute)
-            r += SynoACL._formatPermission("p", self.appendData)
-            r += SynoACL._formatPermission("d", self.delete)
-            r += SynoACL._formatPermission("D", self.deleteChild)
-            r += SynoACL._formatPermission("a", self.readAttribute)
-            r += SynoACL._formatPermission("A", self.writeAttribute)
-            r += SynoACL._formatPermission("R", self.readXAttr)
-            r += SynoACL._formatPermission("W", self.writeXAttr)
-            r += SynoACL._formatPermission("c", self.readAcl)
-            r += SynoACL._formatPermission("C", self.writeAcl)
-            r += SynoACL._formatPermission("o", self.getOwnership)
-            return r
-
-        def __eq__(self, other):
-            # Cheating a bit but performance is not that important and it saves typing
-            return str(self) == str(other)
-
-        def __ne__(self, other):
-            return not self.__eq__(other)
-
-    class Inheritance(object):
+            return SynoACL.Permissions._fromMask(SynoACL.Permissions._parseMask(s))
+
+        @staticmethod
+        def shared(mask):
+            """Return the shared (immutable) instance with the flags of mask, as used by SynoACL.intern."""
+            return _SharedPermissions._get(mask)
+
+    class Inheritance(_FlagSet):
+        __slots__ = ()
+
+        class Flag(enum.IntFlag):
+            FILE_INHERITED = 1 << 0
+            DIRECTORY_INHERITED = 1 << 1
+            INHERIT_ONLY = 1 << 2
+            NO_PROPAGATE = 1 << 3
+
+        _LETTERS = "fdin"
+        _KIND = "inheritance"
+        _PARSE_CACHE = {}
+        _FORMAT_CACHE = {}
+
+        FILE_INHERITED = Flag.FILE_INHERITED
+        DIRECTORY_INHERITED = Flag.DIRECTORY_INHERITED
+        INHERIT_ONLY = Flag.INHERIT_ONLY
+        NO_PROPAGATE = Flag.NO_PROPAGATE
+
         def __init__(self, fileInherited = False, directoryInherited = False, inheritOnly = False, noPropagate = False):
-            self.fileInherited = fileInherited
-            self.directoryInherited = directoryInherited
-            self.inheritOnly = inheritOnly
-            self.noPropagate = noPropagate
+            self._mask = _boolsToMask((fileInherited, directoryInherited, inheritOnly, noPropagate))
+
+        fileInherited = _flagProperty(FILE_INHERITED)
+        directoryInherited = _flagProperty(DIRECTORY_INHERITED)
+        inheritOnly = _flagProperty(INHERIT_ONLY)
+        noPropagate = _flagProperty(NO_PROPAGATE)
 
         @staticmethod
         def fromString(s):
-            fileInherited = False
-            directoryInherited = False
-            inheritOnly = False
-            noPropagate = False
-
-            for c in s:
-                if c == "-":
-                    pass
-                elif c == "f":
-                    fileInherited = True
-                elif c == "d":
-                    directoryInherited = True
-                elif c == "i":
-                    inheritOnly = True
-                elif c == "n":
-                    noPropagate = True
-                else:
-                    raise Exception("Unexpected inheritance letter: '" + c + "'")
-
-            return SynoACL.Inheritance(fileInherited = fileInherited, directoryInherited = directoryInherited,
-                inheritOnly = inheritOnly, noPropagate = noPropagate)
-
-        def __str__(self):
-            r = ""
-            r += SynoACL._formatPermission("f", self.fileInherited)
-            r += SynoACL._formatPermission("d", self.directoryInherited)
-            r += SynoACL._formatPermission("i", self.inheritOnly)
-            r += SynoACL._formatPermission("n", self.noPropagate)
-            return r
-
-        def __eq__(self, other):
-            # Cheating a bit but performance is not that important and it saves typing
-            return str(self) == str(other)
-
-        def __ne__(self, other):
-            return not self.__eq__(other)
-
-    def __init__(self, role, name, aclType, permissions, inheritMode):
-        self.role = role
-        self.name = name
-        self.aclType = aclType
-        self.permissions = permissions
-        self.inheritMode = inheritMode
+            return SynoACL.Inheritance._fromMask(SynoACL.Inheritance._parseMask(s))
+
+        @staticmethod
+        def shared(mask):
+            """Return the shared (immutable) instance with the flags of mask, as used by SynoACL.intern."""
+            return _SharedInheritance._get(mask)
+
+    role: str
+    name: str
+    aclType: str
+    permissions: Permissions
+    inheritMode: Inheritance
 
     def setTarget(self, role, name):
         self.role = role
@@ -180,178 +305,355 @@ class SynoACL(object):
     def setInheritMode(self, inheritMode):
         self.inheritMode = inheritMode
 
-    _SYNOACL_REGEX = re.compile(r"^([^:]+):([^:]+):([^:]+):([^:]+):([^ ]+)$")
+    @staticmethod
+    def _split(s):
+        # equivalent to matching ^([^:]+):([^:]+):([^:]+):([^:]+):([^ ]+)$ but cheaper
+        parts = s.split(":", 4)
+        if len(parts) != 5 or not all(parts) or " " in parts[4]:
+            raise Exception(f"The passed string does not match the synoacl format! (received: '{s}')")
+        return parts
 
     @staticmethod
     def fromString(s):
-        m = SynoACL._SYNOACL_REGEX.match(s)
-        if not m:
-            raise Exception("The passed string does not match the synoacl format! (received: '%s')" % s)
+        role, name, aclType, permissions, inheritMode = SynoACL._split(s)
+        return SynoACL(role = role, name = name, aclType = aclType,
+            permissions = SynoACL.Permissions.fromString(permissions),
+            inheritMode = SynoACL.Inheritance.fromString(inheritMode))
 
-        return SynoACL(role = m.group(1), name = m.group(2), aclType = m.group(3),
-            permissions = SynoACL.Permissions.fromString(m.group(4)),
-            inheritMode = SynoACL.Inheritance.fromString(m.group(5)))
+    # ACL string -> shared _SharedSynoACL
+    _INTERN_CACHE = {}
 
     @staticmethod
-    def _formatPermission(permissionLetter, isSet):
-        if isSet:
-            return permissionLetter
-        else:
-            return "-"
+    def intern(s):
+        """Parse an ACL string like fromString() but return a shared, immutable instance.
+
+        All calls with the same string return the same object, so parsing
+        the same ACL over and over is just a dict lookup and the resulting
+        entries take no extra memory. The returned instance (including its
+        permissions and inheritMode) can't be modified - use fromString()
+        to get a private, modifiable copy.
+        """
+        try:
+            return SynoACL._INTERN_CACHE[s]
+        except KeyError:
+            pass
+
+        role, name, aclType, permissions, inheritMode = SynoACL._split(s)
+        permissions = _SharedPermissions._get(SynoACL.Permissions._parseMask(permissions))
+        inheritMode = _SharedInheritance._get(SynoACL.Inheritance._parseMask(inheritMode))
+        string = f"{role}:{name}:{aclType}:{permissions}:{inheritMode}"
+        # s may list the letters differently, the canonical form maps to the same instance
+        acl = SynoACL._INTERN_CACHE.get(string)
+        if acl is None:
+            acl = _SharedSynoACL._create(role, name, aclType, permissions, inheritMode, string)
+
+        if len(SynoACL._INTERN_CACHE) >= _CACHE_LIMIT:
+            SynoACL._INTERN_CACHE.clear()
+        SynoACL._INTERN_CACHE[s] = acl
+        SynoACL._INTERN_CACHE[string] = acl
+        return acl
 
     def __str__(self):
-        return self.role + ":" + self.name + ":" + self.aclType + ":" + str(self.permissions) + ":" + str(self.inheritMode)
+        return f"{self.role}:{self.name}:{self.aclType}:{self.permissions}:{self.inheritMode}"
 
     def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, SynoACL):
+            return NotImplemented
         return self.role == other.role \
             and self.name == other.name \
             and self.aclType == other.aclType \
             and self.permissions == other.permissions \
             and self.inheritMode == other.inheritMode
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+    def __hash__(self):
+        # SynoACL is mutable - don't change an instance that is used as a dict key or a set member
+        return hash((self.role, self.name, self.aclType, self.permissions._mask, self.inheritMode._mask))
+
+class _SharedPermissions(_Immutable, SynoACL.Permissions):
+    __slots__ = ()
+
+    # mask -> instance
+    _INSTANCES = {}
+
+    @staticmethod
+    def _get(mask):
+        try:
+            return _SharedPermissions._INSTANCES[mask]
+        except KeyError:
+            permissions = _SharedPermissions._fromMask(mask)
+            _SharedPermissions._INSTANCES[mask] = permissions
+            return permissions
+
+class _SharedInheritance(_Immutable, SynoACL.Inheritance):
+    __slots__ = ()
+
+    # mask -> instance
+    _INSTANCES = {}
+
+    @staticmethod
+    def _get(mask):
+        try:
+            return _SharedInheritance._INSTANCES[mask]
+        except KeyError:
+            inheritance = _SharedInheritance._fromMask(mask)
+            _SharedInheritance._INSTANCES[mask] = inheritance
+            return inheritance
+
+class _SharedSynoACL(_Immutable, SynoACL):
+    # the (canonical) ACL string, formatted once by SynoACL.intern
+    __slots__ = ("_string",)
+
+    @staticmethod
+    def _create(role, name, aclType, permissions, inheritMode, string):
+        acl = _SharedSynoACL.__new__(_SharedSynoACL)
+        object.__setattr__(acl, "role", role)
+        object.__setattr__(acl, "name", name)
+        object.__setattr__(acl, "aclType", aclType)
+        object.__setattr__(acl, "permissions", permissions)
+        object.__setattr__(acl, "inheritMode", inheritMode)
+        object.__setattr__(acl, "_string", string)
+        return acl
+
+    def __str__(self):
+        return self._string
+
+
+class _SynoACLDirectView(Sequence):
+    """A read-only sequence of the direct entries of a SynoACLSet (see SynoACLSet.getDirect)."""
+    __slots__ = ("_aclSet",)
+
+    def __init__(self, aclSet):
+        self._aclSet = aclSet
+
+    def __len__(self):
+        direct = self._aclSet._direct
+        return direct if isinstance(direct, int) else len(direct)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        direct = self._aclSet._direct
+        if isinstance(direct, int):
+            if index < 0:
+                index += direct
+            if index < 0 or index >= direct:
+                raise IndexError("direct ACL entry index out of range")
+            return self._aclSet._acls[index]
+        return self._aclSet._acls[direct[index]]
+
+    def __iter__(self):
+        direct = self._aclSet._direct
+        if isinstance(direct, int):
+            return itertools.islice(self._aclSet._acls, direct)
+        return (self._aclSet._acls[i] for i in direct)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence) or isinstance(other, str):
+            return NotImplemented
+        return list(self) == list(other)
+
+    __hash__ = None
 
+    def __str__(self):
+        return "[" + ", ".join(str(acl) for acl in self) + "]"
+
+class SynoACLSet:
+    """The ACL entries of a path, each with its level (0 for direct entries,
+    1 for entries inherited from the parent and so on).
+
+    Instances are immutable and hashable; two sets are equal if they have
+    equal entries with the same levels in the same order. The entries and
+    the levels are kept in two parallel arrays (the levels only if some
+    entry isn't direct), so that large numbers of sets can be held in
+    memory - especially when the entries are interned (see SynoACL.intern).
+    """
+    __slots__ = ("_acls", "_levels", "_direct", "_hash")
 
-class SynoACLSet(object):
     def __init__(self, acls, levels = None):
-        if levels != None and len(acls) != len(levels):
+        acls = tuple(acls)
+        if levels is not None and len(acls) != len(levels):
             raise Exception("Number of ACLs and number of levels don't match!")
 
-        self._direct = []
-
-        if levels == None:
-            # all ACLs are direct
-            self._all = []
-            for acl in acls:
-                self._direct.append(acl)
-                self._all.append({"acl": acl, "level": 0})
-        else:
-            # there can be indirect ACLs too
-            self._all = []
-            for i in range(0, len(acls)):
-                acl = acls[i]
-                level = levels[i]
-                if level == 0:
-                    self._direct.append(acl)
-                self._all.append({"acl": acl, "level": level})
+        # _direct is the number of direct entries if they are the first ones
+        # (as synoacltool lists them), otherwise a tuple of their indices
+        direct = len(acls)
+        if levels is not None:
+            levels = array.array("I", levels)
+            if levels.count(0) == len(levels):
+                levels = None
+            else:
+                direct = 0
+                while direct < len(levels) and levels[direct] == 0:
+                    direct += 1
+                if levels.count(0) != direct:
+                    direct = tuple(i for (i, level) in enumerate(levels) if level == 0)
+
+        object.__setattr__(self, "_acls", acls)
+        object.__setattr__(self, "_levels", levels)
+        object.__setattr__(self, "_direct", direct)
+        object.__setattr__(self, "_hash", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Can't set '{name}': SynoACLSet objects are immutable")
 
     def getDirect(self):
-        return self._direct
+        """Return a (read-only) sequence of the direct entries."""
+        return _SynoACLDirectView(self)
 
     def getAll(self):
-        return self._all
+        """Return a new list of {"acl": SynoACL, "level": int} dicts, one per entry."""
+        return [{"acl": acl, "level": level} for (acl, level) in self.getEntries()]
+
+    def getEntries(self):
+        """Return an iterator over the entries as (SynoACL, level)."""
+        if self._levels is None:
+            return ((acl, 0) for acl in self._acls)
+        return zip(self._acls, self._levels)
+
+    def inherited(self, isDirectory = True):
+        """Return the ACLs that a child of the path with these ACLs inherits.
+
+        These are the entries that propagate to a child directory
+        (directoryInherited) or a file (fileInherited), one level up.
+        Entries with noPropagate are inherited by the immediate children
+        only. The result doesn't contain any direct entries; it's what
+        SynoACLTool.get() returns for a child that has is_inherit set and
+        no ACL entries of its own.
+        """
+        acls = []
+        levels = []
+        for (acl, level) in self.getEntries():
+            inheritMode = acl.inheritMode
+            if isDirectory:
+                if not inheritMode.directoryInherited:
+                    continue
+            elif not inheritMode.fileInherited:
+                continue
+            if inheritMode.noPropagate and level > 0:
+                continue
+            acls.append(acl)
+            levels.append(level + 1)
+        return SynoACLSet(acls, levels)
+
+    def __len__(self):
+        return len(self._acls)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, SynoACLSet):
+            return NotImplemented
+        return self._acls == other._acls and self._levels == other._levels
+
+    def __hash__(self):
+        if self._hash is None:
+            levels = tuple(self._levels) if self._levels is not None else None
+            object.__setattr__(self, "_hash", hash((self._acls, levels)))
+        return self._hash
 
     def __str__(self):
-        s = ""
-        if self._all != None:
-            for i in range(0, len(self._all)):
-                entry = self._all[i]
-                acl = entry["acl"]
-                level = entry["level"]
-                s += "[" + str(i) + "] " + str(acl) + " (level: " + str(level) + ")\n"
-        else:
-            for i in range(0, len(self._direct)):
-                acl = self._direct[i]
-                s += "[" + str(i) + "] " + str(acl) + "\n"
-        return s
-
-    class Iterator(object):
-        def __init__(self, synoAclSet):
-            self._index = 0
-            self._synoAclSet = synoAclSet
-
-        def __iter__(self):
-            return self
-
-        def next(self):
-            acls = self._synoAclSet._direct
-            if self._index >= len(acls):
-                raise StopIteration()
-            acl = acls[self._index]
-            self._index += 1
-            return acl
+        return "".join(f"[{i}] {acl} (level: {level})\n" for (i, (acl, level)) in enumerate(self.getEntries()))
 
     # TODO: the semantics of this is wrong, remove it and use explicit getAll/getDirect
     def __iter__(self):
-        return SynoACLSet.Iterator(self)
+        return iter(self.getDirect())
 
-class SynoACLArchive(object):
+class SynoACLArchive(_FlagSet):
     """This class represents the flags that SynoACL associates with each directory. They determine:
         * if SynoACL is enabled for given path (is_support_ACL)
         * if the directory is read-only (isReadOnly)
         * if all the files created in the directory are owned by the group that owns the directory (isOwnerGroup)
         * if the path has any ACLs set (has_ACL)
         * if the ACLs of the parent directory are to be inherited (is_inherit)
-    """
 
-    _FLAG_IS_INHERIT = "is_inherit"
-    _FLAG_IS_READ_ONLY = "is_read_only"
-    _FLAG_IS_OWNER_GROUP = "is_owner_group"
-    _FLAG_HAS_ACL = "has_ACL"
-    _FLAG_IS_SUPPORT_ACL = "is_support_ACL"
-    _FLAG_NONE = "None"
+    Like the ACL permissions, the flags are kept in a bitmask (see Flag).
+    """
+    __slots__ = ()
+
+    class Flag(enum.IntFlag):
+        IS_INHERIT = 1 << 0
+        IS_READ_ONLY = 1 << 1
+        IS_OWNER_GROUP = 1 << 2
+        HAS_ACL = 1 << 3
+        IS_SUPPORT_ACL = 1 << 4
+
+    _KIND = "archive flag"
+    _PARSE_CACHE = {}
+    _FORMAT_CACHE = {}
+    # the names used by synoacltool, in the order of the Flag members
+    _NAMES = ("is_inherit", "is_read_only", "is_owner_group", "has_ACL", "is_support_ACL")
+    _NAME_BITS = dict(zip(_NAMES, (int(flag) for flag in Flag)))
+    _NONE = "None"
+    # has_ACL reflects the ACL entries, it can't be set or dropped
+    _SETTABLE = int(Flag.IS_INHERIT | Flag.IS_READ_ONLY | Flag.IS_OWNER_GROUP | Flag.IS_SUPPORT_ACL)
 
     def __init__(self, isInherit = False, isReadOnly = False, isOwnerGroup = False, hasACL = False, isSupportACL = False):
-        self.isInherit = isInherit
-        self.isReadOnly = isReadOnly
-        self.isOwnerGroup = isOwnerGroup
-        self.hasACL = hasACL
-        self.isSupportACL = isSupportACL
+        self._mask = _boolsToMask((isInherit, isReadOnly, isOwnerGroup, hasACL, isSupportACL))
+
+    isInherit = _flagProperty(Flag.IS_INHERIT)
+    isReadOnly = _flagProperty(Flag.IS_READ_ONLY)
+    isOwnerGroup = _flagProperty(Flag.IS_OWNER_GROUP)
+    hasACL = _flagProperty(Flag.HAS_ACL)
+    isSupportACL = _flagProperty(Flag.IS_SUPPORT_ACL)
 
     def isNone(self):
-        return not(self.isInherit or self.isReadOnly or self.isOwnerGroup or self.hasACL or self.isSupportACL)
+        return self._mask == 0
+
+    @classmethod
+    def _parseMask(cls, s):
+        try:
+            return cls._PARSE_CACHE[s]
+        except KeyError:
+            pass
+
+        mask = 0
+        for flag in s.split(","):
+            # unknown flags (and "None") are ignored
+            mask |= cls._NAME_BITS.get(flag.strip(), 0)
+
+        if len(cls._PARSE_CACHE) >= _CACHE_LIMIT:
+            cls._PARSE_CACHE.clear()
+        cls._PARSE_CACHE[s] = mask
+        return mask
+
+    @classmethod
+    def _formatMask(cls, mask):
+        if mask == 0:
+            return cls._NONE
+        return ",".join(name for (i, name) in enumerate(cls._NAMES) if mask & (1 << i))
 
     @staticmethod
     def fromString(s):
-        flags = filter(lambda s: s != "", map(lambda s: s.strip(), s.split(',')))
-
-        isInherit = False
-        isReadOnly = False
-        isOwnerGroup = False
-        hasACL = False
-        isSupportACL = False
-        for flag in flags:
-            if flag == SynoACLArchive._FLAG_IS_INHERIT:
-                isInherit = True
-            elif flag == SynoACLArchive._FLAG_IS_READ_ONLY:
-                isReadOnly = True
-            elif flag == SynoACLArchive._FLAG_IS_OWNER_GROUP:
-                isOwnerGroup = True
-            elif flag == SynoACLArchive._FLAG_HAS_ACL:
-                hasACL = True
-            elif flag == SynoACLArchive._FLAG_IS_SUPPORT_ACL:
-                isSupportACL = True
-            elif flag == SynoACLArchive._FLAG_NONE:
-                pass # ignore
-
-        return SynoACLArchive(isInherit = isInherit, isReadOnly = isReadOnly, isOwnerGroup = isOwnerGroup,
-            hasACL = hasACL, isSupportACL = isSupportACL)
+        return SynoACLArchive._fromMask(SynoACLArchive._parseMask(s))
 
-    def __str__(self):
-        flags = []
-        if self.isInherit:
-            flags.append(SynoACLArchive._FLAG_IS_INHERIT)
-        if self.isReadOnly:
-            flags.append(SynoACLArchive._FLAG_IS_READ_ONLY)
-        if self.isOwnerGroup:
-            flags.append(SynoACLArchive._FLAG_IS_OWNER_GROUP)
-        if self.hasACL:
-            flags.append(SynoACLArchive._FLAG_HAS_ACL)
-        if self.isSupportACL:
-            flags.append(SynoACLArchive._FLAG_IS_SUPPORT_ACL)
-        if len(flags) == 0:
-            return SynoACLArchive._FLAG_NONE
-        return ",".join(flags)
+@dataclass(slots = True)
+class SynoACLOperation:
+    """A single change of the ACL entries of a path.
 
-    def __eq__(self, other):
-        # Cheating a bit but performance is not that important and it saves typing
-        return str(self) == str(other)
+    kind is one of ADD, DELETE and REPLACE. index is the index of the entry
+    to delete or replace (None for ADD), acl is the new entry (None for
+    DELETE) and previous is the entry being deleted or replaced.
+    """
 
-    def __ne__(self, other):
-        return not self.__eq__(other)
+    ADD = "add"
+    DELETE = "delete"
+    REPLACE = "replace"
+
+    kind: str
+    index: int = None
+    acl: SynoACL = None
+    previous: SynoACL = None
+
+    def __str__(self):
+        if self.kind == SynoACLOperation.ADD:
+            return f"add {self.acl}"
+        elif self.kind == SynoACLOperation.DELETE:
+            return f"delete [{self.index}] {self.previous}"
+        return f"replace [{self.index}] {self.previous} -> {self.acl}"
 
-class SynoACLTool(object):
+class SynoACLTool:
     """A wrapper around synoacltool.
 
     ACLs and Archive flags are wrapped in python classes which should be
@@ -361,27 +663,157 @@ class SynoACLTool(object):
     the names used close to synoacltool to stay consistent.
     """
 
-    _SYNOACL_CMD = "synoacltool"
+    _executor = SynoACLExecutor()
+    _cache = None
+    _instrumentation = None
+    _scheduler = None
     _SYNOACL_REGEX = re.compile(r"^\t *\[([0-9]+)\] +([^ ]+) +\(level:([0-9]+)\)$")
     _ARCHIVE_REGEX = re.compile(r"^Archive: (.+)$")
 
     @staticmethod
-    def _communicate(args):
-        return subprocess.check_output([ SynoACLTool._SYNOACL_CMD ] + args, universal_newlines = True).split("\n")
+    def setExecutor(executor):
+        """Set the SynoACLExecutor used to run synoacltool.
+
+        This can be used to change the synoacltool command, the per-call timeout
+        or the default concurrency of the batch methods.
+        """
+        SynoACLTool._executor = executor
+
+    @staticmethod
+    def getExecutor():
+        return SynoACLTool._executor
+
+    @staticmethod
+    def setCache(cache):
+        """Set a SynoACLCache to be used by get and getArchive (None to disable caching)."""
+        SynoACLTool._cache = cache
+
+    @staticmethod
+    def getCache():
+        return SynoACLTool._cache
+
+    @staticmethod
+    def setInstrumentation(instrumentation):
+        """Set a SynoACLInstrumentation to record the synoacltool calls (None to disable it)."""
+        SynoACLTool._instrumentation = instrumentation
+
+    @staticmethod
+    def getInstrumentation():
+        return SynoACLTool._instrumentation
+
+    @staticmethod
+    def setScheduler(scheduler):
+        """Set a SynoACLScheduler to decide when the synoacltool calls run (None to run them right away)."""
+        SynoACLTool._scheduler = scheduler
+
+    @staticmethod
+    def getScheduler():
+        return SynoACLTool._scheduler
+
+    @staticmethod
+    def _aclsChanged(path, acls):
+        """Update the cache after the ACLs of path were changed to acls."""
+        cache = SynoACLTool._cache
+        if cache is not None:
+            # inherited ACLs of the children may have changed too
+            cache.invalidate(path, recursive = True)
+            cache.putACLs(path, acls, cache.changeTime(path))
+        return acls
+
+    @staticmethod
+    def _archiveChanged(path, archive):
+        """Update the cache after the archive flags of path were changed to archive."""
+        cache = SynoACLTool._cache
+        if cache is not None:
+            # is_inherit affects the ACLs of path and everything below it
+            cache.invalidate(path, recursive = True)
+            cache.putArchive(path, archive, cache.changeTime(path))
+        return archive
+
+    @staticmethod
+    def _invalidate(path):
+        cache = SynoACLTool._cache
+        if cache is not None:
+            cache.invalidate(path, recursive = True)
+
+    @staticmethod
+    def _communicate(args, parser = None):
+        """Run synoacltool with args and return its output parsed by parser (or the plain lines if None)."""
+        scheduler = SynoACLTool._scheduler
+        if scheduler is not None:
+            return scheduler.run(lambda args: SynoACLTool._run(args, parser), args)
+        return SynoACLTool._run(args, parser)
+
+    @staticmethod
+    def _run(args, parser):
+        instrumentation = SynoACLTool._instrumentation
+        if instrumentation is not None:
+            return instrumentation.run(SynoACLTool._executor.communicate, args, parser)
+        output = SynoACLTool._executor.communicate(args)
+        if parser is not None:
+            return parser(output)
+        return output
+
+    @staticmethod
+    def _communicateStream(args):
+        """Run synoacltool with args and return an iterator over its output lines (as they are produced)."""
+        scheduler = SynoACLTool._scheduler
+        if scheduler is not None:
+            return scheduler.stream(SynoACLTool._runStream, args)
+        return SynoACLTool._runStream(args)
+
+    @staticmethod
+    def _runStream(args):
+        instrumentation = SynoACLTool._instrumentation
+        if instrumentation is not None:
+            return instrumentation.stream(SynoACLTool._executor.communicateStream, args)
+        return SynoACLTool._executor.communicateStream(args)
+
+    @staticmethod
+    def _batch(fn, paths, concurrency, raiseErrors):
+        results = SynoACLTool._executor.map(fn, paths, concurrency)
+        if raiseErrors:
+            for result in results:
+                if not result.ok:
+                    raise result.error
+        return results
+
+    @staticmethod
+    def _closeStream(lines):
+        """Close an iterator over synoacltool output (if it can be closed), ending the call behind it."""
+        close = getattr(lines, "close", None)
+        if close is not None:
+            close()
+
+    @staticmethod
+    def _iterACLResult(lines):
+        """Parse the ACL entries from synoacltool output lines, yielding (SynoACL, level) as the lines come.
+
+        lines is closed when the iteration ends, also when the parsing fails
+        or the generator is closed early.
+        """
+        match = SynoACLTool._SYNOACL_REGEX.match
+        interned = SynoACL._INTERN_CACHE
+        count = 0
+        try:
+            for line in lines:
+                m = match(line)
+                if m:
+                    (entryId, acl, level) = m.groups()
+                    if int(entryId) != count:
+                        raise Exception(f"Unexpected index of ACL entry: expected {entryId}, got: {count}")
+                    count += 1
+                    yield (interned.get(acl) or SynoACL.intern(acl), int(level))
+        finally:
+            SynoACLTool._closeStream(lines)
 
     @staticmethod
     def _parseACLResult(results):
         acls = []
         levels = []
-        for line in results:
-            m = SynoACLTool._SYNOACL_REGEX.match(line)
-            if m:
-                entryId = int(m.group(1))
-                aclString = m.group(2)
-                if entryId != len(acls):
-                    raise Exception("Unexpected index of ACL entry: expected " + str(entryId) + ", got: " + str(len(acls)))
-                level = int(m.group(3))
-                acls.append(SynoACL.fromString(aclString))
+        with contextlib.closing(SynoACLTool._iterACLResult(results)) as entries:
+            for (acl, level) in entries:
+                acls.append(acl)
                 levels.append(level)
         return SynoACLSet(acls, levels)
 
@@ -391,11 +823,200 @@ class SynoACLTool(object):
 
         The returned object is an instance of SynoACLSet.
         """
+        cache = SynoACLTool._cache
+        if cache is not None:
+            acls = cache.getACLs(path)
+            if acls is not None:
+                return acls
+            ctime = cache.changeTime(path)
+
         try:
-            return SynoACLTool._parseACLResult(SynoACLTool._communicate(["-get", path]))
+            acls = SynoACLTool._parseACLResult(SynoACLTool._communicateStream(["-get", path]))
         except subprocess.CalledProcessError:
             # FIXME: synoacltool -get returns "(synoacltool.c, 350)It's Linux mode" when there are no ACLs for the path
-            return SynoACLSet([])
+            acls = SynoACLSet([])
+
+        if cache is not None:
+            cache.putACLs(path, acls, ctime)
+        return acls
+
+    @staticmethod
+    def iterGet(path):
+        """Yield the ACL entries of path as (SynoACL, level) while synoacltool is still printing them.
+
+        Unlike get, this doesn't use the cache and nothing is buffered, so
+        work on the first entries can start before synoacltool finishes. As
+        with get, a path without ACLs ("Linux mode") yields nothing. With a
+        scheduler (see setScheduler), the call holds its slot until the
+        iteration ends.
+        """
+        try:
+            with contextlib.closing(SynoACLTool._iterACLResult(SynoACLTool._communicateStream(["-get", path]))) as entries:
+                for entry in entries:
+                    yield entry
+        except subprocess.CalledProcessError:
+            return
+
+    @staticmethod
+    def getMany(paths, concurrency = None, raiseErrors = False):
+        """Return the ACLs of multiple paths, running several synoacltool calls at once.
+
+        Returns a list of SynoACLResult (one per path, in the order of paths)
+        with the SynoACLSet as the value. Failures are reported per path,
+        unless raiseErrors is True in which case the first failure is raised.
+        concurrency defaults to the executor's concurrency.
+        """
+        return SynoACLTool._batch(SynoACLTool.get, paths, concurrency, raiseErrors)
+
+    @staticmethod
+    def _isExcluded(path, exclude):
+        name = os.path.basename(path)
+        for pattern in exclude:
+            if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+                return True
+        return False
+
+    @staticmethod
+    def walkPaths(root, exclude = (), maxDepth = None, includeFiles = False, followLinks = False, onError = None,
+            prune = None):
+        """Yield (path, depth, isDirectory) for root and everything below it, without reading any ACLs.
+
+        The order is the one of walk: depth-first with the entries of each
+        directory sorted by name, i.e. parents always come before their
+        children. Only the not-yet-visited siblings along the current branch
+        are kept in memory. exclude, maxDepth, includeFiles and followLinks
+        are as in walk. onError(path, error) is called for a directory that
+        can't be listed (without it, the OSError is raised). If prune(path)
+        returns True, path and everything below it is left out.
+        """
+        backend = SynoACLTool._executor.backend
+
+        def isDirectory(path):
+            return backend.isDirectory(path, followLinks)
+
+        stack = [(root, 0, isDirectory(root))]
+        while stack:
+            path, depth, isDir = stack.pop()
+            yield (path, depth, isDir)
+
+            if not isDir or (maxDepth is not None and depth >= maxDepth):
+                continue
+
+            try:
+                names = sorted(backend.listDirectory(path))
+            except OSError as e:
+                if onError is None:
+                    raise
+                onError(path, e)
+                continue
+
+            children = []
+            for name in names:
+                childPath = os.path.join(path, name)
+                if SynoACLTool._isExcluded(childPath, exclude) or (prune is not None and prune(childPath)):
+                    continue
+                childIsDir = isDirectory(childPath)
+                if childIsDir or includeFiles:
+                    children.append((childPath, depth + 1, childIsDir))
+            # the stack is LIFO: push in reverse so that the children are visited in order
+            children.reverse()
+            stack.extend(children)
+
+    @staticmethod
+    def _getWithArchive(entry):
+        path = entry[0]
+        return (SynoACLTool.getArchive(path), SynoACLTool.get(path))
+
+    @staticmethod
+    def _getArchiveAndOwnACLs(entry):
+        """Get the archive flags and only get the ACLs if they can't be derived from the parent.
+
+        Returns (archive, None) when the ACLs are to be derived.
+        """
+        path, depth, isDir = entry
+        archive = SynoACLTool.getArchive(path)
+        if not archive.isSupportACL:
+            # "Linux mode" - synoacltool -get would fail, see get()
+            return (archive, SynoACLSet([]))
+        if archive.hasACL or depth == 0:
+            return (archive, SynoACLTool.get(path))
+        return (archive, None)
+
+    @staticmethod
+    def walk(root, concurrency = None, exclude = (), maxDepth = None, includeFiles = False,
+            followLinks = False, onError = None, deriveInherited = False, verifySample = 0.0):
+        """Walk the directory tree under root and yield (path, SynoACLArchive, SynoACLSet) for each path.
+
+        root itself is included. The paths come depth-first with the entries
+        of each directory sorted by name (so parents always come before
+        their children). The ACLs are fetched ahead of the consumer by up to
+        concurrency parallel synoacltool calls (defaults to the executor's
+        concurrency) and only a bounded number of results is held in memory
+        regardless of the size of the tree.
+
+        exclude is a list of fnmatch patterns; a path matching any of them
+        (by its name or full path) is skipped together with everything below it.
+        maxDepth limits how deep to descend (0 means just root). Files are
+        only included if includeFiles is True and symlinked directories are
+        only descended into if followLinks is True.
+
+        With deriveInherited, synoacltool -get is only run for paths whose
+        archive flags say they have ACL entries of their own (has_ACL). For
+        the others, the ACLs are computed from the parent's ACLs (see
+        SynoACLSet.inherited). This relies on synoacltool keeping has_ACL
+        in sync with the entries; verifySample (0.0 - 1.0) is the fraction
+        of derived ACL sets that are checked against an actual -get. A
+        mismatch is treated as an error for that path (the actual ACLs are
+        then yielded).
+
+        If onError is None, errors (listing a directory or calling synoacltool)
+        are raised. Otherwise onError(path, exception) is called and the path
+        is skipped.
+        """
+        def handleError(path, error):
+            if onError is None:
+                raise error
+            onError(path, error)
+
+        entries = SynoACLTool.walkPaths(root, exclude, maxDepth, includeFiles, followLinks, onError)
+        fetch = SynoACLTool._getArchiveAndOwnACLs if deriveInherited else SynoACLTool._getWithArchive
+
+        # ACLs of the directories on the current branch, indexed by depth (None if unknown)
+        ancestors = []
+        verifyCredit = 0.0
+        for result in SynoACLTool._executor.imap(fetch, entries, concurrency):
+            path, depth, isDir = result.path
+            del ancestors[depth:]
+
+            acls = None
+            if result.ok:
+                archive, acls = result.value
+                if acls is None:
+                    parentACLs = ancestors[depth - 1]
+                    if parentACLs is None:
+                        # the parent failed, so there is nothing to derive from
+                        acls = SynoACLTool.get(path)
+                    elif archive.isInherit:
+                        acls = parentACLs.inherited(isDir)
+                    else:
+                        acls = SynoACLSet([])
+
+                    verifyCredit += verifySample
+                    if verifyCredit >= 1.0:
+                        verifyCredit -= 1.0
+                        actualACLs = SynoACLTool.get(path)
+                        if acls != actualACLs:
+                            handleError(path, Exception(f"ACLs derived for {path} don't match synoacltool:\n" +
+                                f"{acls}vs.\n{actualACLs}"))
+                            acls = actualACLs
+
+            if isDir:
+                ancestors.append(acls)
+
+            if result.ok:
+                yield (path, archive, acls)
+            else:
+                handleError(path, result.error)
 
     @staticmethod
     def add(path, acl):
@@ -403,7 +1024,8 @@ class SynoACLTool(object):
 
         Returns the resulting ACLs as an SynoACLSet.
         """
-        return SynoACLTool._parseACLResult(SynoACLTool._communicate(["-add", path, str(acl)]))
+        return SynoACLTool._aclsChanged(path,
+            SynoACLTool._parseACLResult(SynoACLTool._communicateStream(["-add", path, str(acl)])))
 
     @staticmethod
     def deleteEntry(path, index):
@@ -411,7 +1033,8 @@ class SynoACLTool(object):
 
         Returns the resulting ACLs as an SynoACLSet.
         """
-        return SynoACLTool._parseACLResult(SynoACLTool._communicate(["-del", path, str(index)]))
+        return SynoACLTool._aclsChanged(path,
+            SynoACLTool._parseACLResult(SynoACLTool._communicateStream(["-del", path, str(index)])))
 
     @staticmethod
     def replace(path, index, acl):
@@ -419,7 +1042,8 @@ class SynoACLTool(object):
 
         Returns the resulting ACLs as an SynoACLSet.
         """
-        return SynoACLTool._parseACLResult(SynoACLTool._communicate(["-replace", path, str(index), str(acl)]))
+        return SynoACLTool._aclsChanged(path,
+            SynoACLTool._parseACLResult(SynoACLTool._communicateStream(["-replace", path, str(index), str(acl)])))
 
     @staticmethod
     def deleteAll(path):
@@ -429,13 +1053,17 @@ class SynoACLTool(object):
         """
         # synoacltool returns "(synoacltool.c, 385)Index out of range" when
         # there are no ACLs defined and -del is used
-        if len(SynoACLTool.get(path).getAll()) > 0:
+        if len(SynoACLTool.get(path)) > 0:
             SynoACLTool._communicate(["-del", path])
+            SynoACLTool._invalidate(path)
         # else: no need to do anything
 
     @staticmethod
     def deleteForRole(path, role, name):
-        """A helper function that deletes ACLs for given name."""
+        """A helper function that deletes ACLs for given name.
+
+        Only the first matching entry is deleted, see removeRole to delete all of them.
+        """
         # find role
         acls = SynoACLTool.get(path)
         directACLs = acls.getDirect()
@@ -446,78 +1074,252 @@ class SynoACLTool(object):
             if acl.role == role and acl.name == name:
                 return SynoACLTool.deleteEntry(path, i)
 
-        raise Exception("Could not find role:name " + role + ":" + name + " in ACL for path " + path)
+        raise Exception(f"Could not find role:name {role}:{name} in ACL for path {path}")
 
     @staticmethod
     def reset(path, acls):
+        """Replace the direct ACL entries of path with acls.
+
+        This is not atomic: if an add fails, the path is left with only some
+        of the entries. See synoacl.transaction.SynoACLTransaction for a
+        version that restores the previous state on failures.
+        """
         SynoACLTool.deleteAll(path)
         for acl in acls:
             SynoACLTool.add(path, acl)
 
     @staticmethod
-    def adaptTo(path, acls):
-        """A "softer" version of SynoACLTool.reset().
+    def planAdaptTo(existingAcls, acls):
+        """Compute the changes that turn the direct ACL entries existingAcls into acls.
 
-        It does not delete all rules and set the new ones, but only adapts existing rules
-        doing minimal number of changes.
-        """
-        requestedAclMap = dict()
+        Entries are matched by (role, name, aclType): matching entries with
+        different permissions or inheritance are replaced, unmatched existing
+        entries are deleted and unmatched requested entries are added.
 
+        Returns a list of SynoACLOperation. The indices in the operations
+        take into account the shifts caused by the preceding operations,
+        i.e. the operations can be performed in the order they are listed.
+        """
         def aclKey(acl):
             return (acl.role, acl.name, acl.aclType)
 
-        # turn the acls list into a map of (role, name, type) -> rights
+        # turn the acls list into a map of (role, name, type) -> rights (in the order of acls)
+        requestedAclMap = {}
         for acl in acls:
             requestedAclMap[aclKey(acl)] = acl
 
-        existingAcls = SynoACLTool.get(path).getDirect()
+        deletes = []
+        replaces = []
+        # iterate over existing ACLs and record required changes
+        for (index, existingAcl) in enumerate(existingAcls):
+            key = aclKey(existingAcl)
+            matchedAcl = requestedAclMap.pop(key, None)
+            if matchedAcl is None:
+                # no such entry in the requested keys -> delete the entry
+                deletes.append(SynoACLOperation(SynoACLOperation.DELETE, index, previous = existingAcl))
+            elif existingAcl.permissions != matchedAcl.permissions or existingAcl.inheritMode != matchedAcl.inheritMode:
+                # the index after all the deletes (which are done first) is lower by the number of deleted entries before it
+                replaces.append(SynoACLOperation(SynoACLOperation.REPLACE, index - len(deletes), matchedAcl, existingAcl))
+            #else: keep as is
 
-        # the indices do change after a replace() and perhaps also after other operations
-        # => store the operations and then perform them
-        aclsToDelete = []
-        aclsToModify = []
+        # delete from the back so that a delete doesn't shift the indices of the following deletes
+        deletes.reverse()
 
-        def findACLIndex(path, acl):
-            acls = SynoACLTool.get(path).getDirect()
-            for i in range(len(acls)):
-                if acl == acls[i]:
-                    return i
-            # this should not happen - unless the ACLs change from the outside while we're changing it
-            raise Exception("ACL " + str(acl) + " not present in the ACL list for " + path)
+        # add what's left
+        adds = [SynoACLOperation(SynoACLOperation.ADD, acl = acl) for acl in requestedAclMap.values()]
 
-        # iterate over existing ACLs and record required changes
-        for existingAcl in existingAcls:
-            try:
-                key = aclKey(existingAcl)
-                matchedAcl = requestedAclMap[key]
-                # compare and check if the right is to be adapted or kept as is
-                if existingAcl.permissions != matchedAcl.permissions or existingAcl.inheritMode != matchedAcl.inheritMode:
-                    aclsToModify.append((existingAcl, matchedAcl))
-                #else: keep as is
-                # delete the key so at to mark is as processed
-                del requestedAclMap[key]
-            except KeyError:
-                # no such entry in the requested keys -> delete the entry
-                aclsToDelete.append(existingAcl)
+        return deletes + replaces + adds
 
-        for aclToDelete in aclsToDelete:
-            SynoACLTool.deleteEntry(path, findACLIndex(path, aclToDelete))
+    @staticmethod
+    def compilePolicy(existingAcls, acls):
+        """Compute the fewest changes that turn the direct ACL entries existingAcls into exactly acls, in the same order.
+
+        Unlike planAdaptTo, the order of the entries (which matters for how
+        allow and deny entries are evaluated) is kept and an entry can be
+        replaced by an entry of another user or group. As synoacltool -add
+        puts the new entry first, the result is made of a prefix of acls
+        that is added and the rest, which is made of the existing entries
+        that are kept or replaced (the others are deleted). The split and
+        the matching are chosen by dynamic programming (an edit distance
+        where the insertions can only be done at the front), so the number
+        of operations is minimal.
+
+        Returns a list of SynoACLOperation to be performed in order, as
+        planAdaptTo does: the deletes (from the back), the replaces and the
+        adds. Takes O(len(existingAcls) * len(acls)) time.
+        """
+        existing = list(existingAcls)
+        requested = list(acls)
+        # number the distinct entries so that the comparisons below are cheap
+        ids = {}
+        existingIds = [ids.setdefault(acl, len(ids)) for acl in existing]
+        requestedIds = [ids.setdefault(acl, len(ids)) for acl in requested]
+
+        # a common suffix is always best kept as it is
+        n = len(existingIds)
+        m = len(requestedIds)
+        while n > 0 and m > 0 and existingIds[n - 1] == requestedIds[m - 1]:
+            n -= 1
+            m -= 1
+
+        # cost[i][j]: the fewest deletes and replaces turning existing[i:n] into requested[j:m]
+        infinity = n + m + 1
+        cost = [None] * (n + 1)
+        cost[n] = [infinity] * m + [0]
+        for i in range(n - 1, -1, -1):
+            below = cost[i + 1]
+            row = [0] * (m + 1)
+            row[m] = n - i
+            existingId = existingIds[i]
+            for j in range(m - 1, -1, -1):
+                keep = below[j + 1] + (existingId != requestedIds[j])
+                delete = below[j] + 1
+                row[j] = keep if keep <= delete else delete
+            cost[i] = row
+
+        # the first added entries of requested are added, the rest is matched
+        added = min(range(m + 1), key = lambda k: k + cost[0][k])
+
+        deletes = []
+        replaces = []
+        (i, j) = (0, added)
+        while i < n:
+            if j < m and cost[i][j] == cost[i + 1][j + 1] + (existingIds[i] != requestedIds[j]):
+                if existingIds[i] != requestedIds[j]:
+                    # the index after all the deletes (which are done first)
+                    replaces.append(SynoACLOperation(SynoACLOperation.REPLACE, i - len(deletes), requested[j], existing[i]))
+                j += 1
+            else:
+                deletes.append(SynoACLOperation(SynoACLOperation.DELETE, i, previous = existing[i]))
+            i += 1
+
+        # delete from the back so that a delete doesn't shift the indices of the following deletes
+        deletes.reverse()
+
+        # each add puts the entry first, so add the prefix from its end
+        adds = [SynoACLOperation(SynoACLOperation.ADD, acl = acl) for acl in reversed(requested[:added])]
+
+        return deletes + replaces + adds
 
-        for (aclToModifyFrom, aclToModifyTo) in aclsToModify:
-            SynoACLTool.replace(path, findACLIndex(path, aclToModifyFrom), aclToModifyTo)
+    @staticmethod
+    def _findACLIndex(path, acls, acl, expectedIndex):
+        if expectedIndex < len(acls) and acls[expectedIndex] == acl:
+            return expectedIndex
+        for i in range(len(acls)):
+            if acl == acls[i]:
+                return i
+        # this should not happen - unless the ACLs change from the outside while we're changing it
+        raise Exception(f"ACL {acl} not present in the ACL list for {path}")
 
-        # add what's left
-        for aclToAdd in requestedAclMap.itervalues():
-            SynoACLTool.add(path, aclToAdd)
+    @staticmethod
+    def applyOperations(path, operations, existingAcls):
+        """Perform the operations (as returned by planAdaptTo) on path.
+
+        existingAcls are the current direct ACL entries of path. The index of
+        each entry to be changed is checked against the ACLs returned by the
+        previous operation (synoacltool may reorder the entries) so that no
+        extra -get is needed.
+
+        Returns the resulting SynoACLSet, or None if there were no operations.
+        """
+        current = existingAcls
+        result = None
+        for operation in operations:
+            if operation.kind == SynoACLOperation.DELETE:
+                index = SynoACLTool._findACLIndex(path, current, operation.previous, operation.index)
+                result = SynoACLTool.deleteEntry(path, index)
+            elif operation.kind == SynoACLOperation.REPLACE:
+                index = SynoACLTool._findACLIndex(path, current, operation.previous, operation.index)
+                result = SynoACLTool.replace(path, index, operation.acl)
+            else:
+                result = SynoACLTool.add(path, operation.acl)
+            current = result.getDirect()
+        return result
+
+    @staticmethod
+    def adaptTo(path, acls, dryRun = False, existingAcls = None, ordered = False):
+        """A "softer" version of SynoACLTool.reset().
+
+        It does not delete all rules and set the new ones, but only adapts existing rules
+        doing minimal number of changes: one synoacltool -get plus one call per changed entry.
+
+        Returns the list of SynoACLOperation that were performed (see planAdaptTo).
+        If dryRun is True, the operations are only returned, not performed.
+        existingAcls are the current direct ACL entries of path; if not passed,
+        they are read with get. With ordered, the entries end up in the order
+        of acls and the changes are planned by compilePolicy.
+        """
+        if existingAcls is None:
+            existingAcls = SynoACLTool.get(path).getDirect()
+        if ordered:
+            operations = SynoACLTool.compilePolicy(existingAcls, acls)
+        else:
+            operations = SynoACLTool.planAdaptTo(existingAcls, acls)
+        if not dryRun:
+            SynoACLTool.applyOperations(path, operations, existingAcls)
+        return operations
+
+    @staticmethod
+    def planRemoveRole(existingAcls, role, name):
+        """Compute the deletes that remove all the entries of role:name (allow and deny) from existingAcls.
+
+        The entries are deleted from the back so that the indices of the
+        remaining deletes don't shift. Returns a list of SynoACLOperation.
+        """
+        operations = []
+        for (index, acl) in enumerate(existingAcls):
+            if acl.role == role and acl.name == name:
+                operations.append(SynoACLOperation(SynoACLOperation.DELETE, index, previous = acl))
+        operations.reverse()
+        return operations
+
+    @staticmethod
+    def planRenameRole(existingAcls, role, name, newRole, newName):
+        """Compute the replaces that turn all the entries of role:name in existingAcls into entries of newRole:newName.
+
+        The entries keep their position, type, permissions and inheritance.
+        Returns a list of SynoACLOperation.
+        """
+        operations = []
+        for (index, acl) in enumerate(existingAcls):
+            if acl.role == role and acl.name == name:
+                newAcl = SynoACL.intern(f"{newRole}:{newName}:{acl.aclType}:{acl.permissions}:{acl.inheritMode}")
+                operations.append(SynoACLOperation(SynoACLOperation.REPLACE, index, newAcl, acl))
+        return operations
+
+    @staticmethod
+    def removeRole(path, role, name, dryRun = False, existingAcls = None):
+        """Delete all the direct entries of role:name from path.
+
+        Costs one synoacltool -get (unless existingAcls, the current direct
+        entries, are passed) plus one -del per entry. Returns the list of
+        SynoACLOperation (see planRemoveRole); with dryRun they are not performed.
+        """
+        if existingAcls is None:
+            existingAcls = SynoACLTool.get(path).getDirect()
+        operations = SynoACLTool.planRemoveRole(existingAcls, role, name)
+        if not dryRun and len(operations) > 0:
+            SynoACLTool.applyOperations(path, operations, existingAcls)
+        return operations
+
+    @staticmethod
+    def renameRole(path, role, name, newRole, newName, dryRun = False, existingAcls = None):
+        """Rewrite all the direct entries of role:name on path to newRole:newName (see removeRole and planRenameRole)."""
+        if existingAcls is None:
+            existingAcls = SynoACLTool.get(path).getDirect()
+        operations = SynoACLTool.planRenameRole(existingAcls, role, name, newRole, newName)
+        if not dryRun and len(operations) > 0:
+            SynoACLTool.applyOperations(path, operations, existingAcls)
+        return operations
 
     @staticmethod
     def _parseArchiveResult(result):
         if len(result) != 2 or result[1] != "":
-            raise Exception("Unexpected format of SynoACL archive flags: %s" % result)
+            raise Exception(f"Unexpected format of SynoACL archive flags: {result}")
 
         m = SynoACLTool._ARCHIVE_REGEX.match(result[0])
         if not m:
-            raise Exception("Unexpected format of SynoACL archive flags: %s" % result)
+            raise Exception(f"Unexpected format of SynoACL archive flags: {result}")
 
         return SynoACLArchive.fromString(m.group(1))
 
@@ -527,7 +1329,26 @@ class SynoACLTool(object):
 
         See the documentation of SynoACLArchive for more info on the flags.
         """
-        return SynoACLTool._parseArchiveResult(SynoACLTool._communicate(["-get-archive", path]))
+        cache = SynoACLTool._cache
+        if cache is not None:
+            archive = cache.getArchive(path)
+            if archive is not None:
+                return archive
+            ctime = cache.changeTime(path)
+
+        archive = SynoACLTool._communicate(["-get-archive", path], SynoACLTool._parseArchiveResult)
+
+        if cache is not None:
+            cache.putArchive(path, archive, ctime)
+        return archive
+
+    @staticmethod
+    def getArchiveMany(paths, concurrency = None, raiseErrors = False):
+        """Return the archive flags of multiple paths, running several synoacltool calls at once.
+
+        Works like getMany, with SynoACLArchive as the value of each result.
+        """
+        return SynoACLTool._batch(SynoACLTool.getArchive, paths, concurrency, raiseErrors)
 
     @staticmethod
     def setArchive(path, synoACLArchive):
@@ -537,7 +1358,8 @@ class SynoACLTool(object):
 
         See the documentation of SynoACLArchive for more info on the flags.
         """
-        return SynoACLTool._parseArchiveResult(SynoACLTool._communicate(["-set-archive", path, str(synoACLArchive)]))
+        return SynoACLTool._archiveChanged(path,
+            SynoACLTool._communicate(["-set-archive", path, str(synoACLArchive)], SynoACLTool._parseArchiveResult))
 
     @staticmethod
     def delArchive(path, synoACLArchive):
@@ -545,36 +1367,37 @@ class SynoACLTool(object):
 
         See the documentation of SynoACLArchive for more info on the flags.
         """
-        return SynoACLTool._parseArchiveResult(SynoACLTool._communicate(["-del-archive", path, str(synoACLArchive)]))
-
-    @staticmethod
-    def setArchiveTo(path, requestedFlags):
-        """Set SynoACL Archive flags to match the flags passed."""
-        existingFlags = SynoACLTool.getArchive(path)
-        # drop flags which are to be dropped
-        flagsToDrop = SynoACLArchive()
-        if existingFlags.isInherit and not requestedFlags.isInherit:
-            flagsToDrop.isInherit = True
-        if existingFlags.isReadOnly and not requestedFlags.isReadOnly:
-            flagsToDrop.isReadOnly = True
-        if existingFlags.isOwnerGroup and not requestedFlags.isOwnerGroup:
-            flagsToDrop.isOwnerGroup = True
-        if existingFlags.isSupportACL and not requestedFlags.isSupportACL:
-            flagsToDrop.isSupportACL = True
+        return SynoACLTool._archiveChanged(path,
+            SynoACLTool._communicate(["-del-archive", path, str(synoACLArchive)], SynoACLTool._parseArchiveResult))
+
+    @staticmethod
+    def planSetArchiveTo(existingFlags, requestedFlags):
+        """Compute the flags setArchiveTo would drop and set.
+
+        Returns a (flagsToDrop, flagsToSet) pair of SynoACLArchive. Both are
+        empty (isNone()) if the flags already match. has_ACL is not compared
+        as it reflects the ACL entries and can't be set directly.
+        """
+        existing = existingFlags.mask & SynoACLArchive._SETTABLE
+        requested = requestedFlags.mask & SynoACLArchive._SETTABLE
+        flagsToDrop = SynoACLArchive._fromMask(existing & ~requested)
+        flagsToSet = SynoACLArchive._fromMask(requested & ~existing)
+        return (flagsToDrop, flagsToSet)
+
+    @staticmethod
+    def setArchiveTo(path, requestedFlags, existingFlags = None):
+        """Set SynoACL Archive flags to match the flags passed.
+
+        existingFlags are the current flags of path; if not passed, they
+        are read with getArchive.
+        """
+        if existingFlags is None:
+            existingFlags = SynoACLTool.getArchive(path)
+        (flagsToDrop, flagsToSet) = SynoACLTool.planSetArchiveTo(existingFlags, requestedFlags)
         if not flagsToDrop.isNone():
             SynoACLTool.delArchive(path, flagsToDrop)
         # else: no need to do anything
 
-        # set flags which are to be set
-        flagsToSet = SynoACLArchive()
-        if not existingFlags.isInherit and requestedFlags.isInherit:
-            flagsToSet.isInherit = True
-        if not existingFlags.isReadOnly and requestedFlags.isReadOnly:
-            flagsToSet.isReadOnly = True
-        if not existingFlags.isOwnerGroup and requestedFlags.isOwnerGroup:
-            flagsToSet.isOwnerGroup = True
-        if not existingFlags.isSupportACL and requestedFlags.isSupportACL:
-            flagsToSet.isSupportACL = True
         if not flagsToSet.isNone():
             SynoACLTool.setArchive(path, flagsToSet)
         # else: no need to do anything
@@ -582,3 +1405,4 @@ class SynoACLTool(object):
     @staticmethod
     def enforceInherit(path):
         SynoACLTool._communicate(["-enforce-inherit", path])
+        SynoACLTool._invalidate(path)
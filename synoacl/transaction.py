@@ -0,0 +1,262 @@
+"""
+    This file is part of synoacl.
+
+    Synoacl is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Synoacl is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with synoacl. If not, see <http://www.gnu.org/licenses/>.
+
+    Copyright 2015 David Kozub
+"""
+import threading
+
+from synoacl.tool import SynoACLTool
+from synoacl.reconcile import SynoACLReconcileSummary, SynoACLReconciler
+
+class SynoACLTransactionSummary(SynoACLReconcileSummary):
+    """The outcome of SynoACLTransaction.applyGroups.
+
+    A SynoACLReconcileSummary where all the paths of a group that failed
+    are in failed (with the error that made the group fail) plus
+    rolledBack, the paths that were changed and then restored to their
+    previous state.
+    """
+    def __init__(self):
+        SynoACLReconcileSummary.__init__(self)
+        self.rolledBack = []
+
+    def __str__(self):
+        return SynoACLReconcileSummary.__str__(self) + f", rolled back: {len(self.rolledBack)}"
+
+class SynoACLTransaction:
+    """A group of changes of ACL entries and archive flags applied to one or more paths all-or-nothing.
+
+    The changes are staged by adaptTo (or reset) and setArchiveTo and
+    applied by commit (or at the end of a with block that doesn't raise):
+
+    ::
+
+        with SynoACLTransaction() as transaction:
+            transaction.reset("/volume1/share/a", acls)
+            transaction.reset("/volume1/share/b", acls)
+            transaction.setArchiveTo("/volume1/share/b", archive)
+
+    The paths are changed one by one, in the order they were first
+    staged. Before a path is changed, its state is captured by one
+    synoacltool -get and one -get-archive; the changes are then done with
+    as few calls as SynoACLTool.adaptTo and setArchiveTo need, except that
+    when the ACL entries of a path change and its archive flags are staged
+    too, the flags are read once more after the entries (changing the
+    entries may change them, e.g. has_ACL), which costs another
+    -get-archive. If any call
+    fails, all the paths changed so far (including the one that failed)
+    are restored to their captured state and the error is raised again.
+    If the restore itself fails, an Exception naming the paths that could
+    not be restored is raised (chained to the original error).
+
+    Note that this can't protect against changes made by others in the
+    meantime: a restore puts back the captured state, overwriting them.
+    """
+
+    def __init__(self, dryRun = False):
+        self.dryRun = dryRun
+        # path -> [acls, ordered, archive] (None for the part left alone), in the order the paths were staged
+        self._staged = {}
+        # path -> (direct ACL entries, archive flags) before the transaction changed it
+        self.captured = {}
+        # path -> list of SynoACLOperation / (flagsToDrop, flagsToSet) done (or planned in a dry run)
+        self.operations = {}
+        self.archiveChanges = {}
+        self.rolledBack = []
+        self._committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if excType is None and not self._committed:
+            self.commit()
+        # on an error in the with block nothing has been changed yet - the staged changes are dropped
+
+    def _stage(self, path):
+        if self._committed:
+            raise Exception("The transaction has already been committed")
+        return self._staged.setdefault(path, [None, False, None])
+
+    def adaptTo(self, path, acls, ordered = False):
+        """Stage a change of the direct ACL entries of path to acls (a list of SynoACL or a SynoACLSet).
+
+        As with SynoACLTool.adaptTo, the order of the entries is only kept
+        with ordered.
+        """
+        staged = self._stage(path)
+        staged[0] = SynoACLReconciler.directACLs(acls)
+        staged[1] = ordered
+
+    def reset(self, path, acls):
+        """Stage setting the direct ACL entries of path to exactly acls, in their order.
+
+        Unlike SynoACLTool.reset, only the entries that differ are changed
+        (see SynoACLTool.compilePolicy).
+        """
+        self.adaptTo(path, acls, ordered = True)
+
+    def setArchiveTo(self, path, archive):
+        """Stage a change of the archive flags of path to archive (see SynoACLTool.setArchiveTo)."""
+        self._stage(path)[2] = archive
+
+    def paths(self):
+        """Return the staged paths in the order they will be changed."""
+        return list(self._staged)
+
+    def _applyPath(self, path, acls, ordered, archive):
+        existingAcls = SynoACLTool.get(path).getDirect()
+        existingArchive = SynoACLTool.getArchive(path)
+        self.captured[path] = (list(existingAcls), existingArchive)
+
+        operations = []
+        if acls is not None:
+            if ordered:
+                operations = SynoACLTool.compilePolicy(existingAcls, acls)
+            else:
+                operations = SynoACLTool.planAdaptTo(existingAcls, acls)
+        archiveChanges = None
+        if archive is not None:
+            archiveChanges = SynoACLTool.planSetArchiveTo(existingArchive, archive)
+        self.operations[path] = operations
+        self.archiveChanges[path] = archiveChanges
+
+        if self.dryRun:
+            return
+        if len(operations) > 0:
+            SynoACLTool.applyOperations(path, operations, existingAcls)
+            if archive is not None:
+                # changing the ACL entries may affect the archive flags
+                SynoACLTool.setArchiveTo(path, archive)
+        elif SynoACLReconcileSummary.isArchiveChanged(archiveChanges):
+            SynoACLTool.setArchiveTo(path, archive, existingArchive)
+
+    def commit(self):
+        """Apply the staged changes; on a failure, restore the paths changed so far and raise."""
+        if self._committed:
+            raise Exception("The transaction has already been committed")
+        self._committed = True
+        try:
+            for (path, (acls, ordered, archive)) in self._staged.items():
+                self._applyPath(path, acls, ordered, archive)
+        except Exception as error:
+            if not self.dryRun:
+                self.rollback(error)
+            raise
+
+    @staticmethod
+    def _restoreACLs(path, acls):
+        """Make the direct entries of path exactly acls, in the same order."""
+        current = SynoACLTool.get(path).getDirect()
+        operations = SynoACLTool.compilePolicy(current, acls)
+        if len(operations) > 0:
+            SynoACLTool.applyOperations(path, operations, current)
+
+    def rollback(self, error = None):
+        """Restore the captured state of all the paths the transaction got to, in reverse order.
+
+        Called by commit on a failure; error is the exception that caused it.
+        """
+        notRestored = []
+        for path in reversed(list(self.captured)):
+            (acls, archive) = self.captured[path]
+            try:
+                SynoACLTransaction._restoreACLs(path, acls)
+                SynoACLTool.setArchiveTo(path, archive)
+                self.rolledBack.append(path)
+            except Exception as e:
+                notRestored.append(f"{path} ({e})")
+        if len(notRestored) > 0:
+            raise Exception(f"Rollback failed, left in a partial state: {', '.join(notRestored)}") from error
+
+    @staticmethod
+    def applyGroups(groups, concurrency = None, dryRun = False, progress = None):
+        """Apply each group of changes as a separate transaction, several groups at once.
+
+        groups is an iterable of groups, each a list of (path, acls, archive)
+        as in SynoACLReconciler.reconcileItems (acls or archive can be None
+        to leave them alone). groups is consumed lazily; up to concurrency
+        groups are processed at once (see SynoACLExecutor.imap), the paths
+        of a group one after another. A group either gets all its changes
+        or none. progress(group, summary) is called after each group.
+
+        Groups that share a path are applied one after another, in the order
+        they come in groups: a group waits until the earlier groups with any
+        of its paths are done (committed or rolled back). That way a group
+        captures (and on a failure restores) the state the earlier groups
+        left, not a state in the middle of one of them.
+
+        Returns a SynoACLTransactionSummary.
+        """
+        # path -> [tickets handed out, the ticket whose turn it is]
+        turns = {}
+        condition = threading.Condition()
+
+        def ticketed(groups):
+            # groups is consumed (and the tickets handed out) in order
+            for group in groups:
+                tickets = []
+                with condition:
+                    for path in dict.fromkeys(item[0] for item in group):
+                        turn = turns.setdefault(path, [0, 0])
+                        tickets.append((path, turn[0]))
+                        turn[0] += 1
+                yield (group, tickets)
+
+        def process(item):
+            (group, tickets) = item
+            with condition:
+                condition.wait_for(lambda: all(turns[path][1] == ticket for (path, ticket) in tickets))
+            try:
+                return commit(group)
+            finally:
+                with condition:
+                    for (path, ticket) in tickets:
+                        turn = turns[path]
+                        turn[1] += 1
+                        if turn[1] == turn[0]:
+                            del turns[path]
+                    condition.notify_all()
+
+        def commit(group):
+            transaction = SynoACLTransaction(dryRun)
+            for (path, acls, archive) in group:
+                if acls is not None:
+                    transaction.adaptTo(path, acls)
+                if archive is not None:
+                    transaction.setArchiveTo(path, archive)
+            try:
+                transaction.commit()
+            except Exception as error:
+                # the transaction tells what was rolled back
+                return (transaction, error)
+            return (transaction, None)
+
+        summary = SynoACLTransactionSummary()
+        for result in SynoACLTool.getExecutor().imap(process, ticketed(groups), concurrency):
+            group = result.path[0]
+            (transaction, error) = result.value if result.ok else (None, result.error)
+            if error is None:
+                for path in transaction.paths():
+                    summary.addResult(path, transaction.operations[path], transaction.archiveChanges[path])
+            else:
+                for path in dict.fromkeys(item[0] for item in group):
+                    summary.addFailure(path, error)
+                if transaction is not None:
+                    summary.rolledBack.extend(transaction.rolledBack)
+            if progress is not None:
+                progress(group, summary)
+        return summary
@@ -0,0 +1,105 @@
+import unittest
+import asyncio
+import subprocess
+import sys
+
+from synoacl.tool import SynoACL, SynoACLArchive
+from synoacl.aio import AsyncSynoACLTool
+from tests.test_tool import ListExecutor
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+
+class ListAsyncSynoACLTool(AsyncSynoACLTool):
+    """Runs the commands against a ListExecutor instead of synoacltool."""
+    def __init__(self, executor, concurrency = 2):
+        AsyncSynoACLTool.__init__(self, concurrency = concurrency)
+        self.executor = executor
+        self.running = 0
+        self.maxRunning = 0
+
+    async def _execute(self, args):
+        self.running += 1
+        self.maxRunning = max(self.maxRunning, self.running)
+        try:
+            await asyncio.sleep(0.001)
+            if args[1] == "/missing":
+                return (255, "")
+            return (0, "\n".join(self.executor.communicate(args)))
+        finally:
+            self.running -= 1
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+class TestAsyncSynoACLTool(unittest.TestCase):
+    def setUp(self):
+        self.executor = ListExecutor({"/a": [ADMINS, GUEST], "/b": []}, {"/a": ["is_support_ACL"]})
+        self.tool = ListAsyncSynoACLTool(self.executor)
+
+    def test_get(self):
+        acls = run(self.tool.get("/a"))
+        self.assertEqual([str(acl) for acl in acls.getDirect()], [ADMINS, GUEST])
+        self.assertEqual(len(run(self.tool.get("/missing")).getAll()), 0)
+
+    def test_getMany(self):
+        paths = ["/a", "/b", "/c", "/d", "/e"]
+        results = run(self.tool.getMany(paths))
+        self.assertEqual([r.path for r in results], paths)
+        self.assertEqual(len(results[0].value.getDirect()), 2)
+        self.assertTrue(self.tool.maxRunning <= 2)
+
+        results = run(self.tool.getArchiveMany(["/a", "/missing"]))
+        self.assertEqual(str(results[0].value), "is_support_ACL")
+        self.assertTrue(isinstance(results[1].error, subprocess.CalledProcessError))
+
+    def test_adaptTo(self):
+        requested = [SynoACL.fromString(GUEST.replace("r---", "rwx-"))]
+        operations = run(self.tool.adaptTo("/a", requested))
+        self.assertEqual([op.kind for op in operations], ["delete", "replace"])
+        self.assertEqual(self.executor.acls["/a"], [str(requested[0])])
+        self.assertEqual(run(self.tool.adaptTo("/a", requested)), [])
+
+    def test_adaptToOrdered(self):
+        requested = [SynoACL.fromString(GUEST), SynoACL.fromString(ADMINS)]
+        self.assertEqual(run(self.tool.adaptTo("/a", requested)), [])
+        operations = run(self.tool.adaptTo("/a", requested, ordered = True))
+        self.assertEqual(len(operations), 2)
+        self.assertEqual(self.executor.acls["/a"], [GUEST, ADMINS])
+
+    def test_iterGet(self):
+        async def collect(path):
+            return [(str(acl), level) async for (acl, level) in self.tool.iterGet(path)]
+        self.assertEqual(run(collect("/a")), [(ADMINS, 0), (GUEST, 0)])
+        self.assertEqual(run(collect("/missing")), [])
+
+    def test_removeAndRenameRole(self):
+        operations = run(self.tool.renameRole("/a", "user", "guest", "user", "boss"))
+        self.assertEqual([op.kind for op in operations], ["replace"])
+        self.assertEqual(self.executor.acls["/a"], [ADMINS, GUEST.replace("guest", "boss")])
+        self.assertEqual(len(run(self.tool.removeRole("/a", "user", "boss", dryRun = True))), 1)
+        run(self.tool.removeRole("/a", "user", "boss"))
+        self.assertEqual(self.executor.acls["/a"], [ADMINS])
+
+    def test_setArchiveTo(self):
+        run(self.tool.setArchiveTo("/a", SynoACLArchive(isInherit = True, isSupportACL = True)))
+        self.assertEqual(sorted(self.executor.archives["/a"]), ["is_inherit", "is_support_ACL"])
+
+    def test_subprocess(self):
+        # use the python interpreter to play synoacltool
+        tool = AsyncSynoACLTool(command = sys.executable, timeout = 30)
+        output = run(tool._communicate(["-c", "print('Archive: is_inherit')"]))
+        self.assertEqual(output, ["Archive: is_inherit", ""])
+        with self.assertRaises(subprocess.CalledProcessError):
+            run(tool._communicate(["-c", "import sys; sys.exit(1)"]))
+
+        tool = AsyncSynoACLTool(command = sys.executable, timeout = 0.1)
+        with self.assertRaises(subprocess.TimeoutExpired):
+            run(tool._communicate(["-c", "import time; time.sleep(5)"]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+
+from synoacl.tool import SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.backend import SubprocessBackend
+
+# a stand-in for synoacltool: prints the ACL entries, then sleeps for $3 seconds and exits with $4
+SCRIPT = """#!/bin/sh
+if [ "$2" = "/linux" ]; then
+    echo "(synoacltool.c, 350)It's Linux mode"
+    exit 255
+fi
+echo "ACL version: 1"
+echo "\t [0] user:guest:allow:r------------:fd-- (level:0)"
+echo "\t [1] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)"
+if [ "$2" = "/slow" ]; then
+    exec sleep 5
+fi
+if [ -n "$3" ]; then
+    exec sleep $3
+fi
+exit ${4:-0}
+"""
+
+class TestSubprocessBackend(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.command = os.path.join(self.tempDir, "synoacltool")
+        with open(self.command, "w") as f:
+            f.write(SCRIPT)
+        os.chmod(self.command, stat.S_IRWXU)
+        self.executor = SynoACLTool.getExecutor()
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+        shutil.rmtree(self.tempDir)
+
+    def test_stream(self):
+        backend = SubprocessBackend(self.command)
+        lines = list(backend.communicateStream(["-get", "/p"]))
+        self.assertEqual(lines, backend.communicate(["-get", "/p"])[:-1])
+        self.assertEqual(len(lines), 3)
+
+    def test_streamFailure(self):
+        backend = SubprocessBackend(self.command)
+        lines = backend.communicateStream(["-get", "/p", "", "3"])
+        self.assertEqual(next(lines), "ACL version: 1")
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            list(lines)
+        self.assertEqual(cm.exception.returncode, 3)
+
+    def test_streamTimeout(self):
+        backend = SubprocessBackend(self.command, timeout = 0.2)
+        with self.assertRaises(subprocess.TimeoutExpired):
+            list(backend.communicateStream(["-get", "/p", "5"]))
+
+    def test_iterGet(self):
+        SynoACLTool.setExecutor(SynoACLExecutor(self.command))
+        start = time.time()
+        entries = SynoACLTool.iterGet("/slow")
+        # the first entry is there before synoacltool exits
+        (acl, level) = next(entries)
+        self.assertEqual((acl.name, level), ("guest", 0))
+        self.assertTrue(time.time() - start < 1)
+        entries.close()
+
+        acls = SynoACLTool.get("/p")
+        self.assertEqual([entry["level"] for entry in acls.getAll()], [ 0, 1 ])
+        # "Linux mode"
+        self.assertEqual(list(SynoACLTool.iterGet("/linux")), [])
+
+    def test_indexCheck(self):
+        with self.assertRaises(Exception) as cm:
+            SynoACLTool._parseACLResult(iter(["\t [1] user:guest:allow:r------------:fd-- (level:0)"]))
+        self.assertEqual(str(cm.exception), "Unexpected index of ACL entry: expected 1, got: 0")
@@ -0,0 +1,23 @@
+import unittest
+import json
+
+from benchmarks import bench
+
+class TestBenchmarks(unittest.TestCase):
+    def test_run(self):
+        report = bench.run(quick = True, only = [ "parse.SynoACL.fromString", "tool.adaptTo" ])
+        # must be serializable
+        report = json.loads(json.dumps(report))
+        self.assertEqual([result["name"] for result in report["results"]],
+            [ "parse.SynoACL.fromString", "tool.adaptTo", "tool.adaptTo" ])
+        self.assertEqual(report["results"][1]["calls"], { "-get": 1, "-del": 1, "-replace": 1, "-add": 1 })
+
+    def test_compare(self):
+        baseline = { "results": [ { "name": "a", "params": {}, "best": 1.0, "calls": { "-get": 1 } } ] }
+        current = { "results": [ { "name": "a", "params": {}, "best": 1.1, "calls": { "-get": 1 } } ] }
+        self.assertFalse(bench.compare(baseline, current, 0.2)[1])
+        current["results"][0]["best"] = 1.5
+        self.assertTrue(bench.compare(baseline, current, 0.2)[1])
+        current["results"][0]["best"] = 1.0
+        current["results"][0]["calls"]["-get"] = 2
+        self.assertTrue(bench.compare(baseline, current, 0.2)[1])
@@ -0,0 +1,69 @@
+import unittest
+
+from synoacl.tool import SynoACL, SynoACLOperation, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.bulk import SynoACLBulk
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+ALICE = "user:alice:allow:rwx----------:fd--"
+ALICE_DENY = "user:alice:deny:-w-----------:fd--"
+BOB = "user:bob:allow:r------------:fd--"
+
+class TestSynoACLBulk(unittest.TestCase):
+    def setUp(self):
+        self.executor = SynoACLTool.getExecutor()
+        self.backend = FakeSynoACLBackend()
+        self.backend.makeTree("/share", 3, 2)
+        self.backend.makeDirectory("/share", [ ADMINS ], "is_support_ACL")
+        self.backend.makeDirectory("/share/d0", [ ALICE, BOB, ALICE_DENY ])
+        self.backend.makeDirectory("/share/d1/d2", [ BOB, ALICE ])
+        self.backend.makeDirectory("/share/d2", [ BOB ])
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+
+    def direct(self, path):
+        return [str(acl) for acl in SynoACLTool.get(path).getDirect()]
+
+    def test_planRemoveRole(self):
+        existing = [SynoACL.intern(acl) for acl in [ ALICE, BOB, ALICE_DENY ]]
+        self.assertEqual(SynoACLTool.planRemoveRole(existing, "user", "alice"), [
+            SynoACLOperation(SynoACLOperation.DELETE, 2, previous = existing[2]),
+            SynoACLOperation(SynoACLOperation.DELETE, 0, previous = existing[0])
+        ])
+        self.assertEqual(SynoACLTool.planRemoveRole(existing, "user", "carol"), [])
+
+    def test_removeAndRenameRole(self):
+        operations = SynoACLTool.removeRole("/share/d0", "user", "alice")
+        self.assertEqual(len(operations), 2)
+        self.assertEqual(self.direct("/share/d0"), [ BOB ])
+
+        operations = SynoACLTool.renameRole("/share/d1/d2", "user", "bob", "group", "staff")
+        self.assertEqual([str(operation) for operation in operations],
+            [ "replace [0] " + BOB + " -> group:staff:allow:r------------:fd--" ])
+        self.assertEqual(self.direct("/share/d1/d2"), [ "group:staff:allow:r------------:fd--", ALICE ])
+
+    def test_bulkRemove(self):
+        summary = SynoACLBulk.removeRole("/share", "user", "alice", dryRun = True)
+        self.assertEqual(summary.changed, [ "/share/d0", "/share/d1/d2" ])
+        self.assertEqual(self.backend.calls["-del"], 0)
+
+        self.backend.calls.clear()
+        summary = SynoACLBulk.removeRole("/share", "user", "alice", concurrency = 4)
+        self.assertTrue(summary.isSuccess())
+        self.assertEqual(summary.changed, [ "/share/d0", "/share/d1/d2" ])
+        # one -get per path with entries of its own, one -del per entry
+        self.assertEqual(self.backend.calls["-get"], 4)
+        self.assertEqual(self.backend.calls["-del"], 3)
+        self.assertEqual(self.backend.calls["-replace"], 0)
+        self.assertEqual(self.direct("/share/d0"), [ BOB ])
+        self.assertEqual(self.direct("/share/d1/d2"), [ BOB ])
+
+    def test_bulkRename(self):
+        summary = SynoACLBulk.renameRole("/share", "user", "bob", "user", "carol")
+        self.assertEqual(summary.changed, [ "/share/d0", "/share/d1/d2", "/share/d2" ])
+        self.assertEqual(self.backend.calls["-replace"], 3)
+        self.assertEqual(self.direct("/share/d0"), [ ALICE, BOB.replace("bob", "carol"), ALICE_DENY ])
+        self.assertTrue(BOB not in str(SynoACLTool.get("/share/d2/d0")))
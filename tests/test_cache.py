@@ -0,0 +1,132 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.cache import SynoACLCache
+from tests.test_tool import ListExecutor
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+
+class FakeTimeCache(SynoACLCache):
+    """A cache that takes the ctimes from a dict instead of the filesystem."""
+    def __init__(self, maxSize = 10000, ttl = None):
+        SynoACLCache.__init__(self, maxSize, ttl)
+        self.ctimes = {}
+
+    def changeTime(self, path):
+        return self.ctimes.get(path, 1)
+
+class TestSynoACLCache(unittest.TestCase):
+    def test_hitAndMiss(self):
+        cache = FakeTimeCache()
+        acls = SynoACLSet([])
+        self.assertEqual(cache.getACLs("/a"), None)
+        cache.putACLs("/a", acls, 1)
+        self.assertTrue(cache.getACLs("/a") is acls)
+        self.assertEqual(cache.getArchive("/a"), None)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_ctimeChange(self):
+        cache = FakeTimeCache()
+        cache.putACLs("/a", SynoACLSet([]), 1)
+        cache.putArchive("/a", SynoACLArchive(), 1)
+        cache.ctimes["/a"] = 2
+        self.assertEqual(cache.getACLs("/a"), None)
+        self.assertEqual(len(cache), 0)
+
+        # storing with a different ctime replaces the whole entry
+        cache.putACLs("/a", SynoACLSet([]), 2)
+        cache.putArchive("/a", SynoACLArchive(), 3)
+        self.assertEqual(cache.getACLs("/a"), None)
+
+    def test_realChangeTime(self):
+        tempDir = tempfile.mkdtemp()
+        try:
+            cache = SynoACLCache()
+            self.assertEqual(cache.changeTime(os.path.join(tempDir, "missing")), None)
+            cache.putACLs(tempDir, SynoACLSet([]), cache.changeTime(tempDir))
+            self.assertNotEqual(cache.getACLs(tempDir), None)
+            # no ctime -> nothing to validate against -> not cached
+            cache.putACLs(os.path.join(tempDir, "missing"), SynoACLSet([]), None)
+            self.assertEqual(len(cache), 1)
+        finally:
+            shutil.rmtree(tempDir)
+
+    def test_ttl(self):
+        cache = FakeTimeCache(ttl = -1)
+        cache.putACLs("/a", SynoACLSet([]), 1)
+        self.assertEqual(cache.getACLs("/a"), None)
+
+    def test_lru(self):
+        cache = FakeTimeCache(maxSize = 2)
+        cache.putACLs("/a", SynoACLSet([]), 1)
+        cache.putACLs("/b", SynoACLSet([]), 1)
+        cache.getACLs("/a")
+        cache.putACLs("/c", SynoACLSet([]), 1)
+        self.assertNotEqual(cache.getACLs("/a"), None)
+        self.assertEqual(cache.getACLs("/b"), None)
+        self.assertNotEqual(cache.getACLs("/c"), None)
+
+    def test_invalidate(self):
+        cache = FakeTimeCache()
+        for path in ["/a", "/a/b", "/a/b/c", "/a/x/y", "/ab", "/a-b", "/a0"]:
+            cache.putACLs(path, SynoACLSet([]), 1)
+        cache.invalidate("/a/b")
+        self.assertEqual(len(cache), 6)
+        cache.invalidate("/a", recursive = True)
+        self.assertEqual(len(cache), 3)
+        for path in ["/ab", "/a-b", "/a0"]:
+            self.assertNotEqual(cache.getACLs(path), None)
+        self.assertEqual(cache._paths, ["/a-b", "/a0", "/ab"])
+
+        cache.invalidate("/", recursive = True)
+        self.assertEqual((len(cache), cache._paths), (0, []))
+
+class TestSynoACLToolCache(unittest.TestCase):
+    def setUp(self):
+        self.originalExecutor = SynoACLTool.getExecutor()
+        self.executor = ListExecutor({"/a": [ADMINS], "/a/b": []}, {"/a": ["is_support_ACL"]})
+        SynoACLTool.setExecutor(self.executor)
+        self.cache = FakeTimeCache()
+        SynoACLTool.setCache(self.cache)
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.originalExecutor)
+        SynoACLTool.setCache(None)
+
+    def commands(self):
+        return [args[0] for args in self.executor.calls]
+
+    def test_readThrough(self):
+        SynoACLTool.get("/a")
+        SynoACLTool.get("/a")
+        SynoACLTool.getArchive("/a")
+        SynoACLTool.getArchive("/a")
+        self.assertEqual(self.commands(), ["-get", "-get-archive"])
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+    def test_mutationsUpdateCache(self):
+        SynoACLTool.get("/a")
+        SynoACLTool.get("/a/b")
+        SynoACLTool.add("/a", SynoACL.fromString(GUEST))
+        self.assertEqual(len(SynoACLTool.get("/a").getDirect()), 2)
+        self.assertEqual(self.commands(), ["-get", "-get", "-add"])
+
+        # the change of /a may have changed the inherited ACLs of /a/b
+        SynoACLTool.get("/a/b")
+        self.assertEqual(self.commands(), ["-get", "-get", "-add", "-get"])
+
+        SynoACLTool.getArchive("/a")
+        SynoACLTool.setArchive("/a", SynoACLArchive(isInherit = True))
+        self.assertTrue(SynoACLTool.getArchive("/a").isInherit)
+        SynoACLTool.get("/a")
+        self.assertEqual(self.commands()[-3:], ["-get-archive", "-set-archive", "-get"])
+
+        SynoACLTool.enforceInherit("/a")
+        self.assertEqual(len(self.cache), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.snapshot import SynoACLSnapshot
+from synoacl.diff import SynoACLDiff, SynoACLPathDiff
+from tests.test_tool import ListExecutor
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+ADMINS_READ = "group:administrators:allow:r------------:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+BOSS = "user:boss:allow:rwx----------:fd--"
+
+def source(tree):
+    """Make a diff source out of a list of (path, [(acl string, level)], archive string)."""
+    for (path, entries, archiveString) in tree:
+        acls = SynoACLSet([SynoACL.intern(acl) for (acl, level) in entries], [level for (acl, level) in entries])
+        archive = SynoACLArchive.fromString(archiveString)
+        yield (path, SynoACLSnapshot.aclSetId(acls), SynoACLSnapshot.archiveId(archive), acls, archive)
+
+class TestSynoACLDiff(unittest.TestCase):
+    OLD = [
+        ("/s", [(ADMINS, 0)], "is_support_ACL"),
+        ("/s/a", [(GUEST, 0), (ADMINS, 1)], "is_inherit,is_support_ACL"),
+        ("/s/a/x", [(GUEST, 1), (ADMINS, 2)], "is_inherit,is_support_ACL"),
+        ("/s/b", [(ADMINS, 1)], "is_inherit,is_support_ACL"),
+        ("/s/c", [(ADMINS, 1)], "is_inherit,is_support_ACL")
+    ]
+    NEW = [
+        ("/s", [(ADMINS, 0)], "is_support_ACL"),
+        ("/s/a", [(BOSS, 0), (ADMINS_READ, 0), (ADMINS, 1)], "is_inherit,is_support_ACL"),
+        ("/s/a/x", [(BOSS, 1), (ADMINS_READ, 1), (ADMINS, 2)], "is_inherit,is_support_ACL"),
+        ("/s/a-b", [(ADMINS, 1)], "is_inherit,is_support_ACL"),
+        ("/s/b", [(ADMINS, 1)], "is_support_ACL")
+    ]
+
+    def test_diff(self):
+        diffs = list(SynoACLDiff.diff(source(TestSynoACLDiff.OLD), source(TestSynoACLDiff.NEW)))
+        self.assertEqual([(d.path, d.status) for d in diffs], [
+            ("/s/a", SynoACLPathDiff.CHANGED),
+            ("/s/a/x", SynoACLPathDiff.CHANGED),
+            ("/s/a-b", SynoACLPathDiff.ADDED),
+            ("/s/b", SynoACLPathDiff.CHANGED),
+            ("/s/c", SynoACLPathDiff.REMOVED)
+        ])
+
+        a = diffs[0]
+        self.assertEqual([str(acl) for acl in a.added], [BOSS, ADMINS_READ])
+        self.assertEqual([str(acl) for acl in a.removed], [GUEST])
+        self.assertEqual([(str(old), str(new)) for (old, new) in a.changed], [])
+        self.assertFalse(a.archiveChanged)
+        self.assertFalse(a.inheritedChanged)
+
+        x = diffs[1]
+        self.assertEqual(x.added + x.removed + x.changed, [])
+        self.assertTrue(x.inheritedChanged)
+
+        b = diffs[3]
+        self.assertTrue(b.archiveChanged)
+        self.assertEqual(str(b.newArchive), "is_support_ACL")
+
+        diffs = list(SynoACLDiff.diff(source(TestSynoACLDiff.OLD), source(TestSynoACLDiff.NEW), ignoreInherited = True))
+        self.assertEqual([d.path for d in diffs], ["/s/a", "/s/a-b", "/s/b", "/s/c"])
+
+    def test_changedEntry(self):
+        old = [("/s", [(ADMINS, 0)], "is_support_ACL")]
+        new = [("/s", [(ADMINS_READ, 0)], "is_support_ACL")]
+        diffs = list(SynoACLDiff.diff(source(old), source(new)))
+        self.assertEqual([(str(o), str(n)) for (o, n) in diffs[0].changed], [(ADMINS, ADMINS_READ)])
+        self.assertTrue("~ " + ADMINS + " -> " + ADMINS_READ in str(diffs[0]))
+
+    def test_orderChanged(self):
+        deny = "user:guest:deny:rwxpdDaARWc--:fd--"
+        old = [("/s", [(deny, 0), (ADMINS, 0)], "is_support_ACL")]
+        new = [("/s", [(ADMINS, 0), (deny, 0)], "is_support_ACL")]
+        diffs = list(SynoACLDiff.diff(source(old), source(new), ignoreInherited = True))
+        self.assertEqual(len(diffs), 1)
+        self.assertTrue(diffs[0].orderChanged)
+        self.assertEqual(diffs[0].added + diffs[0].removed + diffs[0].changed, [])
+        self.assertTrue("order of entries changed" in str(diffs[0]))
+
+    def test_duplicateEntries(self):
+        old = [("/s", [(GUEST, 0), (BOSS, 0), (GUEST, 0)], "is_support_ACL")]
+        new = [("/s", [(GUEST, 0), (BOSS, 0)], "is_support_ACL")]
+        diffs = list(SynoACLDiff.diff(source(old), source(new)))
+        self.assertEqual([str(acl) for acl in diffs[0].removed], [GUEST])
+        self.assertEqual(diffs[0].added + diffs[0].changed, [])
+        self.assertFalse(diffs[0].orderChanged)
+
+        guestWrite = "user:guest:allow:rw-----------:fd--"
+        new = [("/s", [(GUEST, 0), (BOSS, 0), (guestWrite, 0)], "is_support_ACL")]
+        diffs = list(SynoACLDiff.diff(source(old), source(new)))
+        self.assertEqual([(str(o), str(n)) for (o, n) in diffs[0].changed], [(GUEST, guestWrite)])
+        self.assertEqual(diffs[0].added + diffs[0].removed, [])
+
+    def test_identical(self):
+        self.assertEqual(list(SynoACLDiff.diff(source(TestSynoACLDiff.OLD), source(TestSynoACLDiff.OLD))), [])
+
+    def test_diffSnapshotWithLive(self):
+        tempDir = tempfile.mkdtemp()
+        root = os.path.join(tempDir, "root")
+        os.mkdir(root)
+        os.mkdir(os.path.join(root, "a"))
+        fileName = os.path.join(tempDir, "snapshot.gz")
+
+        originalExecutor = SynoACLTool.getExecutor()
+        executor = ListExecutor({root: [ADMINS], os.path.join(root, "a"): [GUEST]},
+            {root: ["is_support_ACL"], os.path.join(root, "a"): ["is_support_ACL"]})
+        SynoACLTool.setExecutor(executor)
+        try:
+            SynoACLSnapshot.create(root, fileName)
+            self.assertEqual(list(SynoACLDiff.diffSnapshotWithLive(fileName, root)), [])
+
+            executor.acls[os.path.join(root, "a")] = [BOSS]
+            diffs = list(SynoACLDiff.diffSnapshotWithLive(fileName, root))
+            self.assertEqual([d.path for d in diffs], [os.path.join(root, "a")])
+
+            otherFileName = os.path.join(tempDir, "other.gz")
+            SynoACLSnapshot.create(root, otherFileName)
+            diffs = list(SynoACLDiff.diffSnapshots(fileName, otherFileName))
+            self.assertEqual([str(acl) for acl in diffs[0].added], [BOSS])
+        finally:
+            SynoACLTool.setExecutor(originalExecutor)
+            shutil.rmtree(tempDir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.evaluate import SynoACLPrincipal, SynoACLEvaluator
+
+def aclSet(*entries):
+    return SynoACLSet([SynoACL.intern(acl) for (acl, level) in entries], [level for (acl, level) in entries])
+
+ALICE = SynoACLPrincipal("alice", [ "staff" ])
+BOB = SynoACLPrincipal("bob", [ "staff", "administrators" ])
+GUEST = SynoACLPrincipal("guest")
+
+class TestSynoACLEvaluator(unittest.TestCase):
+    def test_allowAndDeny(self):
+        evaluator = SynoACLEvaluator()
+        acls = aclSet(
+            ("group:staff:allow:rwx----------:fd--", 0),
+            ("user:alice:deny:-w-----------:fd--", 0),
+            ("group:administrators:allow:rwxpdDaARWc--:fd--", 1)
+        )
+        # deny wins at the same level
+        self.assertEqual(str(evaluator.evaluate(acls, ALICE)), "r-x----------")
+        self.assertEqual(str(evaluator.evaluate(acls, BOB)), "rwxpdDaARWc--")
+        self.assertEqual(str(evaluator.evaluate(acls, GUEST)), "-------------")
+
+    def test_levels(self):
+        evaluator = SynoACLEvaluator()
+        # an explicit allow overrides an inherited deny
+        acls = aclSet(
+            ("user:alice:allow:rw-----------:fd--", 0),
+            ("group:staff:deny:rwx----------:fd--", 1),
+            ("group:staff:allow:rwxp---------:fd--", 2)
+        )
+        self.assertEqual(str(evaluator.evaluate(acls, ALICE)), "rw-p---------")
+        self.assertEqual(str(evaluator.evaluate(acls, BOB)), "---p---------")
+
+    def test_inheritOnlyAndSpecialRoles(self):
+        evaluator = SynoACLEvaluator()
+        acls = aclSet(
+            ("user:alice:allow:rwx----------:fdi-", 0),
+            ("everyone:*:allow:r------------:fd--", 0),
+            ("owner:*:allow:rwxpdDaARWcCo:fd--", 0)
+        )
+        self.assertEqual(str(evaluator.evaluate(acls, ALICE)), "r------------")
+        self.assertEqual(str(evaluator.evaluate(acls, ALICE, owner = "alice")), "rwxpdDaARWcCo")
+
+    def test_inheritOnlyOnChild(self):
+        evaluator = SynoACLEvaluator()
+        acls = aclSet(("user:alice:allow:rwx----------:fdi-", 1))
+        self.assertEqual(str(evaluator.evaluate(acls, ALICE)), "rwx----------")
+
+        backend = FakeSynoACLBackend()
+        backend.makeDirectory("/s", [ "user:alice:allow:rwx----------:fdi-" ], "is_support_ACL")
+        backend.makeDirectory("/s/c")
+        executor = SynoACLTool.getExecutor()
+        try:
+            SynoACLTool.setExecutor(SynoACLExecutor(backend = backend))
+            self.assertEqual(str(evaluator.evaluatePath("/s", ALICE)), "-------------")
+            self.assertEqual(str(evaluator.evaluatePath("/s/c", ALICE)), "rwx----------")
+        finally:
+            SynoACLTool.setExecutor(executor)
+
+    def test_memoized(self):
+        evaluator = SynoACLEvaluator()
+        a = aclSet(("user:alice:allow:r------------:fd--", 0))
+        b = aclSet(("user:alice:allow:r------------:fd--", 0))
+        self.assertTrue(evaluator.evaluate(a, ALICE) is evaluator.evaluate(b, ALICE))
+        self.assertEqual(len(evaluator._compiled), 1)
+
+    def test_tree(self):
+        backend = FakeSynoACLBackend()
+        backend.makeTree("/share", 2, 2)
+        backend.makeDirectory("/share", [ "group:staff:allow:r------------:fd--" ], "is_support_ACL")
+        backend.makeDirectory("/share/d1", [ "user:alice:deny:r------------:fd--", "user:bob:allow:rw-----------:fd--" ])
+        executor = SynoACLTool.getExecutor()
+        try:
+            SynoACLTool.setExecutor(SynoACLExecutor(backend = backend))
+            result = dict((path, [str(p) for p in permissions])
+                for (path, permissions) in SynoACLEvaluator().evaluateTree("/share", [ ALICE, BOB, GUEST ]))
+        finally:
+            SynoACLTool.setExecutor(executor)
+
+        self.assertEqual(len(result), 7)
+        self.assertEqual(result["/share/d0/d1"], [ "r------------", "r------------", "-------------" ])
+        self.assertEqual(result["/share/d1/d0"], [ "-------------", "rw-----------", "-------------" ])
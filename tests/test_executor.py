@@ -0,0 +1,76 @@
+import unittest
+import threading
+import time
+
+from synoacl.executor import SynoACLExecutor, SynoACLResult
+
+class TestSynoACLResult(unittest.TestCase):
+    def test_ok(self):
+        self.assertTrue(SynoACLResult("/a", value = 1).ok)
+        self.assertFalse(SynoACLResult("/a", error = Exception("boom")).ok)
+
+class TestSynoACLExecutor(unittest.TestCase):
+    def test_badConcurrency(self):
+        with self.assertRaises(Exception):
+            SynoACLExecutor(concurrency = 0)
+
+    def test_mapSerial(self):
+        executor = SynoACLExecutor(concurrency = 1)
+        results = executor.map(lambda x: x * 2, [1, 2, 3])
+        self.assertEqual([r.path for r in results], [1, 2, 3])
+        self.assertEqual([r.value for r in results], [2, 4, 6])
+
+    def test_mapPreservesOrder(self):
+        def slowForSmall(x):
+            time.sleep(0.001 * (20 - x))
+            return x
+
+        executor = SynoACLExecutor(concurrency = 8)
+        results = executor.map(slowForSmall, range(20))
+        self.assertEqual([r.value for r in results], list(range(20)))
+
+    def test_mapIsBounded(self):
+        lock = threading.Lock()
+        state = {"running": 0, "max": 0}
+
+        def work(x):
+            with lock:
+                state["running"] += 1
+                state["max"] = max(state["max"], state["running"])
+            time.sleep(0.002)
+            with lock:
+                state["running"] -= 1
+            return x
+
+        executor = SynoACLExecutor(concurrency = 3)
+        executor.map(work, range(30))
+        self.assertTrue(state["max"] <= 3)
+
+    def test_errorsArePerPath(self):
+        def failOnOdd(x):
+            if x % 2:
+                raise ValueError("odd: " + str(x))
+            return x
+
+        for concurrency in [1, 4]:
+            results = SynoACLExecutor().map(failOnOdd, range(6), concurrency)
+            self.assertEqual([r.ok for r in results], [True, False] * 3)
+            self.assertTrue(isinstance(results[1].error, ValueError))
+            self.assertEqual(results[4].value, 4)
+
+    def test_imapIsLazy(self):
+        consumed = []
+
+        def paths():
+            for i in range(1000):
+                consumed.append(i)
+                yield i
+
+        executor = SynoACLExecutor(concurrency = 2)
+        results = executor.imap(lambda x: x, paths())
+        self.assertEqual(next(results).value, 0)
+        results.close()
+        self.assertTrue(len(consumed) < 1000)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import subprocess
+import time
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.cache import SynoACLCache
+from synoacl.fake import FakeSynoACLBackend
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+FILES_ONLY = "user:boss:allow:r------------:f---"
+
+class TestFakeSynoACLBackend(unittest.TestCase):
+    def setUp(self):
+        self.executor = SynoACLTool.getExecutor()
+        self.cache = SynoACLTool.getCache()
+        self.backend = FakeSynoACLBackend()
+        self.backend.makeDirectory("/share", [ ADMINS, FILES_ONLY ], "is_support_ACL")
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+        SynoACLTool.setCache(self.cache)
+
+    def test_inheritance(self):
+        self.backend.makeDirectory("/share/dir", [ GUEST ])
+        self.backend.makeFile("/share/dir/file")
+        self.assertEqual(str(SynoACLTool.get("/share/dir")), str(SynoACLSet([ SynoACL.fromString(GUEST), SynoACL.fromString(ADMINS) ], [0, 1])))
+        self.backend.makeFile("/share/file")
+        # entries are only inherited as their flags say
+        self.assertEqual(str(SynoACLTool.get("/share/dir/file")), str(SynoACLSet([ SynoACL.fromString(GUEST), SynoACL.fromString(ADMINS) ], [1, 2])))
+        self.assertEqual(str(SynoACLTool.get("/share/file")), str(SynoACLSet([ SynoACL.fromString(ADMINS), SynoACL.fromString(FILES_ONLY) ], [1, 1])))
+        self.assertEqual(str(SynoACLTool.getArchive("/share/dir")), "is_inherit,has_ACL,is_support_ACL")
+
+    def test_changes(self):
+        self.backend.makeDirectory("/share/dir")
+        SynoACLTool.add("/share/dir", SynoACL.fromString(GUEST))
+        acls = SynoACLTool.add("/share/dir", SynoACL.fromString(FILES_ONLY))
+        # -add inserts at the front
+        self.assertEqual([str(acl) for acl in acls.getDirect()], [ FILES_ONLY, GUEST ])
+
+        acls = SynoACLTool.replace("/share/dir", 1, SynoACL.fromString(ADMINS))
+        self.assertEqual([str(acl) for acl in acls.getDirect()], [ FILES_ONLY, ADMINS ])
+        acls = SynoACLTool.deleteEntry("/share/dir", 0)
+        self.assertEqual([str(acl) for acl in acls.getDirect()], [ ADMINS ])
+
+        # inherited entries can't be deleted
+        with self.assertRaises(subprocess.CalledProcessError):
+            SynoACLTool.deleteEntry("/share/dir", 1)
+
+        SynoACLTool.deleteAll("/share/dir")
+        self.assertEqual(len(SynoACLTool.get("/share/dir").getAll()), 0)
+        self.assertFalse(SynoACLTool.getArchive("/share/dir").isInherit)
+
+        SynoACLTool.enforceInherit("/share/dir")
+        self.assertEqual(len(SynoACLTool.get("/share/dir").getAll()), 1)
+        self.assertEqual(self.backend.calls["-add"], 2)
+
+    def test_archiveCopied(self):
+        archive = SynoACLArchive(isSupportACL = True)
+        self.backend.makeDirectory("/share/a", [], archive)
+        self.backend.makeDirectory("/share/b", [], archive)
+        SynoACLTool.add("/share/a", SynoACL.fromString(GUEST))
+        # the change of has_ACL doesn't leak to the caller's object nor the other path
+        self.assertEqual(str(archive), "is_support_ACL")
+        self.assertEqual(str(SynoACLTool.getArchive("/share/a")), "has_ACL,is_support_ACL")
+        self.assertEqual(str(SynoACLTool.getArchive("/share/b")), "is_support_ACL")
+
+    def test_linuxMode(self):
+        self.backend.makeDirectory("/linux", archive = "is_inherit")
+        self.assertEqual(len(SynoACLTool.get("/linux").getAll()), 0)
+        with self.assertRaises(subprocess.CalledProcessError):
+            SynoACLTool.add("/linux", SynoACL.fromString(GUEST))
+
+    def test_missingPath(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            SynoACLTool.getArchive("/missing")
+        backend = FakeSynoACLBackend(autoCreate = True)
+        self.assertEqual(str(backend.communicate(["-get-archive", "/missing/dir"])[0]), "Archive: is_inherit,is_support_ACL")
+        self.assertTrue(backend.isDirectory("/missing"))
+
+    def test_walk(self):
+        count = self.backend.makeTree("/share", width = 3, depth = 2, filesPerDirectory = 1)
+        self.assertEqual(count, 1 + 3 + 1 + 9 + 3)
+        paths = [entry[0] for entry in SynoACLTool.walk("/share", includeFiles = True)]
+        self.assertEqual(len(paths), count)
+        self.assertEqual(paths[:4], [ "/share", "/share/d0", "/share/d0/d0", "/share/d0/d1" ])
+
+    def test_latency(self):
+        backend = FakeSynoACLBackend(latency = 0.05)
+        backend.makeTree("/share", width = 8, depth = 1)
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = backend, concurrency = 8))
+        start = time.time()
+        results = SynoACLTool.getMany(["/share/d" + str(i) for i in range(8)])
+        self.assertTrue(all(result.ok for result in results))
+        # the calls overlap
+        self.assertTrue(time.time() - start < 8 * 0.05)
+        self.assertEqual(backend.calls["-get"], 8)
+
+    def test_cache(self):
+        self.backend.makeDirectory("/share/dir")
+        SynoACLTool.setCache(SynoACLCache(backend = self.backend))
+        SynoACLTool.get("/share/dir")
+        SynoACLTool.get("/share/dir")
+        self.assertEqual(self.backend.calls["-get"], 1)
+
+        # a change done behind the tool's back changes the ctime
+        self.backend.communicate(["-add", "/share/dir", GUEST])
+        self.assertEqual(len(SynoACLTool.get("/share/dir").getDirect()), 1)
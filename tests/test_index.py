@@ -0,0 +1,80 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from synoacl.tool import SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.snapshot import SynoACLSnapshot
+from synoacl.index import SynoACLIndex
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+ALICE = "user:alice:allow:rwx----------:fd--"
+ALICE_DENY = "user:alice:deny:-w-----------:fd--"
+BOB = "user:bob:allow:r------------:fd--"
+
+class TestSynoACLIndex(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.executor = SynoACLTool.getExecutor()
+        self.backend = FakeSynoACLBackend()
+        self.backend.makeTree("/share", 2, 2)
+        self.backend.makeDirectory("/share", [ ADMINS ], "is_support_ACL")
+        self.backend.makeDirectory("/share/d0", [ ALICE, ALICE_DENY ])
+        self.backend.makeDirectory("/share/d1/d1", [ ALICE, BOB ])
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+        self.index = SynoACLIndex(os.path.join(self.tempDir, "index.db"))
+        self.index.update(SynoACLTool.walk("/share"), root = "/share")
+
+    def tearDown(self):
+        self.index.close()
+        SynoACLTool.setExecutor(self.executor)
+        shutil.rmtree(self.tempDir)
+
+    def test_find(self):
+        self.assertEqual(len(self.index), 7)
+        self.assertEqual(self.index.findPaths("user", "alice", directOnly = True), [ "/share/d0", "/share/d1/d1" ])
+        self.assertEqual(self.index.findPaths("user", "alice"), [ "/share/d0", "/share/d0/d0", "/share/d0/d1", "/share/d1/d1" ])
+        self.assertEqual([(hit.path, hit.level) for hit in self.index.find("user", "alice", "deny")],
+            [ ("/share/d0", 0), ("/share/d0/d0", 1), ("/share/d0/d1", 1) ])
+        self.assertEqual(self.index.findPaths("group", "administrators"), sorted(path for (path, archive, acls) in SynoACLTool.walk("/share")))
+        self.assertEqual(self.index.find("user", "nobody"), [])
+        self.assertEqual(self.index.principals(), [ ("group", "administrators"), ("user", "alice"), ("user", "bob") ])
+        self.assertEqual(self.index.get("/share/d0"), SynoACLTool.get("/share/d0"))
+        self.assertEqual(self.index.get("/missing"), None)
+
+    def test_incrementalUpdate(self):
+        SynoACLTool.deleteAll("/share/d1/d1")
+        SynoACLTool.enforceInherit("/share/d1/d1")
+        self.backend.makeDirectory("/share/d2", [ BOB ])
+        self.index.update(SynoACLTool.walk("/share/d1"), root = "/share/d1")
+        self.assertEqual(self.index.findPaths("user", "bob"), [])
+        self.index.update(SynoACLTool.walk("/share/d2"))
+        self.assertEqual(self.index.findPaths("user", "bob"), [ "/share/d2" ])
+
+        self.index.remove("/share/d0", recursive = True)
+        self.assertEqual(self.index.findPaths("user", "alice"), [])
+        self.assertEqual(self.index.principals(), [ ("group", "administrators"), ("user", "bob") ])
+
+    def test_snapshot(self):
+        fileName = os.path.join(self.tempDir, "snapshot")
+        SynoACLSnapshot.create("/share", fileName)
+        index = SynoACLIndex(":memory:")
+        self.assertEqual(index.updateFromSnapshot(fileName), 7)
+        self.assertEqual(index.findPaths("user", "bob"), [ "/share/d1/d1" ])
+        index.close()
+
+    def test_deleteForRole(self):
+        summary = self.index.deleteForRole("user", "alice", dryRun = True)
+        self.assertEqual(summary.changed, [ "/share/d0", "/share/d1/d1" ])
+        self.assertEqual(len(summary.operations["/share/d0"]), 2)
+        self.assertEqual(self.backend.calls["-del"], 0)
+
+        summary = self.index.deleteForRole("user", "alice", concurrency = 2)
+        self.assertTrue(summary.isSuccess())
+        self.assertEqual(summary.changed, [ "/share/d0", "/share/d1/d1" ])
+        self.assertEqual(self.backend.calls["-del"], 3)
+        self.assertEqual(self.index.findPaths("user", "alice"), [])
+        self.assertEqual(self.index.findPaths("user", "bob"), [ "/share/d1/d1" ])
+        self.assertEqual(self.index.get("/share/d0/d1"), SynoACLTool.get("/share/d0/d1"))
@@ -0,0 +1,87 @@
+import unittest
+import subprocess
+
+from synoacl.tool import SynoACL, SynoACLArchive, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.instrument import SynoACLInstrumentation, SynoACLHook, SynoACLHistogram
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+
+class RecordingHook(SynoACLHook):
+    def __init__(self):
+        self.started = []
+        self.finished = []
+
+    def callStarted(self, args):
+        self.started.append(args)
+        return len(self.started)
+
+    def callFinished(self, call, context):
+        self.finished.append((call, context))
+
+class TestSynoACLInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.executor = SynoACLTool.getExecutor()
+        self.backend = FakeSynoACLBackend()
+        self.backend.makeDirectory("/share", [ ADMINS ], "is_support_ACL")
+        self.backend.makeDirectory("/share/dir")
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+        self.instrumentation = SynoACLInstrumentation()
+        SynoACLTool.setInstrumentation(self.instrumentation)
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+        SynoACLTool.setInstrumentation(None)
+
+    def test_stats(self):
+        SynoACLTool.get("/share/dir")
+        SynoACLTool.add("/share/dir", SynoACL.fromString(GUEST))
+        SynoACLTool.get("/share/dir")
+        SynoACLTool.getArchive("/share/dir")
+        with self.assertRaises(subprocess.CalledProcessError):
+            SynoACLTool.deleteEntry("/share/dir", 5)
+
+        stats = self.instrumentation.stats()
+        self.assertEqual(sorted(stats), [ "-add", "-del", "-get", "-get-archive" ])
+        self.assertEqual((stats["-get"].count, stats["-get"].errors), (2, 0))
+        self.assertEqual((stats["-del"].count, stats["-del"].errors), (1, 1))
+        # header (4 lines) + 1 and 2 entries
+        self.assertEqual(stats["-get"].lines, 4 + 1 + 4 + 2)
+        self.assertEqual(stats["-get-archive"].lines, 1)
+        self.assertEqual(sum(stats["-get"].histogram.counts), 2)
+        self.assertTrue(stats["-get"].parseTime > 0)
+        self.assertTrue("-get-archive" in str(self.instrumentation))
+        self.assertEqual(self.instrumentation.toDict()["-add"]["count"], 1)
+
+        self.instrumentation.reset()
+        self.assertEqual(self.instrumentation.stats(), {})
+
+    def test_hooks(self):
+        hook = RecordingHook()
+        self.instrumentation.addHook(hook)
+        SynoACLTool.enforceInherit("/share/dir")
+        SynoACLTool.setArchive("/share/dir", SynoACLArchive(isReadOnly = True))
+        self.instrumentation.removeHook(hook)
+        SynoACLTool.get("/share/dir")
+
+        self.assertEqual(hook.started, [ [ "-enforce-inherit", "/share/dir" ], [ "-set-archive", "/share/dir", "is_read_only" ] ])
+        self.assertEqual([(call.command, context) for (call, context) in hook.finished], [ ("-enforce-inherit", 1), ("-set-archive", 2) ])
+        self.assertTrue(hook.finished[1][0].error is None)
+
+    def test_disabled(self):
+        SynoACLTool.setInstrumentation(None)
+        SynoACLTool.get("/share/dir")
+        self.assertEqual(self.instrumentation.stats(), {})
+
+class TestSynoACLHistogram(unittest.TestCase):
+    def test_percentile(self):
+        histogram = SynoACLHistogram((1, 2, 3))
+        self.assertEqual(histogram.percentile(50), None)
+        for duration in [ 0.5, 1.5, 1.5, 2.5, 10 ]:
+            histogram.add(duration)
+        self.assertEqual(histogram.counts, [ 1, 2, 1, 1 ])
+        self.assertEqual(histogram.percentile(50), 2)
+        self.assertEqual(histogram.percentile(0), 1)
+        self.assertEqual(histogram.percentile(100), float("inf"))
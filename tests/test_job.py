@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from synoacl.tool import SynoACL, SynoACLArchive, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.job import SynoACLJob, SynoACLJournal
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+ALICE = "user:alice:allow:rwx----------:fd--"
+
+class TestSynoACLJob(unittest.TestCase):
+    def setUp(self):
+        self.executor = SynoACLTool.getExecutor()
+        self.backend = FakeSynoACLBackend()
+        self.backend.makeTree("/share", 4, 1)
+        self.backend.makeDirectory("/share/d1", [ ADMINS ])
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+        self.tempDir = tempfile.mkdtemp()
+        self.journalFile = os.path.join(self.tempDir, "job.journal")
+        self.paths = [ "/share/d" + str(i) for i in range(4) ]
+        self.desired = [SynoACL.intern(ADMINS), SynoACL.intern(ALICE)]
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+        shutil.rmtree(self.tempDir)
+
+    def items(self):
+        return [(path, self.desired, None) for path in self.paths]
+
+    def records(self):
+        with open(self.journalFile) as f:
+            return [line.rstrip("\n").split("\t") for line in f]
+
+    def test_reconcile(self):
+        with SynoACLJob(self.journalFile, name = "migration") as job:
+            summary = job.reconcile(self.items(), concurrency = 2)
+        self.assertEqual(summary.changed, self.paths)
+        self.assertEqual(self.backend.calls["-add"], 7)
+
+        records = self.records()
+        self.assertEqual(records[0], [ "synoacl-journal 1", "migration" ])
+        self.assertIn([ "P", "/share/d1", "add " + ALICE ], records)
+        self.assertEqual(sorted(r[1] for r in records if r[0] == "D"), self.paths)
+
+        # everything is done, nothing is touched again
+        with SynoACLJob(self.journalFile, name = "migration") as job:
+            summary = job.reconcile(self.items())
+        self.assertEqual(summary.skipped, 4)
+        self.assertEqual(self.backend.calls["-get"], 4)
+
+        with self.assertRaises(Exception):
+            SynoACLJob(self.journalFile, name = "other")
+
+    def test_resume(self):
+        class Interrupt(Exception):
+            pass
+
+        def interrupt(path, summary):
+            if len(summary.changed) == 2:
+                raise Interrupt()
+
+        with SynoACLJob(self.journalFile) as job:
+            with self.assertRaises(Interrupt):
+                job.reconcile(self.items(), concurrency = 1, progress = interrupt)
+
+        with SynoACLJob(self.journalFile) as job:
+            summary = job.reconcile(self.items())
+        self.assertEqual(summary.skipped, 2)
+        self.assertEqual(summary.changed, self.paths[2:])
+        for path in self.paths:
+            self.assertEqual(sorted(map(str, SynoACLTool.get(path).getDirect())), [ ADMINS, ALICE ])
+
+    def test_failedRetried(self):
+        items = self.items() + [ ("/share/missing", self.desired, None) ]
+        with SynoACLJob(self.journalFile) as job:
+            summary = job.reconcile(items)
+        self.assertEqual(summary.failed, [ "/share/missing" ])
+
+        self.backend.makeDirectory("/share/missing")
+        with SynoACLJob(self.journalFile) as job:
+            self.assertIn("/share/missing", job.journal.failed)
+            summary = job.reconcile(items)
+        self.assertEqual(summary.changed, [ "/share/missing" ])
+        self.assertEqual(summary.skipped, 4)
+
+    def test_archiveOnly(self):
+        with SynoACLJob(self.journalFile) as job:
+            summary = job.reconcile((path, None, SynoACLArchive(isSupportACL = True)) for path in self.paths)
+        self.assertEqual(len(summary.changed), 4)
+        self.assertEqual(self.backend.calls["-get"], 0)
+        self.assertIn([ "P", "/share/d0", "del-archive is_inherit" ], self.records())
+
+    def test_dryRun(self):
+        with SynoACLJob(self.journalFile, dryRun = True) as job:
+            summary = job.reset((path, self.desired) for path in self.paths)
+        self.assertEqual(len(summary.changed), 4)
+        self.assertFalse(os.path.exists(self.journalFile))
+        self.assertEqual(self.backend.calls["-add"], 0)
+
+    def test_truncatedRecord(self):
+        with SynoACLJob(self.journalFile) as job:
+            job.reset((path, self.desired) for path in self.paths[:2])
+        size = os.path.getsize(self.journalFile)
+        with open(self.journalFile, "a") as f:
+            f.write("D\t/share/d")
+
+        with SynoACLJournal(self.journalFile) as journal:
+            self.assertEqual(journal.done, set(self.paths[:2]))
+            self.assertEqual(os.path.getsize(self.journalFile), size)
+            journal.markDone("/share/d3")
+        with SynoACLJournal(self.journalFile, readOnly = True) as journal:
+            self.assertEqual(journal.done, set(self.paths[:2] + [ "/share/d3" ]))
+
+    def test_batchedSync(self):
+        with mock.patch("os.fsync") as fsync:
+            with SynoACLJournal(self.journalFile, syncEvery = 10, syncInterval = 3600) as journal:
+                for i in range(25):
+                    journal.markDone("/share/d" + str(i))
+            # the header, two full batches and close
+            self.assertEqual(fsync.call_count, 4)
+        with SynoACLJournal(self.journalFile, readOnly = True) as journal:
+            self.assertEqual(len(journal.done), 25)
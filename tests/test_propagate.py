@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from synoacl.tool import SynoACLArchive, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.propagate import SynoACLPropagator, SynoACLPropagationCheckpoint
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+ALICE = "user:alice:allow:rwx----------:fd--"
+
+class TestSynoACLPropagator(unittest.TestCase):
+    def setUp(self):
+        self.executor = SynoACLTool.getExecutor()
+        self.backend = FakeSynoACLBackend()
+        # 1 + 3 + 9 directories
+        self.backend.makeTree("/share", 3, 2)
+        self.backend.makeDirectory("/share", [ ADMINS ], "is_support_ACL")
+        self.backend.makeDirectory("/share/d0", [ ALICE ])
+        self.backend.makeDirectory("/share/d1/d2", [ ALICE ], "is_support_ACL")
+        self.backend.makeDirectory("/share/d2/d0", [], "is_support_ACL")
+        self.backend.makeDirectory("/share/d2/d1", [], "is_inherit,is_read_only,is_support_ACL")
+        self.backend.makeDirectory("/share/d2/d2", [], "None")
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+        self.tempDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+        shutil.rmtree(self.tempDir)
+
+    def assertInherits(self, path):
+        parent = self.backend.getACLs(os.path.dirname(path))
+        self.assertEqual(self.backend.getACLs(path), parent.inherited())
+
+    def test_propagate(self):
+        summary = SynoACLPropagator.propagate("/share", concurrency = 2)
+        self.assertEqual(summary.changed, [ "/share/d0", "/share/d1/d2", "/share/d2/d0" ])
+        self.assertEqual(summary.enforced, summary.changed)
+        self.assertEqual(len(summary.unchanged), 9)
+        self.assertTrue(summary.isSuccess())
+        # only the archive flags are read, -get is never needed
+        self.assertEqual(self.backend.calls["-get-archive"], 12)
+        self.assertEqual(self.backend.calls["-enforce-inherit"], 3)
+        self.assertEqual(self.backend.calls["-get"], 0)
+
+        for path in [ "/share/d0", "/share/d0/d1", "/share/d1/d2", "/share/d2/d0" ]:
+            self.assertInherits(path)
+        # Linux mode is left alone
+        self.assertEqual(str(SynoACLTool.getArchive("/share/d2/d2")), "None")
+        self.assertEqual(str(SynoACLTool.getArchive("/share/d2/d1")), "is_inherit,is_read_only,is_support_ACL")
+
+    def test_propagateArchive(self):
+        summary = SynoACLPropagator.propagate("/share", archive = SynoACLArchive(isSupportACL = True))
+        self.assertEqual(summary.changed, [ "/share/d0", "/share/d1/d2", "/share/d2/d0", "/share/d2/d1" ])
+        self.assertEqual(summary.enforced, [ "/share/d0", "/share/d1/d2", "/share/d2/d0" ])
+        self.assertEqual(str(summary.archiveChanges["/share/d2/d1"][0]), "is_read_only")
+        self.assertEqual(str(SynoACLTool.getArchive("/share/d2/d1")), "is_inherit,is_support_ACL")
+        self.assertEqual(str(SynoACLTool.getArchive("/share/d0")), "is_inherit,is_support_ACL")
+        self.assertEqual(self.backend.calls["-del-archive"], 1)
+        self.assertEqual(self.backend.calls["-set-archive"], 0)
+
+    def test_dryRun(self):
+        summary = SynoACLPropagator.propagate("/share", dryRun = True)
+        self.assertEqual(len(summary.changed), 3)
+        self.assertEqual(self.backend.calls["-enforce-inherit"], 0)
+        self.assertEqual([str(acl) for acl in SynoACLTool.get("/share/d0").getDirect()], [ ALICE ])
+
+    def test_progress(self):
+        seen = []
+        SynoACLPropagator.propagate("/share", progress = lambda path, summary: seen.append((path, len(summary.changed))))
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(seen[0], ("/share/d0", 1))
+        self.assertEqual(seen[-1], ("/share/d2/d2", 3))
+
+    def test_resume(self):
+        checkpoint = os.path.join(self.tempDir, "propagate.json")
+
+        class Interrupt(Exception):
+            pass
+
+        def interrupt(path, summary):
+            if path == "/share/d1/d0":
+                raise Interrupt()
+
+        with self.assertRaises(Interrupt):
+            SynoACLPropagator.propagate("/share", concurrency = 1, progress = interrupt, checkpoint = checkpoint)
+        state = SynoACLPropagationCheckpoint(checkpoint)
+        self.assertTrue(state.load())
+        self.assertEqual(state.root, "/share")
+        self.assertEqual(state.last, "/share/d1/d0")
+        self.assertEqual(self.backend.calls["-get-archive"], 6)
+
+        summary = SynoACLPropagator.propagate("/share", checkpoint = checkpoint)
+        self.assertEqual(summary.changed, [ "/share/d1/d2", "/share/d2/d0" ])
+        # /share/d0 with its children is skipped as a whole, then /share/d1 and /share/d1/d0
+        self.assertEqual(summary.skipped, 3)
+        self.assertEqual(len(summary.unchanged), 4)
+        self.assertEqual(self.backend.calls["-get-archive"], 12)
+        self.assertFalse(os.path.exists(checkpoint))
+
+        state.save()
+        with self.assertRaises(Exception):
+            SynoACLPropagator.propagate("/other", checkpoint = checkpoint)
+
+    def test_resumeUnlisted(self):
+        checkpoint = os.path.join(self.tempDir, "propagate.json")
+        backend = self.backend
+        listDirectory = backend.listDirectory
+
+        def failingListDirectory(path):
+            if path == "/share/d1":
+                raise OSError(13, "Permission denied", path)
+            return listDirectory(path)
+
+        class Interrupt(Exception):
+            pass
+
+        def interrupt(path, summary):
+            if path == "/share/d2/d0":
+                raise Interrupt()
+
+        backend.listDirectory = failingListDirectory
+        with self.assertRaises(Interrupt):
+            SynoACLPropagator.propagate("/share", concurrency = 1, progress = interrupt, checkpoint = checkpoint)
+        state = SynoACLPropagationCheckpoint(checkpoint)
+        state.load()
+        self.assertEqual((state.last, state.failed, state.unlisted), ("/share/d2/d0", [ "/share/d1" ], [ "/share/d1" ]))
+
+        # /share/d1 can be listed now: what is below it gets processed on resume
+        del backend.listDirectory
+        summary = SynoACLPropagator.propagate("/share", concurrency = 1, checkpoint = checkpoint)
+        self.assertEqual(summary.changed, [ "/share/d1/d2" ])
+        self.assertEqual(summary.unchanged, [ "/share/d1", "/share/d1/d0", "/share/d1/d1", "/share/d2/d1", "/share/d2/d2" ])
+        self.assertTrue(summary.isSuccess())
+        self.assertInherits("/share/d1/d2")
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpointOrder(self):
+        components = SynoACLPropagator._components
+        last = components("/share/a/b")
+        self.assertTrue(SynoACLPropagator._isDone(components("/share/a"), last))
+        self.assertTrue(SynoACLPropagator._isDone(components("/share/0"), last))
+        self.assertFalse(SynoACLPropagator._isDone(components("/share/a/b/c"), last))
+        self.assertFalse(SynoACLPropagator._isDone(components("/share/a/c"), last))
+        # "a b" is listed after "a" (but sorts before "a/b" as a string)
+        self.assertFalse(SynoACLPropagator._isDone(components("/share/a b"), last))
+        self.assertTrue(SynoACLPropagator._canPrune(components("/share/0"), last))
+        self.assertFalse(SynoACLPropagator._canPrune(components("/share/a"), last))
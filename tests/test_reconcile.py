@@ -0,0 +1,88 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.reconcile import SynoACLReconciler
+from tests.test_tool import ListExecutor
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+
+class TestSynoACLReconciler(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for d in ["a", "b", "c"]:
+            os.mkdir(os.path.join(self.root, d))
+        self.originalExecutor = SynoACLTool.getExecutor()
+        self.executor = ListExecutor({
+            self.path("a"): [ADMINS],
+            self.path("b"): [ADMINS, GUEST],
+            self.path("c"): [GUEST]
+        }, {
+            self.path("a"): ["is_support_ACL"],
+            self.path("b"): ["is_support_ACL"],
+            self.path("c"): ["is_inherit", "is_support_ACL"]
+        })
+        SynoACLTool.setExecutor(self.executor)
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.originalExecutor)
+        shutil.rmtree(self.root)
+
+    def path(self, p):
+        return os.path.join(self.root, p)
+
+    def test_expand(self):
+        state = (SynoACLSet([]), None)
+        explicitState = (SynoACLSet([]), SynoACLArchive())
+        expanded = SynoACLReconciler.expand({
+            os.path.join(self.root, "*"): state,
+            self.path("b"): explicitState,
+            self.path("none"): state
+        })
+        self.assertEqual([path for (path, s) in expanded], [self.path(p) for p in ["a", "b", "c", "none"]])
+        self.assertTrue(expanded[1][1] is explicitState)
+
+        with self.assertRaises(Exception):
+            SynoACLReconciler.expand({os.path.join(self.root, "*"): state, os.path.join(self.root, "[ab]"): state})
+
+    def test_reconcile(self):
+        desired = (SynoACLSet([SynoACL.fromString(ADMINS)]), SynoACLArchive(isSupportACL = True))
+        mapping = {os.path.join(self.root, "*"): desired}
+
+        summary = SynoACLReconciler.reconcile(mapping, dryRun = True)
+        self.assertEqual(summary.unchanged, [self.path("a")])
+        self.assertEqual(summary.changed, [self.path("b"), self.path("c")])
+        self.assertEqual(self.executor.acls[self.path("c")], [GUEST])
+        self.assertTrue(summary.archiveChanges[self.path("c")][0].isInherit)
+
+        summary = SynoACLReconciler.reconcile(mapping, concurrency = 2)
+        self.assertEqual(str(summary), "changed: 2, unchanged: 1, failed: 0")
+        for p in ["a", "b", "c"]:
+            self.assertEqual(self.executor.acls[self.path(p)], [ADMINS])
+            self.assertEqual(self.executor.archives[self.path(p)], ["is_support_ACL"])
+
+        summary = SynoACLReconciler.reconcile(mapping)
+        self.assertEqual(len(summary.unchanged), 3)
+
+    def test_reconcileFailures(self):
+        class FailingExecutor(ListExecutor):
+            def communicate(self, args):
+                if args[1].endswith("b") and args[0] != "-get":
+                    raise Exception("synoacltool failed")
+                return ListExecutor.communicate(self, args)
+
+        SynoACLTool.setExecutor(FailingExecutor(self.executor.acls, self.executor.archives))
+        summary = SynoACLReconciler.reconcileItems([
+            (self.path("a"), [], None),
+            (self.path("b"), [], None)
+        ])
+        self.assertEqual(summary.changed, [self.path("a")])
+        self.assertEqual(summary.failed, [self.path("b")])
+        self.assertFalse(summary.isSuccess())
+        self.assertEqual(str(summary.errors[self.path("b")]), "synoacltool failed")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import threading
+import time
+import unittest
+from timeit import default_timer
+
+from synoacl.tool import SynoACL, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.schedule import SynoACLScheduler
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+
+class TestSynoACLScheduler(unittest.TestCase):
+    def waitForQueue(self, scheduler, depth):
+        deadline = default_timer() + 5
+        while scheduler.queueDepth() < depth:
+            self.assertLess(default_timer(), deadline)
+            time.sleep(0.001)
+
+    def test_classify(self):
+        self.assertEqual(SynoACLScheduler.classify(["-get", "/share"]), SynoACLScheduler.INTERACTIVE)
+        self.assertEqual(SynoACLScheduler.classify(["-get-archive", "/share"]), SynoACLScheduler.INTERACTIVE)
+        self.assertEqual(SynoACLScheduler.classify(["-add", "/share", GUEST]), SynoACLScheduler.BULK)
+        with SynoACLScheduler.priority(SynoACLScheduler.NORMAL):
+            self.assertEqual(SynoACLScheduler.classify(["-get", "/share"]), SynoACLScheduler.NORMAL)
+        self.assertEqual(SynoACLScheduler.classify(["-get", "/share"]), SynoACLScheduler.INTERACTIVE)
+
+    def test_priority(self):
+        scheduler = SynoACLScheduler(concurrency = 1)
+        order = []
+
+        def call(args):
+            with scheduler.slot(args):
+                order.append(args[0])
+
+        blocker = scheduler.acquire(["-add", "/share", GUEST])
+        bulk = threading.Thread(target = call, args = (["-add", "/share", GUEST],))
+        bulk.start()
+        self.waitForQueue(scheduler, 1)
+        interactive = threading.Thread(target = call, args = (["-get", "/share"],))
+        interactive.start()
+        self.waitForQueue(scheduler, 2)
+        self.assertEqual(scheduler.toDict()["running"], 1)
+
+        # the get came later but goes first
+        scheduler.release(blocker, 0.0)
+        bulk.join()
+        interactive.join()
+        self.assertEqual(order, [ "-get", "-add" ])
+        self.assertEqual(scheduler.queueDepth(), 0)
+
+        stats = scheduler.stats()
+        self.assertEqual(stats[SynoACLScheduler.BULK].calls, 2)
+        self.assertEqual(stats[SynoACLScheduler.INTERACTIVE].calls, 1)
+        self.assertGreater(stats[SynoACLScheduler.BULK].maxWaitTime, 0)
+
+    def test_rate(self):
+        scheduler = SynoACLScheduler(rate = 50, burst = 2)
+        start = default_timer()
+        for _ in range(7):
+            scheduler.run(lambda args: None, ["-get", "/share"])
+        # 2 calls right away, then one every 20 ms
+        self.assertGreaterEqual(default_timer() - start, 0.09)
+        self.assertGreater(scheduler.stats()[SynoACLScheduler.INTERACTIVE].waitTime, 0.05)
+
+    def test_adaptiveConcurrency(self):
+        scheduler = SynoACLScheduler(concurrency = 2, maxConcurrency = 8, targetLatency = 0.1)
+
+        def call(latency):
+            scheduler.release(scheduler.acquire(["-get", "/share"]), latency)
+
+        for _ in range(100):
+            call(0.01)
+        self.assertEqual(scheduler.concurrency, 8)
+
+        # slow calls halve the limit, but only once per limit calls
+        call(1.0)
+        self.assertEqual(scheduler.concurrency, 4)
+        call(1.0)
+        self.assertEqual(scheduler.concurrency, 4)
+        for _ in range(3):
+            call(1.0)
+        self.assertEqual(scheduler.concurrency, 2)
+        for _ in range(10):
+            call(1.0)
+        self.assertEqual(scheduler.concurrency, 1)
+
+        # without maxConcurrency the limit is fixed
+        scheduler = SynoACLScheduler(concurrency = 3)
+        scheduler.release(scheduler.acquire(["-get", "/share"]), 10.0)
+        self.assertEqual(scheduler.concurrency, 3)
+
+    def test_defaultTargetLatency(self):
+        scheduler = SynoACLScheduler(concurrency = 4, maxConcurrency = 4)
+        for latency in [ 0.01, 0.015, 0.01, 0.015 ]:
+            scheduler.release(scheduler.acquire(["-get", "/share"]), latency)
+        self.assertEqual(scheduler.concurrency, 4)
+        scheduler.release(scheduler.acquire(["-get", "/share"]), 0.05)
+        self.assertEqual(scheduler.concurrency, 2)
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            SynoACLScheduler(concurrency = 0)
+        with self.assertRaises(Exception):
+            SynoACLScheduler(rate = 0)
+        # the bucket could never hold a whole token
+        with self.assertRaises(Exception):
+            SynoACLScheduler(rate = 10, burst = 0)
+
+class TestSynoACLToolScheduler(unittest.TestCase):
+    def setUp(self):
+        self.executor = SynoACLTool.getExecutor()
+        self.backend = FakeSynoACLBackend()
+        self.backend.makeTree("/share", 4, 1)
+        self.backend.makeDirectory("/share", [ ADMINS ], "is_support_ACL")
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+        self.scheduler = SynoACLScheduler(concurrency = 2)
+        SynoACLTool.setScheduler(self.scheduler)
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+        SynoACLTool.setScheduler(None)
+
+    def test_calls(self):
+        self.assertEqual(SynoACLTool.getScheduler(), self.scheduler)
+        SynoACLTool.get("/share")
+        SynoACLTool.getArchive("/share")
+        SynoACLTool.add("/share/d0", SynoACL.fromString(GUEST))
+        self.assertEqual([str(acl) for acl in SynoACLTool.get("/share/d0").getDirect()], [ GUEST ])
+        self.assertEqual(len(list(SynoACLTool.iterGet("/share/d0"))), 2)
+
+        stats = self.scheduler.stats()
+        self.assertEqual(stats[SynoACLScheduler.INTERACTIVE].calls, 4)
+        self.assertEqual(stats[SynoACLScheduler.BULK].calls, 1)
+        state = self.scheduler.toDict()
+        self.assertEqual((state["running"], state["queued"], state["concurrency"]), (0, 0, 2))
+        self.assertEqual(state["priorities"]["interactive"]["calls"], 4)
+        self.assertIn("interactive", str(self.scheduler))
+
+    def test_priorityInBatch(self):
+        paths = [ "/share/d" + str(i) for i in range(4) ]
+        with SynoACLScheduler.priority(SynoACLScheduler.NORMAL):
+            results = SynoACLTool.getMany(paths, concurrency = 4, raiseErrors = True)
+        self.assertEqual(len(results), 4)
+        # the priority is passed on to the worker threads
+        stats = self.scheduler.stats()
+        self.assertEqual(stats[SynoACLScheduler.NORMAL].calls, 4)
+        self.assertEqual(stats[SynoACLScheduler.INTERACTIVE].calls, 0)
+
+    def test_parseError(self):
+        class BrokenBackend(FakeSynoACLBackend):
+            def communicate(self, args):
+                output = FakeSynoACLBackend.communicate(self, args)
+                if args[1] == "/share/d1":
+                    # a gap in the entry indices
+                    output = [line.replace("[0]", "[1]") for line in output]
+                return output
+
+        self.backend.__class__ = BrokenBackend
+        SynoACLTool.setScheduler(SynoACLScheduler(concurrency = 1))
+        # the error (with its traceback) is kept alive in the result
+        results = SynoACLTool.getMany([ "/share/d1" ])
+        self.assertFalse(results[0].ok)
+        self.assertEqual(SynoACLTool.getScheduler().toDict()["running"], 0)
+
+        # the slot is free for the next call
+        done = []
+        thread = threading.Thread(target = lambda: done.append(SynoACLTool.get("/share")), daemon = True)
+        thread.start()
+        thread.join(5)
+        self.assertEqual(len(done), 1)
+
+    def test_concurrency(self):
+        self.backend.latency = 0.01
+        running = []
+        communicate = self.backend.communicate
+        active = [0]
+        lock = threading.Lock()
+
+        def countingCommunicate(args):
+            with lock:
+                active[0] += 1
+                running.append(active[0])
+            try:
+                return communicate(args)
+            finally:
+                with lock:
+                    active[0] -= 1
+
+        self.backend.communicate = countingCommunicate
+        paths = [ "/share/d" + str(i) for i in range(4) ] * 3
+        SynoACLTool.getArchiveMany(paths, concurrency = 8, raiseErrors = True)
+        self.assertLessEqual(max(running), 2)
@@ -0,0 +1,118 @@
+import unittest
+import gzip
+import os
+import shutil
+import tempfile
+
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.snapshot import SynoACLSnapshot, SynoACLSnapshotReader, SynoACLSnapshotWriter
+from tests.test_tool import ListExecutor
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+GUEST = "user:guest:allow:r------------:fd--"
+
+class TestSynoACLSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.tempDir, "snapshot.gz")
+        self.inherited = SynoACLSet([SynoACL.fromString(ADMINS)], [1])
+        self.own = SynoACLSet([SynoACL.fromString(GUEST), SynoACL.fromString(ADMINS)], [0, 1])
+        self.archive = SynoACLArchive(isInherit = True, isSupportACL = True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempDir)
+
+    def readLines(self):
+        with gzip.open(self.fileName, "rt") as f:
+            return f.read().split("\n")
+
+    def test_escape(self):
+        for path in ["/plain", "/with\ttab", "/back\\slash\\t", "/new\nline\r"]:
+            escaped = SynoACLSnapshot.escape(path)
+            self.assertFalse("\t" in escaped or "\n" in escaped)
+            self.assertEqual(SynoACLSnapshot.unescape(escaped), path)
+
+    def test_ids(self):
+        self.assertEqual(SynoACLSnapshot.aclSetId(self.own),
+            SynoACLSnapshot.aclSetId(SynoACLSet([SynoACL.fromString(GUEST), SynoACL.fromString(ADMINS)], [0, 1])))
+        self.assertNotEqual(SynoACLSnapshot.aclSetId(self.own), SynoACLSnapshot.aclSetId(self.inherited))
+        self.assertNotEqual(SynoACLSnapshot.aclSetId(self.inherited),
+            SynoACLSnapshot.aclSetId(SynoACLSet([SynoACL.fromString(ADMINS)], [2])))
+        self.assertEqual(SynoACLSnapshot.archiveId(self.archive), SynoACLSnapshot.archiveId(SynoACLArchive.fromString(
+            "is_inherit,is_support_ACL")))
+
+    def test_roundTrip(self):
+        paths = ["/s/a", "/s/a/x", "/s/b\tc", "/s/empty"]
+        with SynoACLSnapshotWriter(self.fileName) as writer:
+            writer.write(paths[0], self.archive, self.own)
+            writer.write(paths[1], self.archive, self.inherited)
+            writer.write(paths[2], self.archive, self.inherited)
+            writer.write(paths[3], SynoACLArchive(), SynoACLSet([]))
+
+        lines = self.readLines()
+        self.assertEqual(lines[0], SynoACLSnapshot.HEADER)
+        # the shared ACL sets and archive flags are only stored once
+        self.assertEqual(len([l for l in lines if l.startswith("S\t")]), 3)
+        self.assertEqual(len([l for l in lines if l.startswith("A\t")]), 2)
+
+        with SynoACLSnapshotReader(self.fileName) as reader:
+            read = list(reader)
+        self.assertEqual([path for (path, archive, acls) in read], paths)
+        self.assertEqual(str(read[0][2]), str(self.own))
+        self.assertEqual(str(read[1][2]), str(self.inherited))
+        self.assertTrue(read[1][2] is read[2][2])
+        self.assertEqual(str(read[3][1]), "None")
+        self.assertEqual(len(read[3][2].getAll()), 0)
+
+        with SynoACLSnapshotReader(self.fileName) as reader:
+            entries = list(reader.entries())
+            self.assertEqual(entries[1][1], entries[2][1])
+            self.assertEqual(entries[0][1], SynoACLSnapshot.aclSetId(self.own))
+            self.assertEqual(str(reader.archives[entries[0][2]]), str(self.archive))
+
+    def test_badHeader(self):
+        with gzip.open(self.fileName, "wt") as f:
+            f.write("something else\n")
+        with self.assertRaises(Exception):
+            SynoACLSnapshotReader(self.fileName)
+
+    def test_createAndRestore(self):
+        root = os.path.join(self.tempDir, "root")
+        for d in ["", "a", "b"]:
+            os.mkdir(os.path.join(root, d))
+
+        def path(p):
+            return os.path.join(root, p) if p else root
+
+        originalExecutor = SynoACLTool.getExecutor()
+        executor = ListExecutor({
+            path(""): [ADMINS],
+            path("a"): [ADMINS, GUEST],
+            path("b"): [GUEST]
+        }, {
+            path(""): ["is_support_ACL"],
+            path("a"): ["is_support_ACL"],
+            path("b"): ["is_support_ACL", "is_inherit"]
+        })
+        SynoACLTool.setExecutor(executor)
+        try:
+            self.assertEqual(SynoACLSnapshot.create(root, self.fileName), 3)
+
+            executor.acls[path("a")] = [GUEST]
+            executor.archives[path("b")] = ["is_support_ACL"]
+            summary = SynoACLSnapshot.restore(self.fileName)
+            self.assertEqual(summary.changed, [path("a"), path("b")])
+            self.assertEqual(summary.unchanged, [path("")])
+            self.assertEqual(sorted(executor.acls[path("a")]), sorted([ADMINS, GUEST]))
+            self.assertEqual(sorted(executor.archives[path("b")]), ["is_inherit", "is_support_ACL"])
+
+            # the same entries in another order are put back in the recorded order
+            executor.acls[path("a")] = [GUEST, ADMINS]
+            summary = SynoACLSnapshot.restore(self.fileName)
+            self.assertEqual(summary.changed, [path("a")])
+            self.assertEqual(executor.acls[path("a")], [ADMINS, GUEST])
+        finally:
+            SynoACLTool.setExecutor(originalExecutor)
+
+if __name__ == '__main__':
+    unittest.main()
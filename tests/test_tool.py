@@ -1,9 +1,13 @@
 import unittest
+import itertools
 import os
 import shutil
 import subprocess
+import tempfile
 
-from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLTool
+from synoacl.tool import SynoACL, SynoACLSet, SynoACLArchive, SynoACLOperation, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
 
 class TestPermissions(unittest.TestCase):
     NO_RIGHTS = "-------------"
@@ -87,6 +91,47 @@ class TestPermissions(unittest.TestCase):
         permissions2 = SynoACL.Permissions.fromString(TestPermissions.ALL_RIGHTS)
         self.assertNotEqual(permissions1, permissions2)
 
+    def test_hash(self):
+        permissions1 = SynoACL.Permissions(readData = True, writeData = True, execute = True)
+        permissions2 = SynoACL.Permissions.fromString(TestPermissions.RWX_RIGHTS)
+        self.assertEqual(hash(permissions1), hash(permissions2))
+        self.assertEqual(len(set([permissions1, permissions2, SynoACL.Permissions()])), 2)
+
+    def test_setOperations(self):
+        rwx = SynoACL.Permissions.fromString(TestPermissions.RWX_RIGHTS)
+        allRights = SynoACL.Permissions.fromString(TestPermissions.ALL_RIGHTS)
+        rOnly = SynoACL.Permissions(readData = True)
+        pOnly = SynoACL.Permissions(appendData = True)
+
+        self.assertEqual(rwx & allRights, rwx)
+        self.assertEqual(str(rOnly | pOnly), "r--p---------")
+        self.assertTrue(rwx.issubset(allRights))
+        self.assertTrue(rwx <= allRights)
+        self.assertFalse(allRights <= rwx)
+        self.assertTrue(allRights >= rOnly)
+        self.assertFalse(pOnly.issubset(rwx))
+
+    def test_fromStringBadLetter(self):
+        with self.assertRaises(Exception) as cm:
+            SynoACL.Permissions.fromString("rwz----------")
+        self.assertEqual(str(cm.exception), "Unexpected permission letter: 'z'")
+
+    def test_setAttribute(self):
+        permissions = SynoACL.Permissions()
+        permissions.execute = True
+        self.assertEqual(str(permissions), "--x----------")
+        self.assertEqual(permissions.mask, SynoACL.Permissions.EXECUTE)
+        permissions.execute = False
+        self.assertEqual(permissions, SynoACL.Permissions())
+
+    def test_flags(self):
+        Flag = SynoACL.Permissions.Flag
+        permissions = SynoACL.Permissions.fromFlags(Flag.READ_DATA | Flag.EXECUTE)
+        self.assertEqual(str(permissions), "r-x----------")
+        self.assertEqual(permissions.flags, Flag.READ_DATA | Flag.EXECUTE)
+        self.assertIn(Flag.EXECUTE, SynoACL.Permissions.fromString(TestPermissions.RWX_RIGHTS).flags)
+        self.assertIs(SynoACL.Permissions.WRITE_ACL, Flag.WRITE_ACL)
+
 class TestInheritance(unittest.TestCase):
     INHERIT_NOTHING= "---n"
     INHERIT_ALL = "fdi-"
@@ -132,6 +177,17 @@ class TestInheritance(unittest.TestCase):
         inheritance2 = SynoACL.Inheritance.fromString(TestInheritance.INHERIT_NOTHING)
         self.assertNotEqual(inheritance1, inheritance2)
 
+    def test_hash(self):
+        inheritance1 = SynoACL.Inheritance(noPropagate = True)
+        inheritance2 = SynoACL.Inheritance.fromString(TestInheritance.INHERIT_NOTHING)
+        self.assertEqual(hash(inheritance1), hash(inheritance2))
+        self.assertEqual({inheritance1: 1}[inheritance2], 1)
+
+    def test_fromStringBadLetter(self):
+        with self.assertRaises(Exception) as cm:
+            SynoACL.Inheritance.fromString("fdx-")
+        self.assertEqual(str(cm.exception), "Unexpected inheritance letter: 'x'")
+
 class TestSynoACL(unittest.TestCase):
     TEST_ROLE = "user"
     TEST_NAME = "boss"
@@ -191,6 +247,53 @@ class TestSynoACL(unittest.TestCase):
         acl2.inheritMode = SynoACL.Inheritance()
         self.assertNotEqual(acl1, acl2)
 
+    def test_hash(self):
+        aclString = TestSynoACL.TEST_ROLE + ":" + TestSynoACL.TEST_NAME + ":" + \
+            TestSynoACL.TEST_TYPE + ":" + TestSynoACL.TEST_PERMISSIONS + ":" + TestSynoACL.TEST_INHERITANCE
+        acl1 = SynoACL.fromString(aclString)
+        acl2 = SynoACL.fromString(aclString)
+        self.assertEqual(hash(acl1), hash(acl2))
+        self.assertEqual(len(set([acl1, acl2])), 1)
+
+    def test_fromStringBadFormat(self):
+        for aclString in ["user:boss:allow:rwx----------", "user::allow:rwx----------:fd--",
+                "user:boss:allow:rwx----------:fd-- "]:
+            with self.assertRaises(Exception) as cm:
+                SynoACL.fromString(aclString)
+            self.assertIn("does not match the synoacl format", str(cm.exception))
+
+    def test_intern(self):
+        aclString = TestSynoACL.TEST_ROLE + ":" + TestSynoACL.TEST_NAME + ":" + \
+            TestSynoACL.TEST_TYPE + ":" + TestSynoACL.TEST_PERMISSIONS + ":" + TestSynoACL.TEST_INHERITANCE
+        acl1 = SynoACL.intern(aclString)
+        acl2 = SynoACL.intern(aclString)
+        self.assertIs(acl1, acl2)
+        self.assertEqual(acl1, SynoACL.fromString(aclString))
+        self.assertEqual(str(acl1), aclString)
+
+        with self.assertRaises(AttributeError):
+            acl1.role = "other"
+        with self.assertRaises(AttributeError):
+            acl1.permissions.readData = False
+        self.assertEqual(str(acl2), aclString)
+
+        # combining shared flags gives ordinary (mutable) ones
+        for combined in [acl1.permissions & acl2.permissions, acl1.permissions | SynoACL.Permissions()]:
+            self.assertIs(type(combined), SynoACL.Permissions)
+            self.assertEqual(combined, acl1.permissions)
+            combined.readData = not combined.readData
+        self.assertIs(type(acl1.inheritMode | acl2.inheritMode), SynoACL.Inheritance)
+        self.assertEqual(str(acl2), aclString)
+
+        self.assertIs(SynoACL.Permissions.shared(acl1.permissions.mask), acl1.permissions)
+        self.assertIs(SynoACL.Inheritance.shared(acl1.inheritMode.mask), acl1.inheritMode)
+
+    def test_internNonCanonical(self):
+        # the letters are at the wrong positions, str() gives the canonical form
+        acl = SynoACL.intern("user:guest:allow:xwr----------:df--")
+        self.assertEqual(str(acl), "user:guest:allow:rwx----------:fd--")
+        self.assertIs(SynoACL.intern(str(acl)), acl)
+
 class TestSynoACLSet(unittest.TestCase):
     def test_emptyCtor(self):
         acls = SynoACLSet([])
@@ -243,6 +346,65 @@ class TestSynoACLSet(unittest.TestCase):
             self.assertEqual(entry["acl"], testACLs[i]["acl"])
             self.assertEqual(entry["level"], testACLs[i]["level"])
 
+    def test_directNotFirst(self):
+        guest = SynoACL.intern("user:guest:allow:r------------:fd--")
+        admins = SynoACL.intern("group:administrators:allow:rwxpdDaARWc--:fd--")
+        boss = SynoACL.intern("user:boss:allow:rwx----------:fd--")
+        acls = SynoACLSet([guest, admins, boss], [1, 0, 0])
+        self.assertEqual(list(acls.getDirect()), [admins, boss])
+        self.assertEqual(acls.getDirect()[-1], boss)
+        self.assertEqual(acls.getDirect(), [admins, boss])
+        self.assertEqual(list(acls), [admins, boss])
+        with self.assertRaises(IndexError):
+            acls.getDirect()[2]
+        self.assertEqual(list(acls.getEntries()), [(guest, 1), (admins, 0), (boss, 0)])
+
+    def test_eqAndHash(self):
+        guest = "user:guest:allow:r------------:fd--"
+        admins = "group:administrators:allow:rwxpdDaARWc--:fd--"
+        a = SynoACLSet([SynoACL.fromString(guest), SynoACL.fromString(admins)], [0, 1])
+        b = SynoACLSet([SynoACL.intern(guest), SynoACL.intern(admins)], [0, 1])
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, SynoACLSet([SynoACL.fromString(guest), SynoACL.fromString(admins)]))
+        self.assertNotEqual(a, SynoACLSet([SynoACL.fromString(admins), SynoACL.fromString(guest)], [1, 0]))
+        # all levels 0 is the same as no levels
+        self.assertEqual(SynoACLSet([SynoACL.fromString(guest)], [0]), SynoACLSet([SynoACL.fromString(guest)]))
+        self.assertEqual(len(set([a, b, SynoACLSet([]), SynoACLSet([])])), 2)
+        self.assertEqual(len(a), 2)
+
+    def test_immutable(self):
+        acls = SynoACLSet([SynoACL.fromString("user:guest:allow:r------------:fd--")])
+        with self.assertRaises(AttributeError):
+            acls._acls = ()
+        # getAll returns a copy
+        acls.getAll().pop()
+        self.assertEqual(len(acls.getAll()), 1)
+
+    def test_inherited(self):
+        acls = SynoACLSet([
+            SynoACL.fromString("user:guest:allow:rwxpd--------:fd--"),
+            SynoACL.fromString("user:files:allow:r------------:f---"),
+            SynoACL.fromString("user:once:allow:r------------:fd-n"),
+            SynoACL.fromString("user:here:allow:r------------:----"),
+            SynoACL.fromString("group:administrators:allow:rwxpdDaARWc--:fd--"),
+            SynoACL.fromString("group:once:allow:r------------:fd-n")
+        ], [0, 0, 0, 0, 1, 1])
+
+        inherited = acls.inherited()
+        self.assertEqual(len(inherited.getDirect()), 0)
+        self.assertEqual([(str(e["acl"]), e["level"]) for e in inherited.getAll()], [
+            ("user:guest:allow:rwxpd--------:fd--", 1),
+            ("user:once:allow:r------------:fd-n", 1),
+            ("group:administrators:allow:rwxpdDaARWc--:fd--", 2)
+        ])
+
+        inherited = acls.inherited(isDirectory = False)
+        self.assertEqual([e["acl"].name for e in inherited.getAll()], ["guest", "files", "once", "administrators"])
+
+        # inheriting twice drops the noPropagate entries
+        self.assertEqual([e["acl"].name for e in acls.inherited().inherited().getAll()], ["guest", "administrators"])
+
 class TestSynoACLArchive(unittest.TestCase):
     def test_toString(self):
         archive = SynoACLArchive()
@@ -266,11 +428,462 @@ class TestSynoACLArchive(unittest.TestCase):
         self.assertEqual(archive.hasACL, True)
         self.assertEqual(archive.isSupportACL, True)
 
+        # spaces and unknown flags are ignored
+        archive = SynoACLArchive.fromString(" is_read_only, is_something_new,")
+        self.assertEqual(archive, SynoACLArchive(isReadOnly = True))
+        self.assertEqual(str(archive), "is_read_only")
+
+    def test_flags(self):
+        Flag = SynoACLArchive.Flag
+        archive = SynoACLArchive(isInherit = True, isSupportACL = True)
+        self.assertEqual(archive.flags, Flag.IS_INHERIT | Flag.IS_SUPPORT_ACL)
+        self.assertEqual(SynoACLArchive.fromFlags(Flag.IS_INHERIT | Flag.IS_SUPPORT_ACL), archive)
+        self.assertEqual(hash(archive), hash(SynoACLArchive.fromString(str(archive))))
+        archive.isInherit = False
+        self.assertEqual(str(archive), "is_support_ACL")
+        self.assertFalse(archive.isNone())
+        self.assertTrue(SynoACLArchive.fromString("None").isNone())
+
+    def test_planSetArchiveTo(self):
+        existing = SynoACLArchive.fromString("is_inherit,has_ACL,is_support_ACL")
+        requested = SynoACLArchive.fromString("is_read_only,is_support_ACL")
+        (flagsToDrop, flagsToSet) = SynoACLTool.planSetArchiveTo(existing, requested)
+        # has_ACL is left alone
+        self.assertEqual(str(flagsToDrop), "is_inherit")
+        self.assertEqual(str(flagsToSet), "is_read_only")
+
+        (flagsToDrop, flagsToSet) = SynoACLTool.planSetArchiveTo(existing, SynoACLArchive(isInherit = True, isSupportACL = True))
+        self.assertTrue(flagsToDrop.isNone())
+        self.assertTrue(flagsToSet.isNone())
+
+class OutputExecutor(SynoACLExecutor):
+    """An executor that returns canned synoacltool output instead of running it.
+
+    outputs maps (subcommand, path) to the output lines; (subcommand, None)
+    is used for paths that have no entry of their own.
+    """
+    def __init__(self, outputs, concurrency = 4):
+        SynoACLExecutor.__init__(self, concurrency = concurrency)
+        self.outputs = outputs
+        self.calls = []
+
+    def communicate(self, args):
+        self.calls.append(args)
+        for key in [(args[0], args[1]), (args[0], None)]:
+            if key in self.outputs:
+                return self.outputs[key]
+        raise subprocess.CalledProcessError(255, [ "synoacltool" ] + args)
+
+    def communicateStream(self, args):
+        return iter(self.communicate(args))
+
+class ListExecutor(SynoACLExecutor):
+    """An executor that keeps a list of direct ACL entries per path and mimics synoacltool on it.
+
+    The archive flags are kept in archives (path -> list of flag names).
+    """
+    def __init__(self, acls, archives = None):
+        SynoACLExecutor.__init__(self)
+        self.acls = acls
+        self.archives = archives if archives is not None else {}
+        self.calls = []
+
+    def communicate(self, args):
+        self.calls.append(args)
+        command, path = args[0], args[1]
+        if command.endswith("-archive"):
+            flags = self.archives.setdefault(path, [])
+            if command == "-set-archive":
+                flags.extend(f for f in args[2].split(",") if f not in flags)
+            elif command == "-del-archive":
+                flags[:] = [f for f in flags if f not in args[2].split(",")]
+            return ["Archive: " + (",".join(flags) if flags else "None"), ""]
+
+        acls = self.acls.setdefault(path, [])
+        if command == "-add":
+            acls.insert(0, args[2])
+        elif command == "-del":
+            del acls[int(args[2])]
+        elif command == "-replace":
+            acls[int(args[2])] = args[3]
+        return ["\t [%d] %s (level:0)" % (i, acl) for (i, acl) in enumerate(acls)] + [""]
+
+    def communicateStream(self, args):
+        return iter(self.communicate(args))
+
+class TestSynoACLToolAdaptTo(unittest.TestCase):
+    EXISTING = [
+        "user:a:allow:r------------:fd--",
+        "user:b:allow:r------------:fd--",
+        "user:c:allow:r------------:fd--",
+        "user:d:deny:r------------:fd--",
+        "user:e:allow:r------------:fd--"
+    ]
+    REQUESTED = [
+        "user:b:allow:rwx----------:fd--",
+        "user:d:deny:r------------:fd--",
+        "user:e:allow:r------------:----",
+        "user:f:allow:r------------:fd--"
+    ]
+
+    def setUp(self):
+        self.originalExecutor = SynoACLTool.getExecutor()
+        self.executor = ListExecutor({"/p": list(TestSynoACLToolAdaptTo.EXISTING)})
+        SynoACLTool.setExecutor(self.executor)
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.originalExecutor)
+
+    def test_plan(self):
+        existing = [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.EXISTING]
+        requested = [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.REQUESTED]
+        plan = SynoACLTool.planAdaptTo(existing, requested)
+        self.assertEqual([str(op) for op in plan], [
+            "delete [2] user:c:allow:r------------:fd--",
+            "delete [0] user:a:allow:r------------:fd--",
+            "replace [0] user:b:allow:r------------:fd-- -> user:b:allow:rwx----------:fd--",
+            "replace [2] user:e:allow:r------------:fd-- -> user:e:allow:r------------:----",
+            "add user:f:allow:r------------:fd--"
+        ])
+        self.assertEqual(plan[0], SynoACLOperation(SynoACLOperation.DELETE, 2, previous = existing[2]))
+
+        self.assertEqual(SynoACLTool.planAdaptTo(existing, existing), [])
+
+    def test_adaptTo(self):
+        requested = [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.REQUESTED]
+
+        plan = SynoACLTool.adaptTo("/p", requested, dryRun = True)
+        self.assertEqual(len(plan), 5)
+        self.assertEqual(self.executor.acls["/p"], TestSynoACLToolAdaptTo.EXISTING)
+
+        SynoACLTool.adaptTo("/p", requested)
+        # one get and one call per operation
+        self.assertEqual([args[0] for args in self.executor.calls],
+            ["-get", "-get", "-del", "-del", "-replace", "-replace", "-add"])
+        self.assertEqual(sorted(self.executor.acls["/p"]), sorted(TestSynoACLToolAdaptTo.REQUESTED))
+
+        self.assertEqual(SynoACLTool.adaptTo("/p", requested), [])
+
+    def test_adaptToReordered(self):
+        class ReorderingExecutor(ListExecutor):
+            """synoacltool moving the deny entries to the front after each change"""
+            def communicate(self, args):
+                output = ListExecutor.communicate(self, args)
+                if args[0] != "-get":
+                    acls = self.acls[args[1]]
+                    acls.sort(key = lambda acl: ":deny:" not in acl)
+                    output = ListExecutor.communicate(self, ["-get", args[1]])
+                return output
+
+        SynoACLTool.setExecutor(ReorderingExecutor({"/p": list(TestSynoACLToolAdaptTo.EXISTING)}))
+        SynoACLTool.adaptTo("/p", [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.REQUESTED])
+        self.assertEqual(sorted(SynoACLTool.getExecutor().acls["/p"]), sorted(TestSynoACLToolAdaptTo.REQUESTED))
+
+    @staticmethod
+    def simulate(acls, operations):
+        """Perform operations on a list the way synoacltool does (-add puts the entry first)."""
+        acls = list(acls)
+        for operation in operations:
+            if operation.kind == SynoACLOperation.DELETE:
+                assert acls[operation.index] == operation.previous
+                del acls[operation.index]
+            elif operation.kind == SynoACLOperation.REPLACE:
+                assert acls[operation.index] == operation.previous
+                acls[operation.index] = operation.acl
+            else:
+                acls.insert(0, operation.acl)
+        return acls
+
+    @staticmethod
+    def editDistance(existing, requested):
+        """The fewest synoacltool calls turning existing into requested, found by a breadth-first search."""
+        alphabet = set(existing) | set(requested)
+        (start, goal) = (tuple(existing), tuple(requested))
+        maxLength = max(len(start), len(goal))
+        seen = { start }
+        level = [ start ]
+        distance = 0
+        while goal not in seen:
+            nextLevel = []
+            for state in level:
+                successors = [state[:i] + state[i + 1:] for i in range(len(state))]
+                successors += [state[:i] + (acl,) + state[i + 1:] for i in range(len(state)) for acl in alphabet]
+                successors += [(acl,) + state for acl in alphabet if len(state) <= maxLength]
+                for successor in successors:
+                    if successor not in seen:
+                        seen.add(successor)
+                        nextLevel.append(successor)
+            level = nextLevel
+            distance += 1
+        return distance
+
+    def test_compilePolicy(self):
+        existing = [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.EXISTING]
+        requested = [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.REQUESTED]
+        plan = SynoACLTool.compilePolicy(existing, requested)
+        self.assertEqual(TestSynoACLToolAdaptTo.simulate(existing, plan), requested)
+        self.assertEqual(len(plan), 5)
+        self.assertEqual(SynoACLTool.compilePolicy(existing, existing), [])
+
+        (a, b, c, d) = existing[:4]
+        # a new first entry is a single add
+        self.assertEqual([str(op) for op in SynoACLTool.compilePolicy([a, b], [c, a, b])], [ "add " + str(c) ])
+        # the order of the entries matters (planAdaptTo sees no difference here)
+        self.assertEqual(SynoACLTool.planAdaptTo([d, a], [a, d]), [])
+        self.assertEqual([str(op) for op in SynoACLTool.compilePolicy([d, a], [a, d])],
+            [ f"replace [0] {d} -> {a}", f"replace [1] {a} -> {d}" ])
+        # an entry can be replaced by another user's instead of a delete and an add
+        self.assertEqual(len(SynoACLTool.planAdaptTo([a, b], [c])), 3)
+        self.assertEqual([str(op) for op in SynoACLTool.compilePolicy([a, b], [c])],
+            [ f"delete [1] {b}", f"replace [0] {a} -> {c}" ])
+        # the indices take the preceding operations into account
+        plan = SynoACLTool.compilePolicy([a, b, c, d, a], [b, a, d, c, a])
+        self.assertEqual(TestSynoACLToolAdaptTo.simulate([a, b, c, d, a], plan), [b, a, d, c, a])
+
+    def test_compilePolicyMinimal(self):
+        acls = [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.EXISTING[:3]]
+        lists = [[]]
+        for length in range(1, 4):
+            lists += [list(combination) for combination in itertools.product(acls, repeat = length)]
+        for existing in lists:
+            for requested in lists:
+                plan = SynoACLTool.compilePolicy(existing, requested)
+                self.assertEqual(TestSynoACLToolAdaptTo.simulate(existing, plan), requested)
+                self.assertEqual(len(plan), TestSynoACLToolAdaptTo.editDistance(existing, requested),
+                    f"{existing} -> {requested}")
+
+    def test_adaptToOrdered(self):
+        requested = [SynoACL.fromString(s) for s in TestSynoACLToolAdaptTo.REQUESTED]
+        SynoACLTool.adaptTo("/p", requested, ordered = True)
+        self.assertEqual(self.executor.acls["/p"], TestSynoACLToolAdaptTo.REQUESTED)
+        self.assertEqual(len(self.executor.calls), 6)
+        self.assertEqual(SynoACLTool.adaptTo("/p", requested, ordered = True), [])
+
+class TestSynoACLToolBatch(unittest.TestCase):
+    def setUp(self):
+        self.originalExecutor = SynoACLTool.getExecutor()
+        SynoACLTool.setExecutor(OutputExecutor({
+            ("-get", "/a"): [
+                "ACL version: 1",
+                "Archive: is_inherit,is_support_ACL",
+                "Owner: [root(user)]",
+                "---------------------",
+                "\t [0] user:guest:allow:rwxpd--------:fd-- (level:0)",
+                "\t [1] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)",
+                ""
+            ],
+            ("-get", "/b"): [
+                "\t [0] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)",
+                ""
+            ],
+            ("-get", "/bad"): [
+                "\t [1] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)",
+                ""
+            ],
+            ("-get-archive", "/a"): [ "Archive: is_inherit,is_support_ACL", "" ]
+        }))
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.originalExecutor)
+
+    def test_getMany(self):
+        results = SynoACLTool.getMany(["/a", "/b", "/bad", "/none"])
+        self.assertEqual([r.path for r in results], ["/a", "/b", "/bad", "/none"])
+        self.assertEqual([r.ok for r in results], [True, True, False, True])
+        self.assertEqual(len(results[0].value.getAll()), 2)
+        self.assertEqual(len(results[0].value.getDirect()), 1)
+        self.assertEqual(len(results[1].value.getDirect()), 0)
+        # a path without ACLs gives an empty set, just like get()
+        self.assertEqual(len(results[3].value.getAll()), 0)
+
+        with self.assertRaises(Exception):
+            SynoACLTool.getMany(["/a", "/bad"], raiseErrors = True)
+
+    def test_getArchiveMany(self):
+        results = SynoACLTool.getArchiveMany(["/a", "/b"], concurrency = 1)
+        self.assertTrue(results[0].ok)
+        self.assertEqual(str(results[0].value), "is_inherit,is_support_ACL")
+        self.assertTrue(isinstance(results[1].error, subprocess.CalledProcessError))
+
+class ClosableLines:
+    """An iterator over output lines that records whether it was closed (as a subprocess stream would)."""
+    def __init__(self, lines):
+        self.iterator = iter(lines)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.iterator)
+
+    def close(self):
+        self.closed = True
+
+class TestSynoACLToolStreams(unittest.TestCase):
+    LINES = [
+        "\t [0] user:guest:allow:r------------:fd-- (level:0)",
+        "\t [1] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)"
+    ]
+
+    def test_closedAfterParse(self):
+        lines = ClosableLines(TestSynoACLToolStreams.LINES)
+        self.assertEqual(len(SynoACLTool._parseACLResult(lines)), 2)
+        self.assertTrue(lines.closed)
+
+    def test_closedOnParseError(self):
+        # a gap in the indices
+        lines = ClosableLines([ TestSynoACLToolStreams.LINES[1] ] + TestSynoACLToolStreams.LINES)
+        with self.assertRaises(Exception):
+            SynoACLTool._parseACLResult(lines)
+        self.assertTrue(lines.closed)
+
+    def test_iterGetClosedEarly(self):
+        lines = ClosableLines(TestSynoACLToolStreams.LINES)
+        originalExecutor = SynoACLTool.getExecutor()
+        executor = SynoACLExecutor()
+        executor.communicateStream = lambda args: lines
+        SynoACLTool.setExecutor(executor)
+        try:
+            entries = SynoACLTool.iterGet("/p")
+            next(entries)
+            entries.close()
+        finally:
+            SynoACLTool.setExecutor(originalExecutor)
+        self.assertTrue(lines.closed)
+
+class TestSynoACLToolWalk(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for d in ["a", "a/x", "a/y", "b", "b/skip", "b/skip/deep", "c"]:
+            os.mkdir(os.path.join(self.root, d))
+        for f in ["a/file1", "c/file2"]:
+            open(os.path.join(self.root, f), "w").close()
+
+        self.originalExecutor = SynoACLTool.getExecutor()
+        self.executor = OutputExecutor({
+            ("-get", None): [
+                "\t [0] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)",
+                ""
+            ],
+            ("-get-archive", None): [ "Archive: is_inherit,is_support_ACL", "" ]
+        })
+        SynoACLTool.setExecutor(self.executor)
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.originalExecutor)
+        shutil.rmtree(self.root)
+
+    def relativePaths(self, **kwargs):
+        return [os.path.relpath(path, self.root) for (path, archive, acls) in SynoACLTool.walk(self.root, **kwargs)]
+
+    def test_walk(self):
+        self.assertEqual(self.relativePaths(), [".", "a", "a/x", "a/y", "b", "b/skip", "b/skip/deep", "c"])
+
+        for (path, archive, acls) in SynoACLTool.walk(self.root):
+            self.assertTrue(archive.isInherit)
+            self.assertEqual(len(acls.getAll()), 1)
+        # one -get and one -get-archive per path, for each of the two walks
+        self.assertEqual(len(self.executor.calls), 2 * 2 * 8)
+
+    def test_walkFiles(self):
+        self.assertEqual(self.relativePaths(includeFiles = True, concurrency = 1),
+            [".", "a", "a/file1", "a/x", "a/y", "b", "b/skip", "b/skip/deep", "c", "c/file2"])
+
+    def test_walkExclude(self):
+        self.assertEqual(self.relativePaths(exclude = ["skip", "*/a/y"]), [".", "a", "a/x", "b", "c"])
+
+    def test_walkMaxDepth(self):
+        self.assertEqual(self.relativePaths(maxDepth = 0), ["."])
+        self.assertEqual(self.relativePaths(maxDepth = 1), [".", "a", "b", "c"])
+
+    def test_walkErrors(self):
+        del self.executor.outputs[("-get-archive", None)]
+        self.executor.outputs[("-get-archive", os.path.join(self.root, "a"))] = [ "Archive: None", "" ]
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(SynoACLTool.walk(self.root))
+
+        errors = []
+        paths = [path for (path, archive, acls) in
+            SynoACLTool.walk(self.root, maxDepth = 1, onError = lambda path, e: errors.append(path))]
+        self.assertEqual(paths, [os.path.join(self.root, "a")])
+        self.assertEqual(len(errors), 3)
+
+class TestSynoACLToolWalkDerived(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for d in ["inherit", "inherit/deeper", "own", "isolated", "linux"]:
+            os.mkdir(os.path.join(self.root, d))
+
+        def path(p):
+            return os.path.join(self.root, p) if p else self.root
+
+        self.originalExecutor = SynoACLTool.getExecutor()
+        self.executor = OutputExecutor({
+            ("-get-archive", path("")): [ "Archive: has_ACL,is_support_ACL", "" ],
+            ("-get", path("")): [
+                "\t [0] group:administrators:allow:rwxpdDaARWc--:fd-- (level:0)",
+                "\t [1] user:files:allow:r------------:f--- (level:0)",
+                ""
+            ],
+            ("-get-archive", path("inherit")): [ "Archive: is_inherit,is_support_ACL", "" ],
+            ("-get-archive", path("inherit/deeper")): [ "Archive: is_inherit,is_support_ACL", "" ],
+            ("-get-archive", path("own")): [ "Archive: is_inherit,has_ACL,is_support_ACL", "" ],
+            ("-get", path("own")): [
+                "\t [0] user:guest:allow:r------------:fd-- (level:0)",
+                "\t [1] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)",
+                ""
+            ],
+            ("-get-archive", path("isolated")): [ "Archive: is_support_ACL", "" ],
+            ("-get-archive", path("linux")): [ "Archive: None", "" ]
+        })
+        SynoACLTool.setExecutor(self.executor)
+        self.path = path
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.originalExecutor)
+        shutil.rmtree(self.root)
+
+    def test_walkDerived(self):
+        result = dict((path, acls) for (path, archive, acls) in SynoACLTool.walk(self.root, deriveInherited = True))
+
+        getCalls = [args[1] for args in self.executor.calls if args[0] == "-get"]
+        self.assertEqual(sorted(getCalls), sorted([self.path(""), self.path("own")]))
+
+        inherited = result[self.path("inherit")].getAll()
+        self.assertEqual(len(inherited), 1)
+        self.assertEqual(inherited[0]["acl"].name, "administrators")
+        self.assertEqual(inherited[0]["level"], 1)
+        self.assertEqual(result[self.path("inherit/deeper")].getAll()[0]["level"], 2)
+        self.assertEqual(len(result[self.path("own")].getDirect()), 1)
+        self.assertEqual(len(result[self.path("isolated")].getAll()), 0)
+        self.assertEqual(len(result[self.path("linux")].getAll()), 0)
+
+    def test_walkDerivedVerify(self):
+        # everything matches
+        self.executor.outputs[("-get", self.path("inherit"))] = [
+            "\t [0] group:administrators:allow:rwxpdDaARWc--:fd-- (level:1)", "" ]
+        self.executor.outputs[("-get", self.path("inherit/deeper"))] = [
+            "\t [0] group:administrators:allow:rwxpdDaARWc--:fd-- (level:2)", "" ]
+        self.executor.outputs[("-get", None)] = [ "" ]
+        list(SynoACLTool.walk(self.root, deriveInherited = True, verifySample = 1.0))
+        getCalls = [args[1] for args in self.executor.calls if args[0] == "-get"]
+        self.assertEqual(len(getCalls), 5)
+
+        # the derived ACLs don't match
+        self.executor.outputs[("-get", self.path("inherit/deeper"))] = [ "" ]
+        errors = []
+        result = dict((path, acls) for (path, archive, acls) in SynoACLTool.walk(self.root, deriveInherited = True,
+            verifySample = 1.0, onError = lambda path, e: errors.append(path)))
+        self.assertEqual(errors, [self.path("inherit/deeper")])
+        self.assertEqual(len(result[self.path("inherit/deeper")].getAll()), 0)
+
 class TestSynoACLTool(unittest.TestCase):
     """The the SynoACLTool class
 
-    This test can only be run on an actual Synology NAS where there is the
-    "synoacltool" executable.
+    On an actual Synology NAS this runs the "synoacltool" executable;
+    elsewhere it runs against FakeSynoACLBackend.
     """
     def setUp(self):
         self.testRunRoot = os.path.join(os.getcwd(), "test_run_dir")
@@ -278,40 +891,34 @@ class TestSynoACLTool(unittest.TestCase):
             raise Exception("The path '" + self.testRunRoot + "' already exists. Please delete it and run the test again.")
         os.mkdir(self.testRunRoot)
 
+        self.executor = SynoACLTool.getExecutor()
+        if shutil.which("synoacltool") is None:
+            SynoACLTool.setExecutor(SynoACLExecutor(backend = FakeSynoACLBackend(autoCreate = True)))
+
         # set the ACLs and archive flags to a known state
-        fnull = open(os.devnull, 'w')
-        subprocess.call([
-            "synoacltool", "-del-archive", self.testRunRoot, "is_inherit,is_read_only,is_owner_group,is_support_ACL"
-        ], stdout = fnull)
-        subprocess.call([
-            "synoacltool", "-set-archive", self.testRunRoot, "is_support_ACL"
-        ], stdout = fnull) # don't inherit from parents to isolate outside interference
-        subprocess.call([
-            "synoacltool", "-del", self.testRunRoot
-        ], stdout = fnull)
-        subprocess.call([
-            "synoacltool", "-add", self.testRunRoot, "group:administrators:allow:rwxpdDaARWc--:fd--"
-        ], stdout = fnull)
+        self.call(["-del-archive", self.testRunRoot, "is_inherit,is_read_only,is_owner_group,is_support_ACL"])
+        self.call(["-set-archive", self.testRunRoot, "is_support_ACL"]) # don't inherit from parents to isolate outside interference
+        self.call(["-del", self.testRunRoot])
+        self.call(["-add", self.testRunRoot, "group:administrators:allow:rwxpdDaARWc--:fd--"])
 
         self.testDir = os.path.join(self.testRunRoot, "guinea-pig")
         os.mkdir(self.testDir)
-        subprocess.call([
-            "synoacltool", "-del-archive", self.testDir, "is_inherit,is_read_only,is_owner_group,is_support_ACL"
-        ], stdout = fnull)
-        subprocess.call([
-            "synoacltool", "-set-archive", self.testDir, "is_support_ACL,is_inherit"
-        ], stdout = fnull)
-        subprocess.call([
-            "synoacltool", "-del", self.testDir], stdout = fnull)
-        subprocess.call([
-            "synoacltool", "-add", self.testDir, "user:guest:allow:rwxpd--------:fd--"
-        ], stdout = fnull)
+        self.call(["-del-archive", self.testDir, "is_inherit,is_read_only,is_owner_group,is_support_ACL"])
+        self.call(["-set-archive", self.testDir, "is_support_ACL,is_inherit"])
+        self.call(["-del", self.testDir])
+        self.call(["-add", self.testDir, "user:guest:allow:rwxpd--------:fd--"])
         # It seems that the -del above affects the archive flags - it drops is_inherit
-        subprocess.call([
-            "synoacltool", "-set-archive", self.testDir, "is_inherit"
-        ], stdout = fnull)
+        self.call(["-set-archive", self.testDir, "is_inherit"])
+
+    @staticmethod
+    def call(args):
+        try:
+            SynoACLTool._communicate(args)
+        except subprocess.CalledProcessError:
+            pass
 
     def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
         shutil.rmtree(self.testRunRoot)
 
     @staticmethod
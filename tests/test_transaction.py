@@ -0,0 +1,154 @@
+import subprocess
+import unittest
+
+from synoacl.tool import SynoACL, SynoACLArchive, SynoACLTool
+from synoacl.executor import SynoACLExecutor
+from synoacl.fake import FakeSynoACLBackend
+from synoacl.transaction import SynoACLTransaction
+
+ADMINS = "group:administrators:allow:rwxpdDaARWc--:fd--"
+ALICE = "user:alice:allow:rwx----------:fd--"
+BOB = "user:bob:allow:r------------:fd--"
+GUEST = "user:guest:deny:rwxpdDaARWc--:fd--"
+
+def acls(*strings):
+    return [SynoACL.fromString(string) for string in strings]
+
+class FailingBackend(FakeSynoACLBackend):
+    """A fake backend where the commands in failOn (tuples of args) fail."""
+    def __init__(self):
+        FakeSynoACLBackend.__init__(self)
+        self.failOn = set()
+
+    def communicate(self, args):
+        if tuple(args) in self.failOn:
+            raise subprocess.CalledProcessError(1, [ "synoacltool" ] + args)
+        return FakeSynoACLBackend.communicate(self, args)
+
+class TestSynoACLTransaction(unittest.TestCase):
+    def setUp(self):
+        self.executor = SynoACLTool.getExecutor()
+        self.backend = FailingBackend()
+        self.backend.makeDirectory("/share", [ ADMINS ], "is_support_ACL")
+        self.backend.makeDirectory("/share/a", [ ALICE ], "is_support_ACL")
+        self.backend.makeDirectory("/share/b", [ ALICE, BOB ], "is_inherit,is_support_ACL")
+        self.backend.makeDirectory("/share/c", [], "is_inherit,is_support_ACL")
+        SynoACLTool.setExecutor(SynoACLExecutor(backend = self.backend))
+
+    def tearDown(self):
+        SynoACLTool.setExecutor(self.executor)
+
+    def direct(self, path):
+        return [str(acl) for acl in SynoACLTool.get(path).getDirect()]
+
+    def test_commit(self):
+        with SynoACLTransaction() as transaction:
+            transaction.reset("/share/a", acls(ALICE, BOB))
+            transaction.adaptTo("/share/b", acls(ALICE))
+            transaction.setArchiveTo("/share/b", SynoACLArchive(isSupportACL = True))
+        self.assertEqual(transaction.paths(), [ "/share/a", "/share/b" ])
+        # reset keeps the order
+        self.assertEqual(self.direct("/share/a"), [ ALICE, BOB ])
+        self.assertEqual(self.direct("/share/b"), [ ALICE ])
+        self.assertEqual(str(SynoACLTool.getArchive("/share/b")), "has_ACL,is_support_ACL")
+        self.assertEqual([str(operation) for operation in transaction.operations["/share/a"]],
+            [ "replace [0] " + ALICE + " -> " + BOB, "add " + ALICE ])
+        self.assertEqual(transaction.captured["/share/b"][0], acls(ALICE, BOB))
+        self.assertEqual(transaction.rolledBack, [])
+        # one -get and one -get-archive per path to capture the state, one call per changed entry
+        self.assertEqual(self.backend.calls["-add"], 1)
+        self.assertEqual(self.backend.calls["-replace"], 1)
+        self.assertEqual(self.backend.calls["-del"], 1)
+
+        with self.assertRaises(Exception):
+            transaction.commit()
+
+    def test_rollback(self):
+        self.backend.failOn.add(("-add", "/share/c", ADMINS))
+        with self.assertRaises(subprocess.CalledProcessError):
+            with SynoACLTransaction() as transaction:
+                transaction.reset("/share/a", acls(BOB))
+                transaction.setArchiveTo("/share/a", SynoACLArchive(isInherit = True, isSupportACL = True))
+                transaction.reset("/share/b", acls(BOB, GUEST))
+                transaction.reset("/share/c", acls(ALICE, ADMINS))
+
+        self.assertEqual(transaction.rolledBack, [ "/share/c", "/share/b", "/share/a" ])
+        # all back as it was, in the same order
+        self.assertEqual(self.direct("/share/a"), [ ALICE ])
+        self.assertEqual(str(SynoACLTool.getArchive("/share/a")), "has_ACL,is_support_ACL")
+        self.assertEqual(self.direct("/share/b"), [ ALICE, BOB ])
+        self.assertEqual(self.direct("/share/c"), [])
+        self.assertEqual(str(SynoACLTool.getArchive("/share/c")), "is_inherit,is_support_ACL")
+
+    def test_rollbackFailure(self):
+        self.backend.failOn.add(("-replace", "/share/b", "0", GUEST))
+        self.backend.failOn.add(("-replace", "/share/a", "0", ALICE))
+        transaction = SynoACLTransaction()
+        transaction.reset("/share/a", acls(BOB))
+        transaction.reset("/share/b", acls(GUEST))
+        with self.assertRaises(Exception) as cm:
+            transaction.commit()
+        self.assertIn("/share/a", str(cm.exception))
+        self.assertNotIn("/share/b", str(cm.exception))
+        self.assertTrue(isinstance(cm.exception.__cause__, subprocess.CalledProcessError))
+        self.assertEqual(transaction.rolledBack, [ "/share/b" ])
+        self.assertEqual(self.direct("/share/b"), [ ALICE, BOB ])
+
+    def test_errorInBlock(self):
+        with self.assertRaises(KeyError):
+            with SynoACLTransaction() as transaction:
+                transaction.reset("/share/a", acls(BOB))
+                raise KeyError("oops")
+        self.assertEqual(self.direct("/share/a"), [ ALICE ])
+        self.assertEqual(self.backend.calls["-get"], 1)
+
+    def test_dryRun(self):
+        with SynoACLTransaction(dryRun = True) as transaction:
+            transaction.reset("/share/a", acls(BOB))
+        self.assertEqual(len(transaction.operations["/share/a"]), 1)
+        self.assertEqual(self.direct("/share/a"), [ ALICE ])
+
+    def test_restoreOrder(self):
+        # the same entries in another order: planAdaptTo sees no difference
+        SynoACLTransaction._restoreACLs("/share/b", acls(BOB, ALICE))
+        self.assertEqual(self.direct("/share/b"), [ BOB, ALICE ])
+        # the missing entry can simply be added at the front
+        SynoACLTransaction._restoreACLs("/share/a", acls(GUEST, ALICE))
+        self.assertEqual(self.direct("/share/a"), [ GUEST, ALICE ])
+        self.assertEqual(self.backend.calls["-replace"], 2)
+        self.assertEqual(self.backend.calls["-add"], 1)
+
+    def test_applyGroups(self):
+        self.backend.failOn.add(("-add", "/share/c", GUEST))
+        groups = [
+            [ ("/share/a", acls(BOB), None), ("/share/b", acls(BOB), None) ],
+            [ ("/share/a", None, SynoACLArchive(isSupportACL = True, isReadOnly = True)),
+              ("/share/c", acls(GUEST), None) ]
+        ]
+        seen = []
+        summary = SynoACLTransaction.applyGroups(groups, concurrency = 1,
+            progress = lambda group, summary: seen.append(len(group)))
+        self.assertEqual(summary.changed, [ "/share/a", "/share/b" ])
+        self.assertEqual(summary.failed, [ "/share/a", "/share/c" ])
+        self.assertTrue(isinstance(summary.errors["/share/c"], subprocess.CalledProcessError))
+        self.assertEqual(summary.rolledBack, [ "/share/c", "/share/a" ])
+        self.assertEqual(seen, [ 2, 2 ])
+        self.assertEqual(self.direct("/share/a"), [ BOB ])
+        self.assertEqual(str(SynoACLTool.getArchive("/share/a")), "has_ACL,is_support_ACL")
+        self.assertEqual(self.direct("/share/c"), [])
+        self.assertIn("rolled back: 2", str(summary))
+
+    def test_applyGroupsSharedPath(self):
+        self.backend.latency = 0.005
+        groups = [
+            [ ("/share/a", acls(BOB), None), ("/share/c", acls(BOB), None) ],
+            [ ("/share/b", acls(GUEST), None) ],
+            [ ("/share/c", acls(GUEST), None), ("/share/a", acls(GUEST), None) ],
+            [ ("/share/a", acls(ALICE, BOB), None) ]
+        ]
+        summary = SynoACLTransaction.applyGroups(groups, concurrency = 4)
+        self.assertEqual(summary.failed, [])
+        # the groups sharing a path ran one after another, in order
+        self.assertEqual(sorted(self.direct("/share/a")), sorted([ ALICE, BOB ]))
+        self.assertEqual(self.direct("/share/b"), [ GUEST ])
+        self.assertEqual(self.direct("/share/c"), [ GUEST ])